@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""
+Time each stage of the BlastGraphMetrics toolchain on synthetic data.
+
+A data set is generated with syntheticBlast.py and pushed through the same
+functions the command line tools call: BLAST parsing and metric computation,
+organism averages and abc output from blast2graphs.py, connected component
+FASTA splitting, GML export from graphs2gml.py and Rtab scoring from
+mcl2rtab.py. For every stage the wall time, peak resident set size and
+throughput (rows per second) are recorded, and the results are written as
+JSON so that runs can be compared with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+
+# Make the toolchain importable when run from anywhere
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from syntheticBlast import add_dataset_args, write_dataset
+
+
+def main(argv=None):
+    """Where the magic happens!
+
+    The main() function coordinates calls to all of the other functions in this
+    program in the hope that, by their powers combined, useful work will be
+    done.
+    """
+    if argv is None:
+        argv = sys.argv
+
+    args = get_parsed_args()
+
+    if not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+
+    files = write_dataset(prefix=os.path.join(args.workdir, 'synthetic'),
+                          orgs=args.orgs, kogs=args.kogs,
+                          seqs_per_kog=args.seqs_per_kog,
+                          density=args.density, noise=args.noise,
+                          idchar=args.idchar, seed=args.seed)
+
+    stages = run_stages(files=files, workdir=args.workdir,
+                        backend=args.backend, idchar=args.idchar)
+
+    config = vars(args).copy()
+    config['compare'] = args.compare.name if args.compare else None
+    report = dict(config=config, platform=get_platform_info(),
+                  hits=files['hits'], stages=stages)
+
+    print_report(stages, sys.stderr)
+    if args.compare:
+        print_comparison(json.load(args.compare)['stages'], stages,
+                         sys.stderr)
+
+    handle = open(args.out, 'w')
+    json.dump(report, handle, indent=2, sort_keys=True)
+    handle.write('\n')
+    handle.close()
+
+    failed = [stage['stage'] for stage in stages if stage['error']]
+    if failed:
+        sys.stderr.write("Stages failed or skipped: {0}\n".format(
+            ', '.join(failed)))
+        return 1
+    return 0
+
+
+def get_parsed_args():
+    """Parse the command line arguments
+
+    Parameters
+    ----------
+    None, argparse fetches them from user input
+
+    Returns
+    -------
+    args : argparse.Namespace object
+        Contains the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark each stage of the toolchain on a synthetic " +
+                    "all-vs-all BLASTP data set")
+    add_dataset_args(parser)
+    parser.add_argument('--backend', dest='backend', default='numpy',
+                        choices=['networkx', 'numpy'],
+                        help="Graph backend used by blast2graphs.py " +
+                             "[def=numpy]")
+    parser.add_argument('--workdir', dest='workdir', default='bench_data',
+                        help="Directory for the generated and output files " +
+                             "[def=bench_data]")
+    parser.add_argument('--out', dest='out', default='bench_results.json',
+                        help="JSON file for the results " +
+                             "[def=bench_results.json]")
+    parser.add_argument('--compare', dest='compare',
+                        type=argparse.FileType('r'),
+                        help="Results from an earlier run to compare against")
+
+    args = parser.parse_args()
+
+    return args
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of this process so far, in megabytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':  # Bytes on macOS, kilobytes elsewhere
+        return peak / 1048576.0
+    return peak / 1024.0
+
+
+def get_platform_info():
+    """Describe the interpreter and libraries used for a run"""
+    info = dict(python=platform.python_version(), machine=platform.machine(),
+                system=platform.system(), time=time.strftime('%Y-%m-%dT%H:%M'))
+    for module in ('numpy', 'networkx', 'scipy'):
+        try:
+            info[module] = __import__(module).__version__
+        except ImportError:
+            info[module] = None
+    return info
+
+
+def time_stage(stages, name, rows, func, *args, **kwargs):
+    """Run one stage, recording its wall time, peak RSS and throughput
+
+    A stage that raises an exception is recorded with its error message
+    instead of stopping the whole benchmark, and main() exits with a non-zero
+    status once all stages have run.
+
+    Args:
+        stages: A list to which the stage's results are appended
+        name: Name of the stage
+        rows: Number of rows processed, or a function returning it that is
+            called after the stage has run
+        func: The function to time, called with args and kwargs
+
+    Returns:
+        The return value of func, or None if it raised an exception
+    """
+    error = None
+    result = None
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as err:
+        error = '{0}: {1}'.format(type(err).__name__, err)
+    wall = time.time() - start
+
+    if callable(rows):
+        rows = rows() if error is None else None
+
+    stages.append(dict(stage=name, wall_s=wall, rows=rows,
+                       rows_per_s=rows / wall if rows and wall else None,
+                       peak_rss_mb=get_peak_rss_mb(), error=error))
+
+    return result
+
+
+def skip_stage(stages, name, reason):
+    """Record a stage that was not run because a stage it needs failed"""
+    stages.append(dict(stage=name, wall_s=None, rows=None, rows_per_s=None,
+                       peak_rss_mb=None, error='skipped: '+reason))
+
+
+def run_stages(files, workdir, backend, idchar):
+    """Run every benchmarked stage on a synthetic data set
+
+    Returns:
+        A list of dicts, one per stage
+    """
+    import networkx as nx
+    import blast2graphs
+    import graphs2gml
+    import mcl2rtab
+    from edgeStore import EdgeStore
+
+    stages = list()
+    out_pref = os.path.join(workdir, 'bench')
+    metrics = ['nle', 'bit', 'bsr', 'bal']
+    org_ids = set()
+
+    if backend == 'numpy':
+        met_grf = EdgeStore(idchar=idchar)
+    else:
+        met_grf = nx.Graph()
+
+    blast = open(files['blast'])
+    time_stage(stages, 'parse', files['hits'],
+               blast2graphs.get_self_bit_scores_and_org_ids,
+               met_grf=met_grf, blast_handle=blast, idchar=idchar,
+               org_ids=org_ids)
+    blast.seek(0)
+    time_stage(stages, 'metrics', files['hits'], blast2graphs.get_metrics,
+               met_grf=met_grf, blast_handle=blast)
+    blast.close()
+
+    n_edges = lambda: met_grf.number_of_edges()
+
+    avgs_wo = time_stage(stages, 'averages', n_edges,
+                         compute_averages, blast2graphs=blast2graphs,
+                         met_grf=met_grf, metrics=metrics, idchar=idchar,
+                         org_ids=org_ids)
+
+    if avgs_wo is not None:
+        time_stage(stages, 'abc_write', lambda: 16 * n_edges(),
+                   blast2graphs.print_abc_files, met_grf=met_grf,
+                   metrics=metrics, idchar=idchar,
+                   glb_avgs=avgs_wo.nodes['global'], org_avgs=avgs_wo,
+                   raw_pref=out_pref+'_raw', nrm_pref=out_pref+'_nrm')
+    else:
+        skip_stage(stages, 'abc_write', 'averages failed')
+
+    fasta = open(files['fasta'])
+    time_stage(stages, 'component_split', len(met_grf.nodes()),
+               blast2graphs.print_connected_component_fasta_files,
+               met_grf=met_grf, fasta_handle=fasta, out_pref=out_pref)
+    fasta.close()
+
+    time_stage(stages, 'gml_export', files['hits'], export_gml,
+               graphs2gml=graphs2gml, files=files, out_pref=out_pref,
+               idchar=idchar)
+
+    time_stage(stages, 'rtab_scoring', count_lines(files['mcl']),
+               score_rtab, mcl2rtab=mcl2rtab, files=files, out_pref=out_pref)
+
+    return stages
+
+
+def compute_averages(blast2graphs, met_grf, metrics, idchar, org_ids):
+    """Organism and global averages, as computed by blast2graphs.main()"""
+    avgs_wo = blast2graphs.compute_organism_averages(
+        met_grf=met_grf, metrics=metrics, idchar=idchar, org_ids=org_ids)
+    blast2graphs.compute_global_averages(org_avgs=avgs_wo, metrics=metrics)
+    return avgs_wo
+
+
+def export_gml(graphs2gml, files, out_pref, idchar):
+    """Build and write the GML graph, as graphs2gml.main() does"""
+    from edgeRecords import EdgeRecords
+    from graphWriters import write_gml
+
+    records = EdgeRecords(idchar=idchar)
+    blast = open(files['blast'])
+    graphs2gml.get_nodes_from_blast(records=records, blast=blast, bscol=11,
+                                    qlcol=12)
+    blast.close()
+
+    graph_handle = open(files['abc'])
+    graphs2gml.add_edges_from_graph(records=records,
+                                    graph_handle=graph_handle)
+    graph_handle.close()
+
+    mcl_handle = open(files['mcl'])
+    graphs2gml.add_edges_from_clustering(records=records,
+                                         mcl_handle=mcl_handle)
+    mcl_handle.close()
+    records.count_new_coclusters()
+
+    handle = open(out_pref+'.gml', 'w')
+    write_gml(records, handle)
+    handle.close()
+
+
+def score_rtab(mcl2rtab, files, out_pref):
+    """Score a clustering and write its Rtab rows, as mcl2rtab.main() does"""
+    from labelIndex import LabelIndex
+
+    summary_handle = open(out_pref+"_kog_summary.Rtab", 'w')
+
+    mcl_file = open(files['mcl'])
+    mcl_name, mcl_properties, kogs_per_cluster, clusters_per_kog, scores, \
+        cluster_kogs = mcl2rtab.score_clustering_file(mcl_file, LabelIndex())
+    mcl_file.close()
+
+    mcl2rtab.print_histogram(summary_handle, 'KOGsPerCluster',
+                             kogs_per_cluster, mcl_properties)
+    mcl2rtab.print_histogram(summary_handle, 'ClustersPerKOG',
+                             clusters_per_kog, mcl_properties)
+    summary_handle.close()
+
+
+def count_lines(path):
+    handle = open(path)
+    count = sum(1 for line in handle)
+    handle.close()
+    return count
+
+
+def print_report(stages, handle):
+    """Print a table of stage timings"""
+    handle.write("{0:<16}{1:>10}{2:>12}{3:>14}{4:>12}\n".format(
+        'stage', 'wall_s', 'rows', 'rows/s', 'peak_MB'))
+    for stage in stages:
+        if stage['error']:
+            handle.write("{0:<16}  ERROR {1}\n".format(stage['stage'],
+                                                       stage['error']))
+            continue
+        handle.write("{0:<16}{1:>10.3f}{2:>12}{3:>14.0f}{4:>12.1f}\n".format(
+            stage['stage'], stage['wall_s'], stage['rows'],
+            stage['rows_per_s'] or 0, stage['peak_rss_mb']))
+
+
+def print_comparison(old_stages, new_stages, handle):
+    """Print the speedup of each stage relative to an earlier run
+
+    Stages that failed, were skipped or are missing from either run are listed
+    with the reason instead of a speedup.
+    """
+    old = dict((stage['stage'], stage) for stage in old_stages)
+    new_names = set(stage['stage'] for stage in new_stages)
+    handle.write("\n{0:<16}{1:>10}{2:>10}{3:>10}\n".format(
+        'stage', 'old_s', 'new_s', 'speedup'))
+    for stage in new_stages:
+        prev = old.get(stage['stage'])
+        if prev is None:
+            reason = 'not in old run'
+        elif prev['error']:
+            reason = 'old ' + prev['error']
+        elif stage['error']:
+            reason = 'new ' + stage['error']
+        else:
+            reason = None
+        if reason is not None:
+            handle.write("{0:<16}  {1}\n".format(stage['stage'], reason))
+            continue
+        speedup = prev['wall_s'] / stage['wall_s'] if stage['wall_s'] else 0
+        handle.write("{0:<16}{1:>10.3f}{2:>10.3f}{3:>9.2f}x\n".format(
+            stage['stage'], prev['wall_s'], stage['wall_s'], speedup))
+    for stage in old_stages:
+        if stage['stage'] not in new_names:
+            handle.write("{0:<16}  not in new run\n".format(stage['stage']))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""
+Deterministic synthetic all-vs-all BLAST data for benchmarking.
+
+Generates a FASTA file of sequences grouped into KOGs, the matching
+'-outfmt "7 std qlen slen"' BLASTP output (including a full-length self-hit
+for every sequence), an MCL-style .abc graph and an MCL clustering, all
+named so that blast2graphs.py, graphs2gml.py and mcl2rtab.py accept them.
+"""
+
+import sys
+import random
+import argparse
+
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def main(argv=None):
+    """Where the magic happens!
+
+    The main() function coordinates calls to all of the other functions in this
+    program in the hope that, by their powers combined, useful work will be
+    done.
+    """
+    if argv is None:
+        argv = sys.argv
+
+    args = get_parsed_args()
+
+    files = write_dataset(prefix=args.prefix, orgs=args.orgs, kogs=args.kogs,
+                          seqs_per_kog=args.seqs_per_kog,
+                          density=args.density, noise=args.noise,
+                          idchar=args.idchar, seed=args.seed)
+
+    for name, path in sorted(files.items()):
+        if name != 'hits':  # The number of hit lines, not a file
+            sys.stdout.write(path+'\n')
+
+
+def get_parsed_args():
+    """Parse the command line arguments
+
+    Parameters
+    ----------
+    None, argparse fetches them from user input
+
+    Returns
+    -------
+    args : argparse.Namespace object
+        Contains the parsed command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic all-vs-all BLASTP data set, with " +
+                    "matching FASTA, abc and MCL files, for benchmarking")
+    add_dataset_args(parser)
+    parser.add_argument('prefix',
+                        help="Prefix for the generated files")
+
+    args = parser.parse_args()
+
+    return args
+
+
+def add_dataset_args(parser):
+    """Add the options describing a synthetic data set to an argparse parser
+    """
+    parser.add_argument('--orgs', dest='orgs', type=int, default=8,
+                        help="Number of organisms [def=8]")
+    parser.add_argument('--kogs', dest='kogs', type=int, default=500,
+                        help="Number of KOGs [def=500]")
+    parser.add_argument('--seqs_per_kog', dest='seqs_per_kog', type=int,
+                        default=10,
+                        help="Sequences in each KOG, spread across the " +
+                             "organisms [def=10]")
+    parser.add_argument('--density', dest='density', type=float, default=0.6,
+                        help="Fraction of the other sequences in the same " +
+                             "KOG hit by each query [def=0.6]")
+    parser.add_argument('--noise', dest='noise', type=int, default=2,
+                        help="Spurious hits to other KOGs per query [def=2]")
+    parser.add_argument('--idchar', dest='idchar', default='|',
+                        help="Character separating the organism ID from " +
+                             "the rest of each sequence ID [def='|']")
+    parser.add_argument('--seed', dest='seed', type=int, default=42,
+                        help="Random seed [def=42]")
+
+
+def make_sequences(orgs, kogs, seqs_per_kog, idchar, rng):
+    """Create sequence records grouped by KOG
+
+    IDs follow the ECK format "<org><idchar><seq>___KOG<nnnn>".
+
+    Returns:
+        A list (one entry per KOG) of lists of (seq_id, length) tuples
+    """
+    org_ids = ['Org{0:03d}'.format(i) for i in range(orgs)]
+    groups = list()
+    for kog in range(kogs):
+        group = list()
+        for i in range(seqs_per_kog):
+            seq_id = '{0}{1}s{2}_{3}___KOG{4:04d}'.format(
+                org_ids[i % orgs], idchar, kog, i, kog % 10000)
+            group.append((seq_id, rng.randint(80, 800)))
+        groups.append(group)
+    return groups
+
+
+def format_evalue(evalue):
+    """Format an E-value the way BLAST+ tabular output does"""
+    if evalue < 1.0e-180:
+        return "0.0"
+    elif evalue < 0.0009:
+        return "{0:.0e}".format(evalue)
+    elif evalue < 0.1:
+        return "{0:.3f}".format(evalue)
+    elif evalue < 1.0:
+        return "{0:.2f}".format(evalue)
+    elif evalue < 10.0:
+        return "{0:.1f}".format(evalue)
+    return "{0:.0f}".format(evalue)
+
+
+def hit_line(qry_id, qry_len, ref_id, ref_len, strength, rng):
+    """Format one tabular BLAST hit with a plausible alignment"""
+    aln_len = max(10, int(min(qry_len, ref_len) * strength))
+    qry_beg = rng.randint(1, qry_len - aln_len + 1)
+    ref_beg = rng.randint(1, ref_len - aln_len + 1)
+    bit = aln_len * 2.0 * strength
+    evalue = 10 ** -(bit / 4.0) * rng.uniform(1, 9)
+    return "{0}\t{1}\t{2:.2f}\t{3}\t{4}\t0\t{5}\t{6}\t{7}\t{8}\t{9}\t{10:.1f}" \
+           "\t{11}\t{12}\n".format(
+               qry_id, ref_id, 100 * strength, aln_len,
+               int(aln_len * (1 - strength)), qry_beg, qry_beg + aln_len - 1,
+               ref_beg, ref_beg + aln_len - 1, format_evalue(evalue), bit,
+               qry_len, ref_len)
+
+
+def write_dataset(prefix, orgs=8, kogs=500, seqs_per_kog=10, density=0.6,
+                  noise=2, idchar='|', seed=42):
+    """Write a synthetic data set
+
+    File names carry the tags that mcl2rtab.py and graphs2gml.py parse out of
+    file names (ordering, fragmentation, E-value cutoff, normalization,
+    dimensionality, metric and inflation).
+
+    Returns:
+        A dict with the path of each file written ('fasta', 'blast', 'abc',
+            'mcl') and the number of BLAST hit lines ('hits')
+    """
+    rng = random.Random(seed)
+    groups = make_sequences(orgs, kogs, seqs_per_kog, idchar, rng)
+    all_seqs = [seq for group in groups for seq in group]
+
+    base = '{0}_ord_evn_1e-5'.format(prefix)
+    files = dict(fasta=base+'.fasta', blast=base+'.blastp',
+                 abc=base+'_raw_dmnd_bit.abc',
+                 mcl=base+'_raw_dmnd_bit_I20.mcl')
+
+    fasta_handle = open(files['fasta'], 'w')
+    for seq_id, seq_len in all_seqs:
+        fasta_handle.write('>{0}\n{1}\n'.format(
+            seq_id, ''.join(rng.choice(AMINO_ACIDS) for i in range(seq_len))))
+    fasta_handle.close()
+
+    blast_handle = open(files['blast'], 'w')
+    abc_handle = open(files['abc'], 'w')
+    blast_handle.write("# BLASTP 2.2.28+\n")
+    hits = 0
+
+    for group in groups:
+        for qry_id, qry_len in group:
+            blast_handle.write("# Query: {0}\n".format(qry_id))
+            blast_handle.write(
+                "# Fields: query id, subject id, % identity, alignment " +
+                "length, mismatches, gap opens, q. start, q. end, s. start, " +
+                "s. end, evalue, bit score, query length, subject length\n")
+
+            lines = [hit_line(qry_id, qry_len, qry_id, qry_len, 1.0, rng)]
+            others = [seq for seq in group if seq[0] != qry_id]
+            targets = rng.sample(others, int(round(density * len(others))))
+            for ref_id, ref_len in targets:
+                lines.append(hit_line(qry_id, qry_len, ref_id, ref_len,
+                                      rng.uniform(0.3, 0.9), rng))
+            for i in range(noise):
+                ref_id, ref_len = rng.choice(all_seqs)
+                if ref_id == qry_id:
+                    continue
+                lines.append(hit_line(qry_id, qry_len, ref_id, ref_len,
+                                      rng.uniform(0.1, 0.3), rng))
+
+            blast_handle.write("# {0} hits found\n".format(len(lines)))
+            blast_handle.writelines(lines)
+            hits += len(lines)
+
+            for line in lines[1:]:
+                temp = line.split('\t')
+                abc_handle.write('{0}\t{1}\t{2}\n'.format(
+                    temp[0], temp[1], temp[11]))
+
+    blast_handle.close()
+    abc_handle.close()
+
+    # One cluster per KOG, with a few sequences moved to the wrong cluster
+    clusters = [[seq_id for seq_id, seq_len in group] for group in groups]
+    for i in range(len(all_seqs) // 20):
+        src = rng.choice(clusters)
+        if len(src) > 1:
+            rng.choice(clusters).append(src.pop(rng.randrange(len(src))))
+    mcl_handle = open(files['mcl'], 'w')
+    for cluster in sorted(clusters, key=len, reverse=True):
+        if cluster:
+            mcl_handle.write('\t'.join(cluster)+'\n')
+    mcl_handle.close()
+
+    files['hits'] = hits
+
+    return files
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,12 +3,32 @@
 # Standard Python libraries
 from sys import stderr
 import sys
+import os
 import argparse
+import math
+import operator
+import multiprocessing
+from collections import OrderedDict
 from decimal import Decimal
+from array import array
+try:
+    from sys import intern
+except ImportError:  # Python 2 keeps intern() as a builtin
+    pass
 
 # Third-party libraries
+import numpy as np
 import networkx as nx
 
+# Local modules
+from edgeStore import EdgeStore
+from blastReader import BlastReader, decode_ids, encode_ids
+from runStats import RunStats
+from hitFilter import HitFilter
+from graphCache import GraphCache
+from compressedFiles import (InputFileType, open_output, get_output_name,
+                             rewind_input)
+
 
 def main(argv=None):
     """Where the magic happens!
@@ -29,36 +49,339 @@ def main(argv=None):
     args = get_parsed_args()
     #TODO: validate data columns when headers are present
 
-    met_grf = nx.Graph()  # NetworkX graph with various BLAST-based metrics
-    org_ids = set()
+    stats = RunStats(progress=args.profile, interval=args.progress_interval,
+                     cprofile=args.cprofile, prof_pref=str(args.out_pref))
+
     metrics = ['nle', 'bit', 'bsr', 'bal']
 
-    get_self_bit_scores_and_org_ids(met_grf=met_grf, blast_handle=args.blast,
-                                    idchar=args.idchar, org_ids=org_ids,
-                                    qlcol=args.qlcol-1, slcol=args.slcol-1)
+    # Hits failing any of these are dropped as the BLAST file is parsed
+    hit_filter = HitFilter(max_evalue=args.max_evalue, min_bit=args.min_bit,
+                           min_qcov=args.min_qcov, min_scov=args.min_scov,
+                           top_hits=args.top_hits, min_bsr=args.min_bsr,
+                           qlcol=args.qlcol-1, slcol=args.slcol-1)
+
+    # Parsed graphs are cached by BLAST file and parsing options
+    cache = None
+    if args.cache_dir and os.path.isfile(args.blast.name):
+        cache = GraphCache(args.cache_dir,
+                           max_bytes=int(args.cache_size * 1048576))
+        cache_key = cache.get_key(
+            args.blast.name, program='blast2graphs', qlcol=args.qlcol,
+            slcol=args.slcol, idchar=args.idchar,
+            max_evalue=args.max_evalue, min_bit=args.min_bit,
+            min_bsr=args.min_bsr, min_qcov=args.min_qcov,
+            min_scov=args.min_scov, top_hits=args.top_hits)
+    elif args.cache_dir:
+        stderr.write("Can not cache {0}, it is not a regular file\n"
+                     .format(args.blast.name))
+
+    arrays = None if cache is None else cache.load(cache_key)
+
+    if arrays is not None:
+        with stats.stage('cache_load') as rec:
+            met_grf, org_ids = load_graph_arrays(
+                arrays=arrays, backend=args.backend, idchar=args.idchar)
+            rec['rows'] = met_grf.number_of_edges()
+        stats.count('cache_hits')
+
+    else:
+        # Graph with various BLAST-based metrics
+        if args.backend == 'numpy':
+            met_grf = EdgeStore(idchar=args.idchar)
+        else:
+            met_grf = nx.Graph()
+        org_ids = set()
+
+        parse_blast_file(met_grf=met_grf, org_ids=org_ids, args=args,
+                         hit_filter=hit_filter, stats=stats)
+        stats.update(hit_filter.counts)
+
+        if cache is not None:
+            with stats.stage('cache_save') as rec:
+                cache.save(cache_key, get_graph_arrays(
+                    met_grf=met_grf, org_ids=org_ids, metrics=metrics),
+                    blast=os.path.abspath(args.blast.name))
+                rec['rows'] = met_grf.number_of_edges()
+
+    if not args.evalue_cutoffs:
+        print_graphs(met_grf, metrics=metrics, org_ids=org_ids, args=args,
+                     out_pref=str(args.out_pref), stats=stats)
+
+    # Graphs for stricter E-value cutoffs are thresholded from this one
+    for i, cutoff in enumerate(args.evalue_cutoffs or []):
+        with stats.stage('subgraph', cutoff) as rec:
+            cut_grf = get_evalue_subgraph(met_grf=met_grf, cutoff=cutoff)
+            rec['rows'] = cut_grf.number_of_edges()
+
+        if args.fasta and i > 0:
+            args.fasta = rewind_input(args.fasta)
+
+        print_graphs(cut_grf, metrics=metrics, org_ids=org_ids, args=args,
+                     out_pref=str(args.out_pref)+"_"+cutoff, stats=stats,
+                     label=cutoff)
+        del cut_grf
+
+    if args.profile:
+        stats.print_summary()
+    if args.stats_json:
+        stats.write_json(args.stats_json)
+
+
+def parse_blast_file(met_grf, org_ids, args, hit_filter, stats):
+    """Read the self bit scores and best hits from the BLAST file
+
+    Uses two passes over the file, a single pass for pipes, stdin and
+    compressed files (or with --one_pass), or a pool of worker processes
+    (with --workers).
+
+    Args:
+        met_grf: An empty NetworkX graph or EdgeStore
+        org_ids: A Python set variable to which organism IDs will be added
+        args: The parsed command line arguments
+        hit_filter: A HitFilter object applied to the hits as they are read
+        stats: A RunStats object in which each stage is timed
 
-    args.blast.seek(0)
+    Returns:
+        Nothing, the graph and organism IDs set are edited in place
+    """
+    compressed = getattr(args.blast, 'compression', None) is not None
+
+    # Shards are read independently, so they must come from a regular,
+    # uncompressed file
+    if args.workers > 1 and (compressed or
+                             not os.path.isfile(args.blast.name)):
+        stderr.write("Can not split {0} into shards, using one worker\n"
+                     .format(args.blast.name))
+        args.workers = 1
+
+    if args.workers > 1:
+        with stats.stage('parse') as rec:
+            hits = get_self_bit_scores_and_hits_parallel(
+                met_grf=met_grf, blast_path=args.blast.name,
+                workers=args.workers, idchar=args.idchar, org_ids=org_ids,
+                qlcol=args.qlcol-1, slcol=args.slcol-1,
+                chunk_size=args.chunk_size, stats=stats,
+                hit_filter=hit_filter)
+            rec['rows'] = stats.counts.get('lines', 0)
+            rec['bytes'] = stats.counts.get('bytes', 0)
+
+        with stats.stage('add_hits') as rec:
+            add_buffered_hits(met_grf=met_grf, hits=hits, stats=stats,
+                              hit_filter=hit_filter)
+            rec['rows'] = len(hits[0])
+
+    # Pipes and stdin can only be read once, and compressed files are not
+    # worth decompressing twice
+    elif args.one_pass or compressed or not is_seekable(args.blast):
+        with stats.stage('parse') as rec:
+            hits = get_self_bit_scores_and_hits(
+                met_grf=met_grf, blast_handle=args.blast, idchar=args.idchar,
+                org_ids=org_ids, qlcol=args.qlcol-1, slcol=args.slcol-1,
+                chunk_size=args.chunk_size, stats=stats,
+                hit_filter=hit_filter)
+            rec['rows'] = stats.counts.get('lines', 0)
+            rec['bytes'] = stats.counts.get('bytes', 0)
+
+        with stats.stage('add_hits') as rec:
+            add_buffered_hits(met_grf=met_grf, hits=hits, stats=stats,
+                              hit_filter=hit_filter)
+            rec['rows'] = len(hits[0])
 
-    get_metrics(met_grf=met_grf, blast_handle=args.blast,
-                qlcol=args.qlcol-1, slcol=args.slcol-1)
+    else:
+        with stats.stage('self_scores') as rec:
+            get_self_bit_scores_and_org_ids(
+                met_grf=met_grf, blast_handle=args.blast, idchar=args.idchar,
+                org_ids=org_ids, qlcol=args.qlcol-1, slcol=args.slcol-1,
+                stats=stats)
+            rec['rows'] = stats.counts.get('lines', 0)
+            rec['bytes'] = stats.counts.get('bytes', 0)
 
-    avgs_wo = compute_organism_averages(
-        met_grf=met_grf, metrics=metrics, idchar=args.idchar, org_ids=org_ids)
+        args.blast.seek(0)
 
-    compute_global_averages(org_avgs=avgs_wo, metrics=metrics)
+        with stats.stage('metrics') as rec:
+            get_metrics(met_grf=met_grf, blast_handle=args.blast,
+                        qlcol=args.qlcol-1, slcol=args.slcol-1, stats=stats,
+                        hit_filter=hit_filter)
+            rec['rows'] = stats.counts.get('lines', 0)
+            rec['bytes'] = stats.counts.get('bytes', 0)
 
-    print_unnormalized_abc_files(met_grf=met_grf, metrics=metrics,
-                                 glb_avgs=avgs_wo.node['global'],
-                                 out_pref=str(args.out_pref)+"_raw")
 
-    print_normalized_abc_files(met_grf=met_grf, metrics=metrics,
-                               idchar=args.idchar, org_avgs=avgs_wo,
-                               out_pref=str(args.out_pref)+"_nrm")
+def print_graphs(met_grf, metrics, org_ids, args, out_pref, stats,
+                 label=None):
+    """Compute the averages for a graph and write all of the requested files
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore containing the best hits
+        metrics: An ordered list of the metrics stored for each hit
+        org_ids: A set containing each organism ID
+        args: The parsed command line arguments
+        out_pref: Prefix for the output files
+        stats: A RunStats object in which each stage is timed
+        label: Appended to the stage names (eg. the E-value cutoff)
+
+    Returns:
+        Nothing, all output is written to files
+    """
+    with stats.stage('averages', label) as rec:
+        avgs_wo = compute_organism_averages(
+            met_grf=met_grf, metrics=metrics, idchar=args.idchar,
+            org_ids=org_ids)
+
+        compute_global_averages(org_avgs=avgs_wo, metrics=metrics)
+        rec['rows'] = met_grf.number_of_edges()
+
+    # Raw and normalized files are written from one traversal of the edges
+    with stats.stage('abc', label) as rec:
+        print_abc_files(met_grf=met_grf, metrics=metrics, idchar=args.idchar,
+                        glb_avgs=avgs_wo.nodes['global'], org_avgs=avgs_wo,
+                        raw_pref=out_pref+"_raw", nrm_pref=out_pref+"_nrm",
+                        compress=args.compress,
+                        threads=args.compress_threads)
+        rec['rows'] = met_grf.number_of_edges()
+
+    if args.mci:
+        with stats.stage('mci', label) as rec:
+            print_mci_files(met_grf=met_grf, metrics=metrics,
+                            glb_avgs=avgs_wo.nodes['global'],
+                            tab_path=out_pref+".tab",
+                            idchar=args.idchar, org_avgs=avgs_wo,
+                            raw_pref=out_pref+"_raw",
+                            nrm_pref=out_pref+"_nrm", compress=args.compress,
+                            threads=args.compress_threads)
+            rec['rows'] = met_grf.number_of_edges()
+
+    if args.inflations:
+        with stats.stage('mcl', label):
+            run_mcl_sweep(met_grf=met_grf, metrics=metrics,
+                          glb_avgs=avgs_wo.nodes['global'],
+                          inflations=args.inflations,
+                          variants=args.mcl_variants, idchar=args.idchar,
+                          org_avgs=avgs_wo, raw_pref=out_pref+"_raw",
+                          nrm_pref=out_pref+"_nrm", processes=args.mcl_jobs,
+                          compress=args.compress)
 
     if args.fasta:
-        print_connected_component_fasta_files(met_grf=met_grf,
-                                              fasta_handle=args.fasta,
-                                              out_pref=args.out_pref)
+        with stats.stage('fasta', label) as rec:
+            print_connected_component_fasta_files(met_grf=met_grf,
+                                                  fasta_handle=args.fasta,
+                                                  out_pref=out_pref,
+                                                  compress=args.compress,
+                                                  threads=args.compress_threads)
+            rec['rows'] = len(met_grf.nodes())
+
+
+def get_graph_arrays(met_grf, org_ids, metrics):
+    """Collect the nodes, best hits and organism IDs of a graph as arrays
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore containing the best hits
+        org_ids: A set containing each organism ID
+        metrics: An ordered list of the metrics stored for each hit
+
+    Returns:
+        A dict of arrays that load_graph_arrays() turns back into a graph:
+            'seq_ids' and 'sbs' (one row per sequence), 'src', 'dst' and one
+            array per metric (one row per best hit), and 'org_ids'
+    """
+    if isinstance(met_grf, EdgeStore):
+        seq_ids = met_grf.seq_ids
+        arrays = dict(sbs=met_grf.sbs[:len(seq_ids)],
+                      src=met_grf.column('src'), dst=met_grf.column('dst'))
+        for met in metrics:
+            arrays[met] = met_grf.column(met)
+
+    else:
+        seq_ids = list(met_grf.nodes())
+        seq_idx = dict((seq_id, i) for i, seq_id in enumerate(seq_ids))
+        edges = [(qry_id, ref_id, edata) for qry_id, ref_id, edata in
+                 met_grf.edges(data=True) if qry_id != ref_id]
+        arrays = dict(
+            sbs=np.array([met_grf.nodes[seq_id]['sbs'] for seq_id in seq_ids],
+                         dtype=np.float64),
+            src=np.array([seq_idx[edge[0]] for edge in edges],
+                         dtype=np.int32),
+            dst=np.array([seq_idx[edge[1]] for edge in edges],
+                         dtype=np.int32))
+        for met in metrics:
+            arrays[met] = np.array([edge[2][met] for edge in edges],
+                                   dtype=np.float64)
+
+    arrays['seq_ids'] = encode_ids(seq_ids)
+    arrays['org_ids'] = encode_ids(sorted(org_ids))
+
+    return arrays
+
+
+def load_graph_arrays(arrays, backend, idchar):
+    """Rebuild a graph from the arrays returned by get_graph_arrays()
+
+    Args:
+        arrays: A dict of arrays (eg. loaded from a GraphCache)
+        backend: 'numpy' for an EdgeStore or 'networkx' for a NetworkX graph
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID
+
+    Returns:
+        met_grf: A NetworkX graph or EdgeStore
+        org_ids: A set containing each organism ID
+    """
+    seq_ids = decode_ids(arrays['seq_ids'])
+    org_ids = set(decode_ids(arrays['org_ids']))
+    metrics = EdgeStore.metrics
+
+    if backend == 'numpy':
+        met_grf = EdgeStore.from_arrays(
+            seq_ids=seq_ids, sbs=arrays['sbs'], src=arrays['src'],
+            dst=arrays['dst'],
+            cols=dict((met, arrays[met]) for met in metrics), idchar=idchar)
+        return met_grf, org_ids
+
+    met_grf = nx.Graph()
+    for seq_id, bit_scr in zip(seq_ids, arrays['sbs'].tolist()):
+        if bit_scr == bit_scr:  # Not NaN
+            met_grf.add_node(seq_id, sbs=bit_scr)
+
+    cols = [arrays[met].tolist() for met in metrics]
+    for row, (u, v) in enumerate(zip(arrays['src'].tolist(),
+                                     arrays['dst'].tolist())):
+        met_grf.add_edge(seq_ids[u], seq_ids[v],
+                         **dict((met, col[row]) for met, col in
+                                zip(metrics, cols)))
+
+    return met_grf, org_ids
+
+
+def get_evalue_subgraph(met_grf, cutoff):
+    """Keep only the best hits with E-values no larger than a cutoff
+
+    This stands in for re-running BLAST with a stricter E-value cutoff. The
+    two differ only for pairs of sequences whose best hit (the one with the
+    largest bit score) fails the cutoff while another of their hits (eg. the
+    reciprocal one, which is scored against a different query length)
+    passes it, which are dropped here. Every node (and self bit score) is
+    kept.
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore containing the best hits
+        cutoff: The E-value cutoff, as a string (eg. "1e-10")
+
+    Returns:
+        A new graph of the same type as met_grf
+    """
+    # Converted exactly as the E-values themselves were
+    min_nle = compute_nle_array([cutoff])[0]
+
+    if isinstance(met_grf, EdgeStore):
+        return met_grf.edge_subgraph(met_grf.column('nle') >= min_nle)
+
+    cut_grf = nx.Graph()
+    cut_grf.add_nodes_from(met_grf.nodes(data=True))
+    cut_grf.add_edges_from((qry_id, ref_id, dict(edata))
+                           for qry_id, ref_id, edata in
+                           met_grf.edges(data=True)
+                           if edata['nle'] >= min_nle)
+
+    return cut_grf
 
 
 def get_parsed_args():
@@ -81,9 +404,10 @@ def get_parsed_args():
                     'query length, subject length')
 
     # Group: IO options
-    parser.add_argument('blast', type=argparse.FileType('r'),
+    parser.add_argument('blast', type=InputFileType('r'),
                         help='Tab-delimited BLAST file (comment lines are ' +
-                             'okay)')
+                             'okay, use "-" to read from stdin), which may ' +
+                             'be compressed with gzip, bzip2 or zstd')
     parser.add_argument('out_pref',
                         help='Prefix for the MCL-compatible "abc" graph files')
 
@@ -102,10 +426,135 @@ def get_parsed_args():
                         help='The character used to separate the organism ' +
                              'ID from the rest of the sequence header ' +
                              '[def="|"]')
-    parser.add_argument('--fasta', dest='fasta', type=argparse.FileType('r'),
+    parser.add_argument('--fasta', dest='fasta', type=InputFileType('r'),
                         help='FASTA file used to generate BLAST results, ' +
                              'will be split into connected components and ' +
                              'reprinted, one file per connected component')
+    parser.add_argument('--mci', dest='mci', action='store_true',
+                        default=False,
+                        help='Also write each graph in MCL\'s native matrix ' +
+                             'format (.mci), along with a single tab file ' +
+                             'of node labels, so MCL does not need to ' +
+                             're-parse the abc file for every run')
+    parser.add_argument('--compress', dest='compress', action='store',
+                        default=None, choices=['gz', 'bz2', 'zst'],
+                        help='Compress the abc, mci, tab, clustering and ' +
+                             'FASTA output files with gzip, bzip2 or zstd ' +
+                             '(the external mcl program needs uncompressed ' +
+                             'graphs) [def=None]')
+    parser.add_argument('--compress_threads', dest='compress_threads',
+                        action='store', type=int, default=4,
+                        help='Number of threads compressing each output ' +
+                             'file [def=4]')
+
+    # Group: Filtering options
+    parser.add_argument('--max_evalue', dest='max_evalue',
+                        action='store', type=float, default=None,
+                        help='Drop hits with larger E-values while parsing ' +
+                             '(stricter than the BLAST -evalue cutoff)')
+    parser.add_argument('--min_bit', dest='min_bit',
+                        action='store', type=float, default=None,
+                        help='Drop hits with smaller bit scores')
+    parser.add_argument('--min_bsr', dest='min_bsr',
+                        action='store', type=float, default=None,
+                        help='Drop hits with smaller bit score ratios ' +
+                             '(counted per pair of sequences in the ' +
+                             'filtered_bsr_pairs statistic)')
+    parser.add_argument('--min_qcov', dest='min_qcov',
+                        action='store', type=float, default=None,
+                        help='Drop hits whose alignment covers a smaller ' +
+                             'fraction of the query length (0-1)')
+    parser.add_argument('--min_scov', dest='min_scov',
+                        action='store', type=float, default=None,
+                        help='Drop hits whose alignment covers a smaller ' +
+                             'fraction of the subject length (0-1)')
+    parser.add_argument('--top_hits', dest='top_hits',
+                        action='store', type=int, default=None,
+                        help='Keep only the first (best) N subjects hit by ' +
+                             'each query, in the order BLAST reports them')
+
+    parser.add_argument('--evalue_cutoffs', dest='evalue_cutoffs',
+                        nargs='+', default=None, type=get_evalue_string,
+                        help='Write a separate set of graphs (and averages) ' +
+                             'for each of these E-value cutoffs, named ' +
+                             '<out_pref>_<cutoff>_*, from the single set of ' +
+                             'hits read from the BLAST file (which should ' +
+                             'be run with the loosest cutoff)')
+
+    # Group: Clustering options
+    parser.add_argument('--inflations', dest='inflations', nargs='+',
+                        type=float, default=None,
+                        help='Cluster the graphs with the built-in MCL ' +
+                             'engine at each of these inflation values, ' +
+                             'writing <graph>_I<inflation*10>.mcl files')
+    parser.add_argument('--mcl_variants', dest='mcl_variants', nargs='+',
+                        default=['raw_dmnd', 'nrm_dmnd'],
+                        choices=['raw_dmnd', 'raw_dmls', 'nrm_dmnd',
+                                 'nrm_dmls'],
+                        help='Graph variants clustered when --inflations ' +
+                             'is given [def=raw_dmnd nrm_dmnd]')
+    parser.add_argument('--mcl_jobs', dest='mcl_jobs',
+                        action='store', type=int, default=1,
+                        help='Number of processes used for the built-in ' +
+                             'MCL engine [def=1]')
+
+    # Group: Performance options
+    parser.add_argument('--backend', dest='backend', action='store',
+                        choices=['networkx', 'numpy'], default='networkx',
+                        help='Store the best hits in a NetworkX graph or in ' +
+                             'columnar NumPy arrays, which need far less ' +
+                             'memory for large graphs [def=networkx]')
+    parser.add_argument('--one_pass', dest='one_pass',
+                        action='store_true', default=False,
+                        help='Read the BLAST file only once, buffering ' +
+                             'non-self hits until all self bit scores are ' +
+                             'known (always used for pipes and stdin)')
+    parser.add_argument('--chunk_size', dest='chunk_size',
+                        action='store', type=int, default=100000,
+                        help='Number of BLAST hits whose metrics are ' +
+                             'computed together as arrays when using ' +
+                             '--one_pass [def=100000]')
+    parser.add_argument('--workers', dest='workers',
+                        action='store', type=int, default=1,
+                        help='Number of processes used to parse the BLAST ' +
+                             'file, each reading a separate range of lines ' +
+                             '(implies --one_pass) [def=1]')
+
+    parser.add_argument('--cache_dir', dest='cache_dir', action='store',
+                        default=None,
+                        help='Directory in which the parsed graph is cached, ' +
+                             'keyed by the BLAST file and the column, ID and ' +
+                             'filtering options, so that later runs on the ' +
+                             'same file skip parsing')
+    parser.add_argument('--cache_size', dest='cache_size',
+                        action='store', type=float, default=10240,
+                        help='Largest total size of the cache in MB; the ' +
+                             'least recently used graphs are removed first ' +
+                             '[def=10240]')
+
+    # Group: Profiling options
+    parser.add_argument('--profile', dest='profile',
+                        action='store_true', default=False,
+                        help='Report progress through the BLAST file to ' +
+                             'stderr and finish with a table of stage ' +
+                             'timings, throughput, peak memory and counts')
+    parser.add_argument('--progress_interval', dest='progress_interval',
+                        action='store', type=float, default=10.0,
+                        help='Seconds between progress reports when using ' +
+                             '--profile [def=10]')
+    parser.add_argument('--stats_json', dest='stats_json', action='store',
+                        default=None,
+                        help='Save stage timings, throughput, peak memory ' +
+                             'and counts to this JSON file')
+    parser.add_argument('--cprofile', dest='cprofile', nargs='+',
+                        default=None,
+                        choices=['self_scores', 'metrics', 'parse',
+                                 'add_hits', 'cache_load', 'cache_save',
+                                 'subgraph', 'averages', 'abc', 'mci', 'mcl',
+                                 'fasta'],
+                        help='Run these stages under cProfile, writing ' +
+                             '<out_pref>.<stage>.prof files that can be ' +
+                             'read with pstats or snakeviz')
 
     # Group: TODO
     parser.add_argument('-m', '--merge', dest='merge',
@@ -119,9 +568,20 @@ def get_parsed_args():
     return args
 
 
+def get_evalue_string(value):
+    """Check that a command line argument is an E-value, keeping its text"""
+    try:
+        if float(value) < 0:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "invalid E-value: '{0}'".format(value))
+    return value
+
+
 def get_self_bit_scores_and_org_ids(
         met_grf, blast_handle, idchar=None, org_ids=None,
-        evcol=10, bscol=11, qlcol=12, slcol=13):
+        evcol=10, bscol=11, qlcol=12, slcol=13, stats=None):
     """Get bit scores from full-length self-alignments
 
     Searches an open file for tab-delimited BLAST hit records where the query
@@ -149,31 +609,34 @@ def get_self_bit_scores_and_org_ids(
         bscol: Column containing BLAST bit scores
         qlcol: Column containing query sequence lengths
         slcol: Column containing subject sequence lengths
+        stats: A RunStats object for line counts and progress reports
 
     Returns:
         Nothing, the NetworkX graph and organsm IDs set data structures are
         edited in place
     """
-    for line in blast_handle:
-        temp = line.strip().split()
-        if not temp:
-            continue
-        elif temp[0][0] == "#":
-            continue
-
-        if temp[0] == temp[1]:
-            seq_id = str(temp[0])
-            bit_scr = float(temp[bscol])
+    reader = BlastReader(blast_handle)
+    for chunk in reader.iter_chunks({0: None, 1: None, bscol: np.float64}):
+        is_self = chunk[0] == chunk[1]
+        if stats is not None:
+            stats.count('lines', len(is_self))
+            stats.count('self_hits', int(is_self.sum()))
+            stats.report_progress(reader.offset, reader.size)
+
+        for seq_id, bit_scr in zip(decode_ids(chunk[0][is_self]),
+                                   chunk[bscol][is_self].tolist()):
             org_ids.add(seq_id.split(idchar)[0])
 
-            if not met_grf.has_node(seq_id):
-                met_grf.add_node(seq_id, sbs=bit_scr)
-            elif bit_scr > met_grf.node[seq_id]['sbs']:
-                met_grf.node[seq_id]['sbs'] = bit_scr
+            update_self_bit_score(met_grf=met_grf, seq_id=seq_id,
+                                  bit_scr=bit_scr)
+    if stats is not None:
+        stats.count('bytes', reader.offset)
+    reader.close()
 
 
 def get_metrics(met_grf, blast_handle,
-                evcol=10, bscol=11, qlcol=12, slcol=13):
+                evcol=10, bscol=11, qlcol=12, slcol=13, stats=None,
+                hit_filter=None):
     """Get bit scores from full-length alignments between different sequences
 
     Searches an open file for tab-delimited BLAST hit records where the query
@@ -203,59 +666,634 @@ def get_metrics(met_grf, blast_handle,
         bscol: Column containing BLAST bit scores
         qlcol: Column containing query sequence lengths
         slcol: Column containing subject sequence lengths
+        stats: A RunStats object for hit and edge counts and progress reports
+        hit_filter: A HitFilter object, hits failing its thresholds are
+            dropped before their metrics are computed (or, for the BSR
+            filter, before they are stored)
 
     Returns:
         Nothing, all data structures are edited in place
     """
-    for line in blast_handle:
-        temp = line.strip().split()
-        if not temp:
-            continue
-        elif temp[0][0] == "#":
+    tally = dict.fromkeys(['insert', 'replace', None, 'skip'], 0)
+    min_bsr = None if hit_filter is None else hit_filter.min_bsr
+    bsr_pairs = set()  # Pairs with a hit failing the BSR filter
+    reader = BlastReader(blast_handle)
+    for chunk in reader.iter_chunks(get_hit_columns(
+            evcol=evcol, bscol=bscol, qlcol=qlcol, slcol=slcol)):
+        if stats is not None:
+            stats.count('hits', int((chunk[0] != chunk[1]).sum()))
+            stats.report_progress(reader.offset, reader.size,
+                                  what='BLAST file (pass 2)')
+        if hit_filter is not None:
+            chunk = hit_filter.apply(chunk)
+
+        chk_bit, chk_nle, chk_bal = compute_metric_arrays(
+            evalue=chunk[evcol], bit=chunk[bscol], aln_len=chunk[3],
+            qry_aln_beg=chunk[6], qry_aln_end=chunk[7],
+            ref_aln_beg=chunk[8], ref_aln_end=chunk[9],
+            qry_len=chunk[qlcol], ref_len=chunk[slcol])
+
+        for qry_id, ref_id, hit_bit, hit_nle, hit_bal in zip(
+                decode_ids(chunk[0]), decode_ids(chunk[1]), chk_bit.tolist(),
+                chk_nle.tolist(), chk_bal.tolist()):
+
+            if met_grf.has_node(qry_id) and met_grf.has_node(ref_id):
+                metrics = {'bit': hit_bit, 'nle': hit_nle, 'bal': hit_bal}
+
+                # Compute 'Bit Score Ratio'
+                qry_sbs = get_self_bit_score(met_grf=met_grf, seq_id=qry_id)
+                ref_sbs = get_self_bit_score(met_grf=met_grf, seq_id=ref_id)
+                metrics['bsr'] = metrics['bit'] / min(qry_sbs, ref_sbs)
+
+                if min_bsr is not None and qry_id != ref_id and \
+                        not hit_filter.keep_bsr(metrics['bsr'], count=False):
+                    bsr_pairs.add((qry_id, ref_id) if qry_id < ref_id
+                                  else (ref_id, qry_id))
+                    continue
+
+                status = update_best_hit(met_grf=met_grf, qry_id=qry_id,
+                                         ref_id=ref_id, metrics=metrics)
+                if qry_id != ref_id:
+                    tally[status] += 1
+            elif qry_id != ref_id:
+                tally['skip'] += 1
+    reader.close()
+
+    # Pairs are counted as filtered by BSR only if none of their hits passed,
+    # as they are when the best hits are buffered
+    if bsr_pairs:
+        hit_filter.count_bsr_pairs(sum(
+            1 for qry_id, ref_id in bsr_pairs
+            if not met_grf.has_edge(qry_id, ref_id)))
+
+    if stats is not None:
+        add_edge_tally(stats, tally)
+
+
+def get_self_bit_scores_and_hits(
+        met_grf, blast_handle, idchar=None, org_ids=None,
+        evcol=10, bscol=11, qlcol=12, slcol=13, chunk_size=100000,
+        stats=None, hit_filter=None):
+    """Get self bit scores and best non-self hits in a single pass
+
+    Combines get_self_bit_scores_and_org_ids() and get_metrics() so that the
+    BLAST file only needs to be read once, which also makes it possible to
+    read BLAST results from a pipe. The bit score ratio can not be computed
+    until the self bit scores for both sequences are known, so the best hit
+    between each pair of sequences is buffered in a set of flat arrays (bit
+    score, -log10(E-value), and bit per anchored length) and handed to
+    add_buffered_hits() once the whole file has been read.
+
+    Hits are read in chunks of chunk_size lines by a BlastReader and their
+    metrics computed with NumPy array operations by add_hit_chunk().
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore (does not need to be empty)
+        blast_handle: An open file handle or a BlastReader for tab-delimited
+            BLAST hits (can contain comment lines beginning with a hash '#'
+            character)
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID
+        org_ids: A Python set variable to which organism IDs will be added
+        evcol: Column containing BLAST E-values
+        bscol: Column containing BLAST bit scores
+        qlcol: Column containing query sequence lengths
+        slcol: Column containing subject sequence lengths
+        chunk_size: Number of hits to parse before computing their metrics
+        stats: A RunStats object for line counts and progress reports
+        hit_filter: A HitFilter object, hits failing its thresholds are
+            never buffered (except for the BSR filter, which is applied by
+            add_buffered_hits())
+
+    Returns:
+        hits: A tuple (rows, bit, nle, bal) in which rows maps each
+            (query, subject) pair to a row in the three metric arrays
+    """
+    hits = (dict(), array('d'), array('d'), array('d'))
+
+    if isinstance(blast_handle, BlastReader):
+        reader = blast_handle
+    else:
+        reader = BlastReader(blast_handle)
+
+    for chunk in reader.iter_chunks(
+            get_hit_columns(evcol=evcol, bscol=bscol, qlcol=qlcol,
+                            slcol=slcol),
+            chunk_size=chunk_size):
+        add_hit_chunk(met_grf=met_grf, hits=hits, chunk=chunk,
+                      idchar=idchar, org_ids=org_ids, evcol=evcol,
+                      bscol=bscol, qlcol=qlcol, slcol=slcol, stats=stats,
+                      hit_filter=hit_filter)
+        if stats is not None:
+            stats.report_progress(reader.offset, reader.size)
+    if stats is not None:
+        stats.count('bytes', reader.offset)
+    reader.close()
+
+    return hits
+
+
+def get_self_bit_scores_and_hits_parallel(
+        met_grf, blast_path, workers, idchar=None, org_ids=None,
+        evcol=10, bscol=11, qlcol=12, slcol=13, chunk_size=100000,
+        stats=None, hit_filter=None):
+    """Run get_self_bit_scores_and_hits() on shards of a file in parallel
+
+    The BLAST file is split into one byte range per worker, with each range
+    starting and ending on a line boundary. Each shard is parsed in its own
+    process, and the partial self score and best hit tables are merged in
+    file order using the same "largest bit score wins" rule, keeping the
+    first of several equally good hits. The result is therefore identical
+    to parsing the whole file in a single process.
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore (does not need to be empty)
+        blast_path: Path to a tab-delimited BLAST file
+        workers: Number of processes (and shards)
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID
+        org_ids: A Python set variable to which organism IDs will be added
+        evcol: Column containing BLAST E-values
+        bscol: Column containing BLAST bit scores
+        qlcol: Column containing query sequence lengths
+        slcol: Column containing subject sequence lengths
+        chunk_size: Number of hits to parse before computing their metrics
+        stats: A RunStats object for line counts and progress reports (which
+            are made as each shard is merged)
+        hit_filter: A HitFilter object, copied to each worker process
+
+    Returns:
+        hits: A tuple (rows, bit, nle, bal) like the one returned by
+            get_self_bit_scores_and_hits()
+    """
+    tasks = [(blast_path, beg, end, idchar, evcol, bscol, qlcol, slcol,
+              chunk_size, hit_filter)
+             for beg, end in get_shard_ranges(blast_path, workers)]
+
+    hits = (dict(), array('d'), array('d'), array('d'))
+
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        for task, (shd_sbs, shd_org_ids, shd_hits, shd_counts) in zip(
+                tasks, pool.imap(parse_blast_shard, tasks)):
+            if stats is not None:
+                stats.update(shd_counts)
+                stats.report_progress(task[2], os.path.getsize(blast_path))
+            org_ids.update(shd_org_ids)
+            for seq_id, bit_scr in shd_sbs.items():
+                update_self_bit_score(met_grf=met_grf, seq_id=seq_id,
+                                      bit_scr=bit_scr)
+            merge_buffered_hits(hits=hits, new_hits=shd_hits)
+    finally:
+        pool.close()
+        pool.join()
+
+    return hits
+
+
+def get_shard_ranges(blast_path, shards):
+    """Split a file into byte ranges that begin and end at line boundaries
+
+    Each boundary is moved forward to the start of the next query's hits, so
+    that all of the hits for a query are in the same range (which keeps the
+    --top_hits filter independent of the number of shards).
+
+    Returns:
+        A list of (begin, end) byte offsets, skipping empty ranges
+    """
+    size = os.path.getsize(blast_path)
+    bounds = [0]
+
+    with open(blast_path, 'rb') as handle:
+        for i in range(1, shards):
+            pos = size * i // shards
+            if pos <= bounds[-1]:
+                continue
+            # Finish the line containing the byte before the boundary
+            handle.seek(pos-1)
+            handle.readline()
+            bounds.append(min(skip_to_next_query(handle), size))
+
+    bounds.append(size)
+
+    return [(beg, end) for beg, end in zip(bounds[:-1], bounds[1:])
+            if end > beg]
+
+
+def skip_to_next_query(handle):
+    """Skip the rest of the hits for the query of the next line in a file
+
+    Args:
+        handle: A binary file handle positioned at the start of a line
+
+    Returns:
+        The offset of the first hit for a different query (or the end of
+        the file)
+    """
+    first_qry = None
+    while True:
+        pos = handle.tell()
+        line = handle.readline()
+        if not line:
+            return pos
+        if line.startswith(b'#') or not line.strip():
             continue
+        qry_id = line.split(b'\t', 1)[0]
+        if first_qry is None:
+            first_qry = qry_id
+        elif qry_id != first_qry:
+            return pos
+
+
+def parse_blast_shard(task):
+    """Parse one shard of a BLAST file in a worker process
+
+    Args:
+        task: A tuple (blast_path, beg, end, idchar, evcol, bscol, qlcol,
+            slcol, chunk_size, hit_filter)
+
+    Returns:
+        A tuple (sbs, org_ids, hits, counts) holding a dict of self bit
+            scores keyed by sequence ID, a set of organism IDs, the best hits
+            in the shard as returned by get_self_bit_scores_and_hits(), and a
+            dict of line and filter counts
+    """
+    (blast_path, beg, end, idchar, evcol, bscol, qlcol, slcol, chunk_size,
+     hit_filter) = task
+
+    shd_grf = EdgeStore()
+    shd_org_ids = set()
+    shd_stats = RunStats()
+
+    shd_hits = get_self_bit_scores_and_hits(
+        met_grf=shd_grf, blast_handle=BlastReader(blast_path, beg, end),
+        idchar=idchar, org_ids=shd_org_ids, evcol=evcol, bscol=bscol,
+        qlcol=qlcol, slcol=slcol, chunk_size=chunk_size, stats=shd_stats,
+        hit_filter=hit_filter)
+    if hit_filter is not None:
+        shd_stats.update(hit_filter.counts)
+
+    shd_sbs = dict()
+    for seq_id in shd_grf.nodes():
+        shd_sbs[seq_id] = shd_grf.self_score(seq_id)
+
+    return shd_sbs, shd_org_ids, shd_hits, shd_stats.counts
+
+
+def merge_buffered_hits(hits, new_hits):
+    """Merge hits buffered from a later part of the BLAST file into hits
+
+    Args:
+        hits: A (rows, bit, nle, bal) tuple to be updated
+        new_hits: A (rows, bit, nle, bal) tuple from a later part of the file
+
+    Returns:
+        Nothing, hits is edited in place
+    """
+    rows, bit, nle, bal = hits
+    new_rows, new_bit, new_nle, new_bal = new_hits
+
+    for (qry_id, ref_id), new_row in new_rows.items():
+        row = rows.get((qry_id, ref_id))
+        if row is None:
+            row = rows.get((ref_id, qry_id))
+
+        if row is None:
+            rows[(intern(qry_id), intern(ref_id))] = len(bit)
+            bit.append(new_bit[new_row])
+            nle.append(new_nle[new_row])
+            bal.append(new_bal[new_row])
+
+        # Largest bit score => best hit
+        elif new_bit[new_row] > bit[row]:
+            bit[row] = new_bit[new_row]
+            nle[row] = new_nle[new_row]
+            bal[row] = new_bal[new_row]
+
+
+def add_hit_chunk(met_grf, hits, chunk, idchar=None, org_ids=None,
+                  evcol=10, bscol=11, qlcol=12, slcol=13, stats=None,
+                  hit_filter=None):
+    """Compute metrics for a chunk of BLAST hits and buffer the best ones
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore
+        hits: The (rows, bit, nle, bal) tuple being built by
+            get_self_bit_scores_and_hits()
+        chunk: A dict of column arrays as yielded by BlastReader.iter_chunks()
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID
+        org_ids: A Python set variable to which organism IDs will be added
+        evcol: Column containing BLAST E-values
+        bscol: Column containing BLAST bit scores
+        qlcol: Column containing query sequence lengths
+        slcol: Column containing subject sequence lengths
+        stats: A RunStats object for line counts
+        hit_filter: A HitFilter object, hits failing its thresholds are
+            dropped before their metrics are computed
+
+    Returns:
+        Nothing, the graph and hit buffer are edited in place
+    """
+    rows, bit, nle, bal = hits
+    is_self = chunk[0] == chunk[1]
+    if stats is not None:
+        n_self = int(is_self.sum())
+        stats.count('lines', len(is_self))
+        stats.count('self_hits', n_self)
+        stats.count('hits', len(is_self) - n_self)
+
+    for seq_id, bit_scr in zip(decode_ids(chunk[0][is_self]),
+                               chunk[bscol][is_self].tolist()):
+        org_ids.add(seq_id.split(idchar)[0])
+        update_self_bit_score(met_grf=met_grf, seq_id=intern(str(seq_id)),
+                              bit_scr=bit_scr)
+
+    chunk = dict((col, arr[~is_self]) for col, arr in chunk.items())
+    if hit_filter is not None:
+        chunk = hit_filter.apply(chunk)
+
+    chk_bit, chk_nle, chk_bal = compute_metric_arrays(
+        evalue=chunk[evcol], bit=chunk[bscol], aln_len=chunk[3],
+        qry_aln_beg=chunk[6], qry_aln_end=chunk[7],
+        ref_aln_beg=chunk[8], ref_aln_end=chunk[9],
+        qry_len=chunk[qlcol], ref_len=chunk[slcol])
+
+    for qry_id, ref_id, hit_bit, hit_nle, hit_bal in zip(
+            decode_ids(chunk[0]), decode_ids(chunk[1]), chk_bit.tolist(),
+            chk_nle.tolist(), chk_bal.tolist()):
+
+        # Reciprocal hits share a row, just like they share a graph edge
+        row = rows.get((qry_id, ref_id))
+        if row is None:
+            row = rows.get((ref_id, qry_id))
+
+        if row is None:
+            # Interning keeps a single copy of each ID no matter how many hits
+            rows[(intern(str(qry_id)), intern(str(ref_id)))] = len(bit)
+            bit.append(hit_bit)
+            nle.append(hit_nle)
+            bal.append(hit_bal)
+
+        # Largest bit score => best hit
+        elif hit_bit > bit[row]:
+            bit[row] = hit_bit
+            nle[row] = hit_nle
+            bal[row] = hit_bal
+
+
+def add_buffered_hits(met_grf, hits, stats=None, hit_filter=None):
+    """Add hits buffered by get_self_bit_scores_and_hits() to the graph
+
+    Hits between sequences lacking a self-alignment are skipped, exactly as
+    they are by get_metrics().
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore containing self-alignment
+            scores
+        hits: The tuple returned by get_self_bit_scores_and_hits()
+        stats: A RunStats object for edge counts
+        hit_filter: A HitFilter object whose BSR threshold is applied to
+            the best hit of each pair
+
+    Returns:
+        Nothing, the graph is edited in place
+    """
+    rows, bit, nle, bal = hits
+
+    pairs = [pair for pair in rows.keys()
+             if met_grf.has_node(pair[0]) and met_grf.has_node(pair[1])]
+    # Only the best hit of each pair was buffered, so replaced hits and hits
+    # that were not the best are not known and are left out of the tally
+    tally = dict(insert=0, skip=len(rows) - len(pairs))
+    if not pairs:
+        if stats is not None:
+            add_edge_tally(stats, tally)
+        return
+
+    idx = np.array([rows[pair] for pair in pairs], dtype=np.int64)
+    hit_bit = np.frombuffer(bit, dtype=np.float64)[idx]
+    qry_sbs = np.array([get_self_bit_score(met_grf=met_grf, seq_id=qry_id)
+                        for qry_id, ref_id in pairs])
+    ref_sbs = np.array([get_self_bit_score(met_grf=met_grf, seq_id=ref_id)
+                        for qry_id, ref_id in pairs])
+
+    # Compute 'Bit Score Ratio'
+    hit_bsr = hit_bit / np.minimum(qry_sbs, ref_sbs)
+    hit_nle = np.frombuffer(nle, dtype=np.float64)[idx]
+    hit_bal = np.frombuffer(bal, dtype=np.float64)[idx]
+
+    if hit_filter is not None and hit_filter.min_bsr is not None:
+        keep = hit_filter.keep_bsr(hit_bsr)
+        pairs = [pair for pair, kept in zip(pairs, keep.tolist()) if kept]
+        hit_bit = hit_bit[keep]
+        hit_bsr = hit_bsr[keep]
+        hit_nle = hit_nle[keep]
+        hit_bal = hit_bal[keep]
+
+    for (qry_id, ref_id), met_bit, met_nle, met_bsr, met_bal in zip(
+            pairs, hit_bit.tolist(), hit_nle.tolist(), hit_bsr.tolist(),
+            hit_bal.tolist()):
+        status = update_best_hit(met_grf=met_grf, qry_id=qry_id,
+                                 ref_id=ref_id,
+                                 metrics={'nle': met_nle, 'bit': met_bit,
+                                          'bsr': met_bsr, 'bal': met_bal})
+        tally[status] = tally.get(status, 0) + 1
+
+    if stats is not None:
+        add_edge_tally(stats, tally)
+
+
+def add_edge_tally(stats, tally):
+    """Add the outcomes of a series of update_best_hit() calls to a RunStats
+
+    Only the outcomes present in the tally are counted.
+
+    Args:
+        stats: A RunStats object
+        tally: A dict counting the values returned by update_best_hit(), plus
+            the hits skipped for lack of self-alignment scores ('skip')
+    """
+    for status, name in (('insert', 'edges_inserted'),
+                         ('replace', 'edges_replaced'),
+                         (None, 'hits_not_best'),
+                         ('skip', 'hits_without_self_score')):
+        if status in tally:
+            stats.count(name, tally[status])
+
+
+def compute_metric_arrays(evalue, bit, aln_len, qry_aln_beg, qry_aln_end,
+                          ref_aln_beg, ref_aln_end, qry_len, ref_len):
+    """Compute the bit score, -log10(E-value), and bit per anchored length
+
+    Every argument is a sequence of the strings (or numbers) found in the
+    corresponding BLAST column.
+
+    Returns:
+        A tuple (bit, nle, bal) of NumPy float arrays
+    """
+    bit = np.asarray(bit, dtype=np.float64)
+    nle = compute_nle_array(evalue)
+
+    anchored_length = compute_anchored_length_array(
+        qry_aln_beg=np.asarray(qry_aln_beg, dtype=np.int64),
+        qry_aln_end=np.asarray(qry_aln_end, dtype=np.int64),
+        ref_aln_beg=np.asarray(ref_aln_beg, dtype=np.int64),
+        ref_aln_end=np.asarray(ref_aln_end, dtype=np.int64),
+        aln_len=np.asarray(aln_len, dtype=np.float64),
+        qry_len=np.asarray(qry_len, dtype=np.float64),
+        ref_len=np.asarray(ref_len, dtype=np.float64))
+
+    return bit, nle, bit / anchored_length
+
+
+def compute_nle_array(evalue):
+    """Compute the negative common log of an array of BLAST E-values
+
+    BLAST prints E-values with only a few significant digits, so there are
+    few distinct E-value strings even in very large files. Each distinct
+    string is converted with exact Decimal arithmetic, which also keeps the
+    results independent of the platform's floating point log10().
+    """
+    uniq, inverse = np.unique(np.asarray(evalue), return_inverse=True)
+    uniq_nle = np.empty(len(uniq), dtype=np.float64)
+
+    for i, evl in enumerate(uniq.tolist()):
+        if isinstance(evl, bytes):
+            evl = evl.decode('utf-8')
+        #BLAST 2.2.28+ rounds E-values smaller than 1e-180 to zero
+        if float(evl) == 0:
+            uniq_nle[i] = float(181)
+        else:
+            uniq_nle[i] = float(-Decimal(evl).log10())
 
-        metrics = dict()
-        qry_id = str(temp[0])
-        ref_id = str(temp[1])
-
-        if met_grf.has_node(qry_id) and met_grf.has_node(ref_id):
-            qry_len = float(temp[qlcol])
-            ref_len = float(temp[slcol])
-            aln_len = float(temp[3])
-            qry_aln_beg = int(temp[6])
-            qry_aln_end = int(temp[7])
-            ref_aln_beg = int(temp[8])
-            ref_aln_end = int(temp[9])
-            metrics['bit'] = float(temp[bscol])
-
-            #BLAST 2.2.28+ rounds E-values smaller than 1e-180 to zero
-            if float(temp[evcol]) == 0:
-                metrics['nle'] = float(181)
-            else:
-                # Compute Negative common (base 10) Log of the E-value
-                metrics['nle'] = float(-Decimal(temp[evcol]).log10())
-
-            # Compute 'Bit per Anchored length'
-            anchored_length = compute_anchored_length(
-                qry_aln_beg=qry_aln_beg, qry_aln_end=qry_aln_end,
-                ref_aln_beg=ref_aln_beg, ref_aln_end=ref_aln_end,
-                aln_len=aln_len, qry_len=qry_len, ref_len=ref_len)
-            metrics['bal'] = metrics['bit'] / anchored_length
-
-            # Compute 'Bit Score Ratio'
-            qry_sbs = met_grf.node[qry_id]['sbs']
-            ref_sbs = met_grf.node[ref_id]['sbs']
-            metrics['bsr'] = metrics['bit'] / min(qry_sbs, ref_sbs)
-
-            if not met_grf.has_edge(qry_id, ref_id):
-                met_grf.add_edge(qry_id, ref_id)
-                for met in metrics.keys():
-                    met_grf[qry_id][ref_id][met] = metrics[met]
-
-            # Largest bit score => best hit
-            elif metrics['bit'] > met_grf[qry_id][ref_id]['bit']:
-                for met in metrics.keys():
-                    met_grf[qry_id][ref_id][met] = metrics[met]
+    return uniq_nle[inverse.ravel()]
+
+
+def get_hit_columns(evcol=10, bscol=11, qlcol=12, slcol=13):
+    """Columns (and their types) that BlastReader must extract for each hit
+
+    E-values are kept as strings so that compute_nle_array() can convert each
+    distinct value only once.
+    """
+    return {0: None, 1: None, 3: np.float64,
+            6: np.int64, 7: np.int64, 8: np.int64, 9: np.int64,
+            evcol: None, bscol: np.float64,
+            qlcol: np.float64, slcol: np.float64}
+
+
+def is_seekable(handle):
+    """Check whether a file handle can be rewound for a second pass"""
+    try:
+        return handle.seekable()
+    except AttributeError:  # Python 2 file objects
+        try:
+            handle.tell()
+        except IOError:
+            return False
+        return True
+
+
+def update_self_bit_score(met_grf, seq_id, bit_scr):
+    """Store a self-alignment bit score, keeping the largest one seen
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore
+        seq_id: The ID of the self-aligned sequence
+        bit_scr: The bit score of the self-alignment
+
+    Returns:
+        Nothing, the graph is edited in place
+    """
+    if isinstance(met_grf, EdgeStore):
+        met_grf.update_self_score(seq_id, bit_scr)
+    elif not met_grf.has_node(seq_id):
+        met_grf.add_node(seq_id, sbs=bit_scr)
+    elif bit_scr > met_grf.nodes[seq_id]['sbs']:
+        met_grf.nodes[seq_id]['sbs'] = bit_scr
+
+
+def get_self_bit_score(met_grf, seq_id):
+    """Look up the self-alignment bit score of a sequence
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore
+        seq_id: The ID of the sequence
+
+    Returns:
+        The largest self-alignment bit score found for the sequence
+    """
+    if isinstance(met_grf, EdgeStore):
+        return met_grf.self_score(seq_id)
+    return met_grf.nodes[seq_id]['sbs']
+
+
+def update_best_hit(met_grf, qry_id, ref_id, metrics):
+    """Store a hit unless a hit with a larger bit score is already stored
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore
+        qry_id: The ID of the query sequence
+        ref_id: The ID of the subject sequence
+        metrics: A dict containing the 'nle', 'bit', 'bsr', and 'bal' values
+            computed for the hit
+
+    Returns:
+        'insert' if a new edge was added, 'replace' if a stored hit was
+        replaced, or None if the stored hit was kept; the graph is edited in
+        place
+    """
+    if isinstance(met_grf, EdgeStore):
+        n_edges = met_grf.n_edges
+        if not met_grf.add_best_hit(qry_id, ref_id, bit=metrics['bit'],
+                                    nle=metrics['nle'], bsr=metrics['bsr'],
+                                    bal=metrics['bal']):
+            return None
+        return 'insert' if met_grf.n_edges > n_edges else 'replace'
+
+    elif not met_grf.has_edge(qry_id, ref_id):
+        met_grf.add_edge(qry_id, ref_id)
+        for met in metrics.keys():
+            met_grf[qry_id][ref_id][met] = metrics[met]
+        return 'insert'
+
+    # Largest bit score => best hit
+    elif metrics['bit'] > met_grf[qry_id][ref_id]['bit']:
+        for met in metrics.keys():
+            met_grf[qry_id][ref_id][met] = metrics[met]
+        return 'replace'
+
+    return None
+
+
+def get_component_labels(met_grf):
+    """Map each sequence to the index of its connected component
+
+    Returns:
+        comp_of: A function returning the component index of a sequence ID,
+            or None if the sequence is not in the graph
+        n_comp: The number of components
+    """
+    if isinstance(met_grf, EdgeStore):
+        labels, n_comp = met_grf.component_labels()
+        labels = labels.tolist()
+        seq_idx = met_grf.seq_idx
+
+        def comp_of(seq_id):
+            idx = seq_idx.get(seq_id)
+            if idx is None or labels[idx] < 0:
+                return None
+            return labels[idx]
+
+        return comp_of, n_comp
+
+    comp_idx = dict()
+    n_comp = 0
+    for n_comp, comp in enumerate(nx.connected_components(met_grf), 1):
+        for seq_id in comp:
+            comp_idx[seq_id] = n_comp - 1
+
+    return comp_idx.get, n_comp
 
 
 def compute_anchored_length(qry_aln_beg, qry_aln_end, ref_aln_beg, ref_aln_end,
@@ -283,39 +1321,26 @@ def compute_anchored_length(qry_aln_beg, qry_aln_end, ref_aln_beg, ref_aln_end,
     return left_ohang + aln_len + right_ohang
 
 
-def print_unnormalized_abc_files(met_grf, metrics, glb_avgs, out_pref):
-    """Print MCL-formatted .abc graph files"""
-    handle = dict()
+def compute_anchored_length_array(qry_aln_beg, qry_aln_end, ref_aln_beg,
+                                  ref_aln_end, aln_len, qry_len, ref_len):
+    """
+    Array version of compute_anchored_length(), which remains the reference
+    """
+    qab = np.minimum(qry_aln_beg, qry_aln_end)
+    qae = np.maximum(qry_aln_beg, qry_aln_end)
+    rab = np.minimum(ref_aln_beg, ref_aln_end)
+    rae = np.maximum(ref_aln_beg, ref_aln_end)
 
-    for met in metrics:
-        handle['dmls_'+met] = open(out_pref+'_dmls_'+met+'.abc', 'w')
-        handle['dmnd_'+met] = open(out_pref+'_dmnd_'+met+'.abc', 'w')
+    left_ohang = np.minimum(qab, rab)-1
+    right_ohang = np.minimum(qry_len-qae, ref_len-rae)
 
-    for qry_id, ref_id, edata in met_grf.edges(data=True):
-        if qry_id == ref_id:
-            continue
+    return left_ohang + aln_len + right_ohang
 
-        for met in metrics:
-            if edata[met]:
-                dmls_met = edata[met] / glb_avgs[met+'_avg']
-                dmnd_met = edata[met]
-            elif met == 'nle':  # Restore p(BLAST-rounded E-value)s
-                dmls_met = float(181) / glb_avgs[met+'_avg']
-                dmnd_met = float(181)
-            else:  # just in case...
-                err_out = "Found empty {0} value between {1} and {2}.\n" \
-                          .format(met, qry_id, ref_id)
-                sys.stderr.write(err_out)
-
-            dmls_out = '{0}\t{1}\t{2}\n'.format(qry_id, ref_id, dmls_met)
-            handle['dmls_'+met].write(dmls_out)
-
-            dmnd_out = '{0}\t{1}\t{2}\n'.format(qry_id, ref_id, dmnd_met)
-            handle['dmnd_'+met].write(dmnd_out)
 
-    for met in metrics:
-        handle['dmls_'+met].close()
-        handle['dmnd_'+met].close()
+def print_unnormalized_abc_files(met_grf, metrics, glb_avgs, out_pref):
+    """Print MCL-formatted .abc graph files"""
+    print_abc_files(met_grf=met_grf, metrics=metrics, glb_avgs=glb_avgs,
+                    raw_pref=out_pref)
 
 
 def compute_organism_averages(met_grf, metrics, idchar, org_ids):
@@ -336,6 +1361,21 @@ def compute_organism_averages(met_grf, metrics, idchar, org_ids):
     """
     avgs_wo = nx.Graph()  # Inter-organism averages w/o self hits
 
+    # Sums are rounded once (math.fsum), so they do not depend on the order of
+    # the edges, which differs between backends and parsing modes
+    if isinstance(met_grf, EdgeStore) and met_grf.idchar == idchar:
+        org_lo, org_hi, sums = met_grf.org_pair_sums()
+        for i, j, pair_sums in zip(org_lo.tolist(), org_hi.tolist(),
+                                   sums.tolist()):
+            qry_org = met_grf.org_ids[i]
+            ref_org = met_grf.org_ids[j]
+            avgs_wo.add_edge(qry_org, ref_org, cnt=int(met_grf.org_cnt[i, j]))
+            for met, met_sum in zip(met_grf.metrics, pair_sums):
+                if met in metrics:
+                    avgs_wo[qry_org][ref_org][met+'_sum'] = met_sum
+                    avgs_wo[qry_org][ref_org][met+'_avg'] = None
+        return avgs_wo
+
     for qry_id, ref_id, edata in met_grf.edges(data=True):
         qry_org = qry_id.split(idchar)[0]
         ref_org = ref_id.split(idchar)[0]
@@ -345,13 +1385,17 @@ def compute_organism_averages(met_grf, metrics, idchar, org_ids):
             try:
                 avgs_wo[qry_org][ref_org]['cnt'] += 1
                 for met in metrics:
-                    avgs_wo[qry_org][ref_org][met+'_sum'] += edata[met]
+                    avgs_wo[qry_org][ref_org][met+'_sum'].append(edata[met])
             except KeyError:
                 avgs_wo.add_edge(qry_org, ref_org, cnt=1)
                 for met in metrics:
-                    avgs_wo[qry_org][ref_org][met+'_sum'] = edata[met]
+                    avgs_wo[qry_org][ref_org][met+'_sum'] = [edata[met]]
                     avgs_wo[qry_org][ref_org][met+'_avg'] = None
 
+    for qry_org, ref_org, edata in avgs_wo.edges(data=True):
+        for met in metrics:
+            edata[met+'_sum'] = math.fsum(edata[met+'_sum'])
+
     return avgs_wo
 
 
@@ -374,18 +1418,20 @@ def compute_global_averages(org_avgs, metrics):
                       bsr_sum=float(0), nle_sum=float(0))
 
     for qry_org, ref_org, edata in org_avgs.edges(data=True):
-        org_avgs.node['global']['cnt'] += edata['cnt']
+        org_avgs.nodes['global']['cnt'] += edata['cnt']
 
         for met in metrics:
-            org_avgs.node['global'][met+'_sum'] += edata[met+'_sum']
             temp_avg = edata[met+'_sum']/edata['cnt']
             org_avgs[qry_org][ref_org][met+'_avg'] = temp_avg
 
-    glb_cnt = org_avgs.node['global']['cnt']
+    glb_cnt = org_avgs.nodes['global']['cnt']
 
+    # Summed with math.fsum so that the order of the pairs does not matter
     for met in metrics:
-        met_sum = org_avgs.node['global'][met+'_sum']  # floats or Decimals
-        org_avgs.node['global'][met+'_avg'] = met_sum/glb_cnt
+        met_sum = math.fsum(edata[met+'_sum'] for qry_org, ref_org, edata in
+                            org_avgs.edges(data=True))
+        org_avgs.nodes['global'][met+'_sum'] = met_sum
+        org_avgs.nodes['global'][met+'_avg'] = met_sum/glb_cnt
 
 
 def print_normalized_abc_files(met_grf, metrics, idchar, org_avgs, out_pref):
@@ -406,63 +1452,447 @@ def print_normalized_abc_files(met_grf, metrics, idchar, org_avgs, out_pref):
     computed directly because they are more prone to rounding errors and
     because manipulating floats offers significant performance benefits.
     """
-    glb_avg = dict()
-    handle = dict()
+    print_abc_files(met_grf=met_grf, metrics=metrics, idchar=idchar,
+                    glb_avgs=org_avgs.nodes['global'], org_avgs=org_avgs,
+                    nrm_pref=out_pref)
+
+
+def print_abc_files(met_grf, metrics, glb_avgs, idchar=None, org_avgs=None,
+                    raw_pref=None, nrm_pref=None, block_size=65536,
+                    compress=None, threads=1):
+    """Print raw and/or normalized .abc graph files in one pass over the edges
+
+    The edges are pulled out of the graph as columns by get_edge_arrays() and
+    written in blocks of block_size edges. For each block, the query/subject
+    prefix of every line is built once and shared by all of the output files,
+    each metric column is scaled with a single array operation, and each file
+    receives the whole block in a single write.
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore with edges weighted using each
+            BLAST-based metric
+        metrics: An ordered list of metrics used in the met_grf data structure
+        glb_avgs: A dict containing the global average of each metric
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID (normalized files only)
+        org_avgs: The organism averages graph from compute_global_averages()
+            (normalized files only)
+        raw_pref: Prefix for the unnormalized files, or None to skip them
+        nrm_pref: Prefix for the normalized files, or None to skip them
+        block_size: Number of edges formatted and written at a time
+        compress: Compression format for the files ('gz', 'bz2', 'zst'), or
+            None to leave them uncompressed
+        threads: Number of compression threads per file
+
+    Returns:
+        Nothing
+    """
+    seq_ids, src, dst, cols = get_edge_arrays(met_grf=met_grf,
+                                              metrics=metrics)
+    scalings = get_output_scalings(
+        seq_ids=seq_ids, src=src, dst=dst, metrics=metrics,
+        glb_avgs=glb_avgs, idchar=idchar, org_avgs=org_avgs,
+        raw_pref=raw_pref, nrm_pref=nrm_pref)
+
+    outputs = list()  # (handle, metric, divisor, is_raw) for each file
+    for out_name, met, divisor, is_raw in scalings:
+        handle = open_output(get_output_name(out_name+'.abc', compress), 'w',
+                             compress=compress, threads=threads)
+        outputs.append((handle, met, divisor, is_raw))
+
+    for met in metrics:
+        for row in np.flatnonzero(cols[met] == 0).tolist():
+            err_out = "Found empty {0} value between {1} and {2}.\n" \
+                      .format(met, seq_ids[src[row]], seq_ids[dst[row]])
+            sys.stderr.write(err_out)
+
+    for beg in range(0, len(src), block_size):
+        end = beg + block_size
+        prefixes = [seq_ids[u]+'\t'+seq_ids[v]+'\t' for u, v in
+                    zip(src[beg:end].tolist(), dst[beg:end].tolist())]
+
+        for handle, met, divisor, is_raw in outputs:
+            values = scale_metric(values=cols[met][beg:end], met=met,
+                                  divisor=divisor, is_raw=is_raw, beg=beg,
+                                  end=end)
+
+            handle.write('\n'.join(map(operator.add, prefixes,
+                                       map(str, values.tolist()))))
+            handle.write('\n')
+
+    for output in outputs:
+        output[0].close()
+
+
+def print_mci_files(met_grf, metrics, glb_avgs, tab_path, idchar=None,
+                    org_avgs=None, raw_pref=None, nrm_pref=None,
+                    compress=None, threads=1):
+    """Print graphs in MCL's native matrix format, with a shared label tab file
+
+    mcl has to read and hash every label in an .abc file each time it is run,
+    whereas a native matrix (.mci) file is already indexed. All of the .mci
+    files written here share a single indexing, written to tab_path as
+    "index<TAB>label" lines, so they can be clustered with
+
+        mcl graph.mci -use-tab graph.tab -I 2.0
+
+    to produce labelled clusters identical to those from the .abc files. Only
+    sequences with at least one edge are indexed, as in the .abc files.
+    Graphs are written symmetrically (as "mcxload --stream-mirror" would).
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore with edges weighted using each
+            BLAST-based metric
+        metrics: An ordered list of metrics used in the met_grf data structure
+        glb_avgs: A dict containing the global average of each metric
+        tab_path: Path for the file mapping matrix indices to sequence IDs
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID (normalized files only)
+        org_avgs: The organism averages graph from compute_global_averages()
+            (normalized files only)
+        raw_pref: Prefix for the unnormalized files, or None to skip them
+        nrm_pref: Prefix for the normalized files, or None to skip them
+        compress: Compression format for the files ('gz', 'bz2', 'zst'), or
+            None to leave them uncompressed
+        threads: Number of compression threads per file
+
+    Returns:
+        Nothing
+    """
+    seq_ids, src, dst, cols = get_edge_arrays(met_grf=met_grf,
+                                              metrics=metrics)
+    scalings = get_output_scalings(
+        seq_ids=seq_ids, src=src, dst=dst, metrics=metrics,
+        glb_avgs=glb_avgs, idchar=idchar, org_avgs=org_avgs,
+        raw_pref=raw_pref, nrm_pref=nrm_pref)
+
+    labels, mat_src, mat_dst = get_matrix_index(seq_ids=seq_ids, src=src,
+                                                dst=dst)
+    n_edges = len(src)
+
+    tab_handle = open_output(get_output_name(tab_path, compress), 'w',
+                             compress=compress, threads=threads)
+    tab_handle.write(''.join('{0}\t{1}\n'.format(i, seq_id)
+                             for i, seq_id in enumerate(labels)))
+    tab_handle.close()
+
+    # Each edge appears in the rows of both of its nodes, and the sort order
+    # is shared by every file
+    rows = np.concatenate((mat_src, mat_dst))
+    entries = np.concatenate((mat_dst, mat_src))
+    order = np.lexsort((entries, rows))
+    rows = rows[order]
+    entries = [str(j)+':' for j in entries[order].tolist()]
+    row_ids, row_begs = np.unique(rows, return_index=True)
+    row_ends = np.append(row_begs[1:], len(rows))
+
+    for out_name, met, divisor, is_raw in scalings:
+        values = scale_metric(values=cols[met], met=met, divisor=divisor,
+                              is_raw=is_raw, beg=0, end=n_edges)
+        values = np.concatenate((values, values))[order]
+        tokens = list(map(operator.add, entries, map(str, values.tolist())))
+
+        handle = open_output(get_output_name(out_name+'.mci', compress), 'w',
+                             compress=compress, threads=threads)
+        handle.write("(mclheader\nmcltype matrix\ndimensions {0}x{0}\n)\n"
+                     .format(len(labels)))
+        handle.write("(mclmatrix\nbegin\n")
+        for i, beg, end in zip(row_ids.tolist(), row_begs.tolist(),
+                               row_ends.tolist()):
+            handle.write("{0} {1} $\n".format(i, ' '.join(tokens[beg:end])))
+        handle.write(")\n")
+        handle.close()
+
+
+def run_mcl_sweep(met_grf, metrics, glb_avgs, inflations, variants,
+                  idchar=None, org_avgs=None, raw_pref=None, nrm_pref=None,
+                  processes=1, compress=None):
+    """Cluster graphs with the built-in MCL engine at several inflation values
+
+    Rather than starting the external mcl program once per graph and
+    inflation value, each graph variant is built once as a sparse matrix and
+    every (graph, inflation) pair is clustered in a pool of worker processes.
+    Clusterings are written to "<graph>_I<inflation*10>.mcl" in the same
+    labelled, one-cluster-per-line format produced by mcl, which is what
+    mcl2rtab.py and graphs2gml.py read.
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore with edges weighted using each
+            BLAST-based metric
+        metrics: An ordered list of metrics used in the met_grf data structure
+        glb_avgs: A dict containing the global average of each metric
+        inflations: A list of inflation values
+        variants: The graph variants to cluster (eg. 'raw_dmnd', 'nrm_dmls')
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID (normalized graphs only)
+        org_avgs: The organism averages graph from compute_global_averages()
+            (normalized graphs only)
+        raw_pref: Prefix for the unnormalized graphs, or None to skip them
+        nrm_pref: Prefix for the normalized graphs, or None to skip them
+        processes: Number of worker processes
+        compress: Compression format for the clustering files, or None
+
+    Returns:
+        A list of the clustering files written
+    """
+    from mclEngine import build_matrix, run_inflation_sweep
+
+    seq_ids, src, dst, cols = get_edge_arrays(met_grf=met_grf,
+                                              metrics=metrics)
+    scalings = get_output_scalings(
+        seq_ids=seq_ids, src=src, dst=dst, metrics=metrics,
+        glb_avgs=glb_avgs, idchar=idchar, org_avgs=org_avgs,
+        raw_pref=raw_pref, nrm_pref=nrm_pref)
+    labels, mat_src, mat_dst = get_matrix_index(seq_ids=seq_ids, src=src,
+                                                dst=dst)
+
+    graphs = dict()
+    tasks = list()
+    for out_name, met, divisor, is_raw in scalings:
+        if not any(out_name.endswith('_'+var+'_'+met) for var in variants):
+            continue
+
+        weights = scale_metric(values=cols[met], met=met, divisor=divisor,
+                               is_raw=is_raw, beg=0, end=len(src))
+        matrix = build_matrix(mat_src, mat_dst, weights, len(labels))
+        graphs[out_name] = (matrix, labels, dict())
+
+        for inflation in inflations:
+            out_path = '{0}_I{1:02d}.mcl'.format(out_name,
+                                                 int(round(inflation*10)))
+            tasks.append((out_name, inflation,
+                          get_output_name(out_path, compress)))
+
+    return run_inflation_sweep(graphs=graphs, tasks=tasks,
+                               processes=processes, compress=compress)
+
+
+def get_matrix_index(seq_ids, src, dst):
+    """Index the sequences that have at least one edge
+
+    Matrix indices follow the order of the sequences in seq_ids, which is the
+    order in which they were first seen (interned), not sequence ID order.
+
+    Returns:
+        labels: A list of sequence IDs, one per matrix index
+        mat_src, mat_dst: Matrix indices for both ends of each edge
+    """
+    used, inverse = np.unique(np.concatenate((src, dst)), return_inverse=True)
+    inverse = inverse.ravel()
+    labels = [seq_ids[idx] for idx in used.tolist()]
+
+    return labels, inverse[:len(src)], inverse[len(src):]
+
+
+def get_output_scalings(seq_ids, src, dst, metrics, glb_avgs, idchar=None,
+                        org_avgs=None, raw_pref=None, nrm_pref=None):
+    """Determine how each output graph is derived from the edge weights
+
+    Returns:
+        A list of (out_name, metric, divisor, is_raw) tuples, one per graph,
+            where out_name lacks a file extension and divisor is either a
+            scalar or an array with one value per edge
+    """
+    scalings = list()
 
-    # Print both DiMensioNeD and DiMensionLesS normalized values
     for met in metrics:
-        glb_avg[met] = org_avgs.node['global'][met+'_avg']
-        handle['dmls_'+met] = open(out_pref+'_dmls_'+met+'.abc', 'w')
-        handle['dmnd_'+met] = open(out_pref+'_dmnd_'+met+'.abc', 'w')
+        if raw_pref:
+            scalings.append((raw_pref+'_dmls_'+met, met,
+                             glb_avgs[met+'_avg'], True))
+            scalings.append((raw_pref+'_dmnd_'+met, met, 1.0, True))
+
+    if nrm_pref:
+        edge_orgs = get_edge_organisms(seq_ids=seq_ids, src=src, dst=dst,
+                                       idchar=idchar, org_avgs=org_avgs)
+
+        # I inverted these fractions from what would be more intuitive to
+        # avoid some small numbers
+        for met in metrics:
+            dmls_scl = get_organism_pair_averages(
+                org_avgs=org_avgs, met=met, edge_orgs=edge_orgs)
+            dmnd_scl = dmls_scl / glb_avgs[met+'_avg']
+            scalings.append((nrm_pref+'_dmls_'+met, met, dmls_scl, False))
+            scalings.append((nrm_pref+'_dmnd_'+met, met, dmnd_scl, False))
+
+    return scalings
+
+
+def scale_metric(values, met, divisor, is_raw, beg, end):
+    """Scale a block of edge weights for one output graph
+
+    Args:
+        values: Edge weights for rows beg to end
+        met: The metric the weights belong to
+        divisor: A scalar, or an array with one value per edge in the graph
+        is_raw: True if the output graph is unnormalized
+
+    Returns:
+        An array of scaled edge weights
+    """
+    if is_raw:
+        if met == 'nle':  # Restore p(BLAST-rounded E-value)s
+            values = np.where(values == 0, float(181), values)
+        return values / divisor
+
+    return values / divisor[beg:end]
+
+
+def get_edge_arrays(met_grf, metrics):
+    """Pull the non-self edges out of a graph as columns
+
+    Returns:
+        seq_ids: A list of sequence IDs
+        src, dst: Arrays of indices into seq_ids for both ends of each edge
+        cols: A dict containing an array of edge weights for each metric
+    """
+    if isinstance(met_grf, EdgeStore):
+        cols = dict((met, met_grf.column(met)) for met in metrics)
+        return (met_grf.seq_ids, met_grf.column('src'), met_grf.column('dst'),
+                cols)
+
+    seq_ids = list()
+    seq_idx = dict()
+    src = array('l')
+    dst = array('l')
+    vals = dict((met, array('d')) for met in metrics)
 
     for qry_id, ref_id, edata in met_grf.edges(data=True):
         if qry_id == ref_id:
             continue
 
-        qry_org = qry_id.split(idchar)[0]
-        ref_org = ref_id.split(idchar)[0]
+        for seq_id, col in ((qry_id, src), (ref_id, dst)):
+            idx = seq_idx.get(seq_id)
+            if idx is None:
+                idx = seq_idx[seq_id] = len(seq_ids)
+                seq_ids.append(seq_id)
+            col.append(idx)
 
-        # I inverted these fractions from what would be more intuitive to avoid
-        # some small numbers
         for met in metrics:
-            dmls_scl = org_avgs[qry_org][ref_org][met+'_avg']
-            dmnd_scl = org_avgs[qry_org][ref_org][met+'_avg'] / glb_avg[met]
+            vals[met].append(edata[met])
 
-            if edata[met]:
-                dmls_met = edata[met] / dmls_scl
-                dmnd_met = edata[met] / dmnd_scl
-            else:  # just in case...
-                err_out = "Found empty {0} value between {1} and {2}.\n" \
-                          .format(met, qry_id, ref_id)
-                sys.stderr.write(err_out)
+    cols = dict((met, np.frombuffer(vals[met], dtype=np.float64))
+                for met in metrics)
+    return (seq_ids, np.array(src, dtype=np.int64),
+            np.array(dst, dtype=np.int64), cols)
 
-            dmls_out = '{0}\t{1}\t{2}\n'.format(qry_id, ref_id, dmls_met)
-            handle['dmls_'+met].write(dmls_out)
 
-            dmnd_out = '{0}\t{1}\t{2}\n'.format(qry_id, ref_id, dmnd_met)
-            handle['dmnd_'+met].write(dmnd_out)
+def get_edge_organisms(seq_ids, src, dst, idchar, org_avgs):
+    """Map both ends of each edge to a row in the organism average matrices
 
-    for met in metrics:
-        handle['dmls_'+met].close()
-        handle['dmnd_'+met].close()
+    Returns:
+        A tuple (org_list, qry_org, ref_org) containing the organism IDs in
+            matrix order and an array of organism indices for each end of
+            each edge
+    """
+    org_list = sorted(org for org in org_avgs.nodes() if org != 'global')
+    org_idx = dict((org, i) for i, org in enumerate(org_list))
+
+    # Split each sequence ID once, rather than once per edge
+    node_org = np.array([org_idx.get(seq_id.split(idchar)[0], -1)
+                         for seq_id in seq_ids], dtype=np.int64)
+
+    return org_list, node_org[src], node_org[dst]
 
 
-def print_connected_component_fasta_files(met_grf, fasta_handle, out_pref):
+def get_organism_pair_averages(org_avgs, met, edge_orgs):
+    """Look up the average score between the organisms connected by each edge
     """
+    org_list, qry_org, ref_org = edge_orgs
+    org_idx = dict((org, i) for i, org in enumerate(org_list))
+
+    avg_mat = np.zeros((len(org_list), len(org_list)), dtype=np.float64)
+    for qry_org_id, ref_org_id, edata in org_avgs.edges(data=True):
+        i = org_idx[qry_org_id]
+        j = org_idx[ref_org_id]
+        avg_mat[i, j] = avg_mat[j, i] = edata[met+'_avg']
+
+    return avg_mat[qry_org, ref_org]
+
+
+def print_connected_component_fasta_files(met_grf, fasta_handle, out_pref,
+                                          max_handles=256, compress=None,
+                                          threads=1):
+    """Split a FASTA file into one file per connected component of the graph
+
+    The FASTA file is streamed once, sending each record to the file for its
+    component, so only one sequence is held in memory at a time. At most
+    max_handles component files are open at once; the least recently used
+    one is closed (and later re-opened for appending) when another is needed.
+
+    Args:
+        met_grf: A NetworkX graph or EdgeStore
+        fasta_handle: An open FASTA file containing the sequences in the graph
+        out_pref: Prefix for the "<out_pref>_comp<N>.fasta" output files
+        max_handles: Maximum number of component files open at once
+        compress: Compression format for the files ('gz', 'bz2', 'zst'), or
+            None to leave them uncompressed (a re-opened file gets another
+            compressed member appended)
+        threads: Number of compression threads per file
+
+    Returns:
+        Nothing
     """
-    from Bio import SeqIO
-    fasta = SeqIO.to_dict(SeqIO.parse(fasta_handle, 'fasta'))
-    w = len(str(len(nx.connected_components(met_grf))))
-    cmp_cnt = 0
-    for comp in nx.connected_components(met_grf):
-        cmp_hdl = open(out_pref+"_comp"+str(cmp_cnt).zfill(w)+".fasta", 'w')
-        for sid in comp:
-            try:
-                cmp_hdl.write(">{0}\n{1}\n".format(sid, fasta[sid].seq))
-            except KeyError:
-                stderr.write("{0} not found in FASTA file\n".format(sid))
+    comp_of, n_comp = get_component_labels(met_grf)
+    w = len(str(n_comp))
+    found = set()
+    started = [False] * n_comp
+    handles = OrderedDict()  # Open component files, least recently used first
+
+    for seq_id, seq in iter_fasta(fasta_handle):
+        comp = comp_of(seq_id)
+        if comp is None:
+            continue
+        found.add(seq_id)
+
+        cmp_hdl = handles.pop(comp, None)
+        if cmp_hdl is None:
+            if len(handles) >= max_handles:
+                handles.popitem(last=False)[1].close()
+            cmp_hdl = open_output(
+                get_output_name(out_pref+"_comp"+str(comp).zfill(w)+".fasta",
+                                compress), 'a' if started[comp] else 'w',
+                compress=compress, threads=threads)
+            started[comp] = True
+        handles[comp] = cmp_hdl
+
+        cmp_hdl.write(">{0}\n{1}\n".format(seq_id, seq))
+
+    for cmp_hdl in handles.values():
         cmp_hdl.close()
-        cmp_cnt += 1
+
+    # Every component gets a file, even if none of its sequences were found
+    for comp in range(n_comp):
+        if not started[comp]:
+            open_output(get_output_name(
+                out_pref+"_comp"+str(comp).zfill(w)+".fasta", compress), 'w',
+                compress=compress).close()
+
+    for seq_id in met_grf.nodes():
+        if seq_id not in found:
+            stderr.write("{0} not found in FASTA file\n".format(seq_id))
+
+
+def iter_fasta(fasta_handle):
+    """Yield (ID, sequence) tuples from a FASTA file, one record at a time
+
+    The ID is the first word of the header line, as in Biopython.
+    """
+    seq_id = None
+    seq = list()
+
+    for line in fasta_handle:
+        line = line.rstrip()
+        if line.startswith('>'):
+            if seq_id is not None:
+                yield seq_id, ''.join(seq)
+            words = line[1:].split(None, 1)
+            seq_id = words[0] if words else ''
+            seq = list()
+        elif seq_id is not None:
+            seq.append(line.replace(' ', ''))
+
+    if seq_id is not None:
+        yield seq_id, ''.join(seq)
 
 
 if __name__ == "__main__":
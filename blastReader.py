@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+"""
+Memory-mapped reader for tabular BLAST output (-outfmt 6 or 7).
+
+Rather than splitting every line into a list of new Python strings, the
+BlastReader class maps the file into memory and locates line and field
+boundaries with NumPy array operations over the raw bytes. Comment and blank
+lines are dropped by masking, and only the requested columns are copied out,
+either as fixed-width byte string arrays or converted to typed arrays. The
+occasional line that is not tab-delimited (eg. space-delimited or indented)
+is split on whitespace instead, as str.split() would.
+
+Pipes, stdin and compressed files can not be mapped, so they are read in
+large blocks and handed to the same block parser.
+"""
+
+import os
+import stat
+import mmap
+
+import numpy as np
+
+from compressedFiles import open_input
+
+
+# Zero-based positions of the fields in '-outfmt "7 std qlen slen"' output
+COLUMNS = dict(qseqid=0, sseqid=1, pident=2, length=3, mismatch=4, gapopen=5,
+               qstart=6, qend=7, sstart=8, send=9, evalue=10, bitscore=11,
+               qlen=12, slen=13)
+
+NEWLINE = ord('\n')
+TAB = ord('\t')
+HASH = ord('#')
+CR = ord('\r')
+WHITESPACE = np.array([ord(char) for char in ' \t\r\x0b\x0c'], dtype=np.uint8)
+
+
+class BlastReader(object):
+    """Column-oriented reader for tab-delimited BLAST files
+
+    Args:
+        source: A path or an open file handle. Regular files are memory
+            mapped; anything else (pipes, stdin, compressed files) is read in
+            blocks.
+        beg: Byte offset at which to start reading (must be the start of a
+            line, regular files only)
+        end: Byte offset at which to stop reading (must be the end of a
+            line, regular files only) [def=end of file]
+        block_size: Number of bytes scanned at a time
+    """
+
+    def __init__(self, source, beg=0, end=None, block_size=1 << 25):
+        self.block_size = block_size
+        self.mm = None
+        self.stream = None
+        self._own_handle = False
+        self.size = None  # Number of bytes to read, if known
+        self.offset = 0  # Number of bytes read so far
+        self._block_beg = 0
+
+        if isinstance(source, str):
+            source = open_input(source, 'rb')
+            self._own_handle = True
+        self.handle = source
+
+        try:
+            fileno = source.fileno()
+            regular = stat.S_ISREG(os.fstat(fileno).st_mode)
+        except (AttributeError, IOError, OSError, ValueError):
+            regular = False
+
+        if regular:
+            size = os.fstat(fileno).st_size
+            self.beg = beg
+            self.end = size if end is None else min(end, size)
+            self.size = max(self.end - self.beg, 0)
+            if self.end > self.beg:
+                self.mm = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        else:
+            # Text mode handles in Python 3 keep the raw bytes in .buffer
+            self.stream = getattr(source, 'buffer', source)
+
+    def close(self):
+        """Release the memory map (and the file, if it was opened here)"""
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self._own_handle:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def iter_chunks(self, columns, chunk_size=100000):
+        """Yield the requested columns for up to chunk_size hits at a time
+
+        Args:
+            columns: A dict keyed by zero-based column index, with the NumPy
+                dtype each column should be converted to as values (None
+                keeps the fixed-width byte strings, eg. for sequence IDs)
+            chunk_size: Maximum number of hits per chunk
+
+        Yields:
+            A dict keyed by column index containing one array per column
+
+        The offset attribute holds the number of bytes read up to the end of
+        the chunk most recently yielded.
+        """
+        for buf in self._iter_blocks():
+            starts, ends = find_data_lines(buf)
+            for i in range(0, len(starts), chunk_size):
+                chunk = extract_columns(buf, starts[i:i+chunk_size],
+                                        ends[i:i+chunk_size], columns)
+                self.offset = self._block_beg + int(ends[i:i+chunk_size][-1])
+                yield chunk
+            self.offset = self._block_beg + len(buf)
+
+    def _iter_blocks(self):
+        """Yield uint8 arrays holding whole lines, block_size bytes at a time
+        """
+        if self.mm is not None:
+            pos = self.beg
+            while pos < self.end:
+                stop = min(pos + self.block_size, self.end)
+                if stop < self.end:
+                    nl_pos = self.mm.rfind(b'\n', pos, stop)
+                    if nl_pos < 0:  # A single line longer than the block
+                        nl_pos = self.mm.find(b'\n', stop, self.end)
+                    stop = self.end if nl_pos < 0 else nl_pos + 1
+
+                # A view into the mapped file, not a copy
+                self._block_beg = pos - self.beg
+                yield np.frombuffer(self.mm, dtype=np.uint8,
+                                    count=stop-pos, offset=pos)
+                pos = stop
+
+        elif self.stream is not None:
+            carry = b''
+            while True:
+                data = self.stream.read(self.block_size)
+                if not isinstance(data, bytes):
+                    data = data.encode('utf-8')
+                if not data:
+                    break
+                data = carry + data
+                nl_pos = data.rfind(b'\n')
+                if nl_pos < 0:
+                    carry = data
+                    continue
+                carry = data[nl_pos+1:]
+                yield np.frombuffer(data, dtype=np.uint8, count=nl_pos+1)
+                self._block_beg += nl_pos + 1
+
+            if carry:
+                yield np.frombuffer(carry, dtype=np.uint8)
+
+
+def find_data_lines(buf):
+    """Locate the non-blank, non-comment lines in a block of bytes
+
+    Returns:
+        starts, ends: Arrays with the offset of the first byte of each line
+            and the offset just past its last byte (excluding line endings)
+    """
+    nl_pos = np.flatnonzero(buf == NEWLINE)
+    if len(buf) and buf[-1] != NEWLINE:  # Final line lacks a line ending
+        nl_pos = np.append(nl_pos, len(buf))
+
+    starts = np.empty(len(nl_pos), dtype=np.int64)
+    starts[:1] = 0
+    starts[1:] = nl_pos[:-1] + 1
+    ends = nl_pos.astype(np.int64)
+
+    # Drop carriage returns from DOS line endings
+    has_cr = ends > starts
+    has_cr[has_cr] = buf[ends[has_cr]-1] == CR
+    ends -= has_cr
+
+    keep = ends > starts
+    keep[keep] = buf[starts[keep]] != HASH
+
+    # Indented lines are blank or comments if their first word is
+    indented = keep.copy()
+    indented[keep] = np.isin(buf[starts[keep]], WHITESPACE)
+    for i in np.flatnonzero(indented).tolist():
+        line = buf[starts[i]:ends[i]].tobytes().strip()
+        if not line or line.startswith(b'#'):
+            keep[i] = False
+
+    return starts[keep], ends[keep]
+
+
+def extract_columns(buf, starts, ends, columns):
+    """Copy selected tab-delimited fields out of a block of lines
+
+    Lines with too few tabs or starting with whitespace are split on runs of
+    whitespace instead, like str.split(), which is slower but rarely needed.
+
+    Args:
+        buf: A uint8 array containing whole lines
+        starts, ends: Line boundaries as returned by find_data_lines()
+        columns: A dict keyed by zero-based column index, with the dtype for
+            each column as values (None keeps the raw byte strings)
+
+    Returns:
+        A dict keyed by column index containing one array per column
+    """
+    tabs = np.flatnonzero(buf == TAB)
+    first_tab = np.searchsorted(tabs, starts)
+    tab_cnts = np.searchsorted(tabs, ends) - first_tab
+
+    is_split = tab_cnts < max(columns)
+    is_split |= np.isin(buf[starts], WHITESPACE)
+    split_rows = [buf[beg:end].tobytes().split() for beg, end in
+                  zip(starts[is_split].tolist(), ends[is_split].tolist())]
+    for row in split_rows:
+        if len(row) <= max(columns):
+            raise ValueError(("Expected at least {0} columns in BLAST " +
+                              "line: {1}").format(
+                                  max(columns)+1,
+                                  b' '.join(row).decode('utf-8', 'replace')))
+
+    is_tab = ~is_split
+    starts = starts[is_tab]
+    ends = ends[is_tab]
+    first_tab = first_tab[is_tab]
+    tab_cnts = tab_cnts[is_tab]
+
+    chunk = dict()
+    for col, dtype in columns.items():
+        if col == 0:
+            fld_beg = starts
+        else:
+            fld_beg = tabs[first_tab + col - 1] + 1
+
+        is_last = tab_cnts == col
+        fld_end = ends.copy()
+        fld_end[~is_last] = tabs[first_tab[~is_last] + col]
+
+        fields = gather_fields(buf, fld_beg, fld_end)
+        if split_rows:
+            split_fields = np.array([row[col] for row in split_rows])
+            merged = np.empty(len(is_split), dtype='S{0}'.format(max(
+                fields.itemsize, split_fields.itemsize)))
+            merged[is_tab] = fields
+            merged[is_split] = split_fields
+            fields = merged
+        if dtype is not None:
+            fields = fields.astype(dtype)
+        chunk[col] = fields
+
+    return chunk
+
+
+def gather_fields(buf, beg, end):
+    """Copy byte ranges out of a buffer into a fixed-width byte string array
+    """
+    lens = end - beg
+    width = int(lens.max()) if len(lens) else 0
+    if width == 0:
+        return np.zeros(len(lens), dtype='S1')
+
+    offs = np.arange(width)
+    idx = np.minimum(beg[:, None] + offs, len(buf) - 1)
+    mat = np.where(offs < lens[:, None], buf[idx], 0).astype(np.uint8)
+
+    return np.ascontiguousarray(mat).view('S{0}'.format(width)).ravel()
+
+
+def decode_ids(ids):
+    """Convert an array of byte string IDs to a list of Python strings
+
+    Each distinct ID is decoded once, so repeated IDs share a single string.
+    """
+    uniq, inverse = np.unique(ids, return_inverse=True)
+    if str is bytes:  # Python 2
+        uniq = uniq.tolist()
+    else:
+        uniq = [seq_id.decode('utf-8') for seq_id in uniq.tolist()]
+
+    return [uniq[i] for i in inverse.ravel().tolist()]
+
+
+def encode_ids(ids):
+    """Convert a list of Python strings to a fixed-width byte string array
+
+    The inverse of decode_ids(), eg. for saving sequence IDs with NumPy.
+    """
+    if str is bytes:  # Python 2
+        return np.array(ids, dtype=bytes)
+    return np.array([seq_id.encode('utf-8') for seq_id in ids], dtype=bytes)
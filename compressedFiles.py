@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+"""
+Transparent reading and multithreaded writing of compressed files.
+
+BLAST output, FASTA files, abc graphs and MCL clusterings are all plain text
+that compresses several fold, which matters when they live on network
+storage. Inputs compressed with gzip, bzip2 or zstd are recognised by their
+magic bytes (not their names) and decompressed on the fly by open_input(),
+or by the InputFileType argparse type, so every program in this package
+reads them exactly like uncompressed files.
+
+Outputs are compressed by BlockCompressedWriter, which cuts the written text
+into large blocks and compresses each block independently in a pool of
+threads (zlib, bz2 and zstandard all release the GIL while compressing), in
+the same way as pigz or "zstd -T". Each block becomes a complete gzip member,
+bzip2 stream or zstd frame, and since all three formats allow concatenated
+members, the output is an ordinary file that gzip, bzip2, zstd and Python
+read as a whole.
+
+zstd support needs the optional zstandard module.
+"""
+
+import io
+import os
+import sys
+import bz2
+import zlib
+import argparse
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+
+FORMATS = ('gz', 'bz2', 'zst')
+
+MAGIC = (('gz', b'\x1f\x8b'),
+         ('bz2', b'BZh'),
+         ('zst', b'\x28\xb5\x2f\xfd'))
+
+DEFAULT_LEVELS = dict(gz=6, bz2=9, zst=3)
+
+
+def get_zstandard():
+    """Import the optional zstandard module"""
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compressed files require the zstandard " +
+                          "module (pip install zstandard)")
+    return zstandard
+
+
+def detect_compression(path):
+    """Identify the compression format of a file from its first bytes
+
+    Returns:
+        'gz', 'bz2' or 'zst', or None for anything else (including files
+        that can not be read, such as pipes)
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'rb') as handle:
+        head = handle.read(4)
+    for compress, magic in MAGIC:
+        if head.startswith(magic):
+            return compress
+    return None
+
+
+def get_output_name(path, compress):
+    """Add the suffix for a compression format (if any) to a file name"""
+    if compress is None:
+        return path
+    return path + '.' + compress
+
+
+def strip_compression_suffix(path):
+    """Remove a .gz, .bz2 or .zst suffix from a file name"""
+    for compress in FORMATS:
+        if path.endswith('.' + compress):
+            return path[:-len(compress)-1]
+    return path
+
+
+class CompressedBinaryFile(io.BufferedReader):
+    """Buffered binary reader over a decompressing stream
+
+    Reports the name of the compressed file, and refuses fileno() so that
+    nothing memory maps or seeks the compressed bytes by mistake.
+    """
+
+    def __init__(self, raw, name, compression):
+        io.BufferedReader.__init__(self, raw)
+        self._name = name
+        self.compression = compression
+
+    @property
+    def name(self):
+        return self._name
+
+    def fileno(self):
+        raise io.UnsupportedOperation('compressed file has no usable fileno')
+
+
+class CompressedTextFile(io.TextIOWrapper):
+    """Text reader over a CompressedBinaryFile"""
+
+    def __init__(self, buffer, name, compression):
+        io.TextIOWrapper.__init__(self, buffer)
+        self._name = name
+        self.compression = compression
+
+    @property
+    def name(self):
+        return self._name
+
+    def fileno(self):
+        raise io.UnsupportedOperation('compressed file has no usable fileno')
+
+
+def open_input(path, mode='r'):
+    """Open a file for reading, decompressing it if needed
+
+    Args:
+        path: Path to a plain, gzip, bzip2 or zstd compressed file
+        mode: 'r' for text or 'rb' for bytes
+
+    Returns:
+        A file object. Compressed files have a compression attribute holding
+        their format.
+    """
+    compress = detect_compression(path)
+    if compress is None:
+        return open(path, mode)
+
+    if compress == 'gz':
+        import gzip
+        raw = gzip.GzipFile(path, 'rb')
+    elif compress == 'bz2':
+        raw = bz2.BZ2File(path, 'rb')
+    else:
+        zstandard = get_zstandard()
+        raw = zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True)
+
+    handle = CompressedBinaryFile(raw, path, compress)
+    if 'b' in mode or str is bytes:  # Python 2 str is bytes
+        return handle
+    return CompressedTextFile(handle, path, compress)
+
+
+def rewind_input(handle):
+    """Return a handle positioned at the start of a file for another pass
+
+    Handles that can not seek backwards (eg. zstd streams) are re-opened.
+    """
+    try:
+        handle.seek(0)
+        return handle
+    except (IOError, OSError, ValueError):
+        if not os.path.isfile(handle.name):
+            raise
+    handle.close()
+    return open_input(handle.name, getattr(handle, 'mode', 'r'))
+
+
+class InputFileType(object):
+    """argparse type opening a possibly compressed file for reading
+
+    Works like argparse.FileType('r'), including '-' for stdin.
+    """
+
+    def __init__(self, mode='r'):
+        self.mode = mode
+
+    def __call__(self, string):
+        if string == '-':
+            if 'b' in self.mode:
+                return getattr(sys.stdin, 'buffer', sys.stdin)
+            return sys.stdin
+        try:
+            return open_input(string, self.mode)
+        except (IOError, OSError, ImportError) as err:
+            raise argparse.ArgumentTypeError(
+                "can't open '{0}': {1}".format(string, err))
+
+    def __repr__(self):
+        return 'InputFileType({0!r})'.format(self.mode)
+
+
+def open_output(path, mode='w', compress=None, threads=1, level=None):
+    """Open a file for writing, compressing it if a format is given
+
+    Args:
+        path: Path of the file, used as is (see get_output_name())
+        mode: 'w' to truncate or 'a' to append, with or without 'b'
+        compress: 'gz', 'bz2', 'zst' or None for an uncompressed file
+        threads: Number of threads compressing blocks in parallel
+        level: Compression level [def=format default]
+
+    Returns:
+        A file object accepting both str and bytes when compressed
+    """
+    if compress is None:
+        return open(path, mode)
+    return BlockCompressedWriter(path, compress=compress, mode=mode,
+                                 threads=threads, level=level)
+
+
+class BlockCompressedWriter(object):
+    """File object compressing blocks of its output in a pool of threads
+
+    Written data is collected into blocks of block_size bytes. Each full
+    block is handed to a thread pool shared by all writers using the same
+    number of threads, and the compressed blocks are written in order, with
+    at most two blocks per thread in flight.
+
+    Args:
+        path: Path of the output file
+        compress: 'gz', 'bz2' or 'zst'
+        mode: 'w' to truncate or 'a' to append a new member to the file
+        threads: Number of compression threads (1 compresses inline)
+        level: Compression level [def=format default]
+        block_size: Number of uncompressed bytes per block
+    """
+
+    def __init__(self, path, compress, mode='w', threads=1, level=None,
+                 block_size=1 << 22):
+        if compress not in FORMATS:
+            raise ValueError("Unknown compression format " + str(compress))
+        if compress == 'zst':
+            get_zstandard()  # Fail before creating the file
+
+        self.name = path
+        self.mode = mode
+        self.compress = compress
+        self.level = DEFAULT_LEVELS[compress] if level is None else level
+        self.block_size = block_size
+        self.threads = max(threads, 1)
+        self.closed = False
+        self.handle = open(path, 'ab' if 'a' in mode else 'wb')
+        self._pool = get_thread_pool(self.threads) if self.threads > 1 \
+            else None
+        self._blocks = list()
+        self._buf_len = 0
+        self._pending = deque()  # Compressed blocks not yet written
+        self._n_blocks = 0
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self._blocks.append(data)
+        self._buf_len += len(data)
+        if self._buf_len >= self.block_size:
+            self._submit()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        """Write every compressed block (the partial block is kept)"""
+        while self._pending:
+            self.handle.write(self._pending.popleft().get())
+        self.handle.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buf_len or (self._n_blocks == 0 and 'a' not in self.mode):
+            self._submit()  # An empty file still gets one empty member
+        self.flush()
+        self.handle.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _submit(self):
+        """Compress the buffered data as one block"""
+        block = b''.join(self._blocks)
+        self._blocks = list()
+        self._buf_len = 0
+        self._n_blocks += 1
+
+        if self._pool is None:
+            self.handle.write(compress_block(block, self.compress,
+                                             self.level))
+            return
+
+        self._pending.append(self._pool.apply_async(
+            compress_block, (block, self.compress, self.level)))
+        while len(self._pending) > 2 * self.threads:
+            self.handle.write(self._pending.popleft().get())
+
+
+def compress_block(data, compress, level):
+    """Compress a block of bytes into a complete gzip member, bzip2 stream
+    or zstd frame"""
+    if compress == 'gz':
+        comp = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip header
+        return comp.compress(data) + comp.flush()
+    elif compress == 'bz2':
+        return bz2.compress(data, level)
+    return get_zstandard().ZstdCompressor(level=level).compress(data)
+
+
+# Thread pools shared by all writers, keyed by their number of threads
+_thread_pools = dict()
+
+
+def get_thread_pool(threads):
+    """Return the shared pool with the given number of threads"""
+    pool = _thread_pools.get(threads)
+    if pool is None:
+        pool = _thread_pools[threads] = ThreadPool(threads)
+    return pool
@@ -125,54 +125,66 @@ do
          2>&1 >> $log
     echo >> $log
 
+    ############################################################################
+    #  E-value cutoffs (as exponents), loosest first
+    ############################################################################
+    #exponents=$(seq 3 2 5)
+    exponents=5
+    cutoffs=$(for e in $exponents; do echo "1e-${e}"; done)
+    loosest=$(echo "$cutoffs" | head -n 1)
+
+    ############################################################################
+    #  ...BLAST data set against itself once, with the loosest cutoff
+    ############################################################################
+    blastp=${fasta%.fasta}_${loosest}.blastp
+    date >> $log
+    echo "BLAST'ing ${fasta} with max evalue cutoff ${loosest}" >> $log
+    nice blastp \
+         -query ${dir2}/${fasta} \
+         -db ${dir2}/${fasta} \
+         -out $blastp \
+         -outfmt '7 std qlen slen' \
+         -evalue $loosest \
+         -soft_masking true \
+         -num_threads 8 \
+         2>&1 >> $log
+    echo >> $log
+
+    ############################################################################
+    #  ...generate a set of MCL-formatted abc graphs for every cutoff from
+    #  that one BLAST file
+    ############################################################################
+    date >> $log
+    echo "Generating abc graphs from ${blastp} for MCL with cutoffs:" >> $log
+    echo $cutoffs >> $log
+    nice ${dir0}/blast2graphs.py \
+         $blastp \
+         ${fasta%.fasta} \
+         --mci \
+         --fasta ${dir2}/$fasta \
+         --evalue_cutoffs $cutoffs
+    echo >> $log
+
     ############################################################################
     #  For each E-value...
     ############################################################################
-    #for e in $(seq 5 -2 3)
-    for e in 5
+    for cutoff in $cutoffs
     do
 
         ########################################################################
-        #  Determine BLAST output name from E-value
-        #  Create subdirectory and change into it to analyze this BLAST run
+        #  Determine graph file prefix from E-value
+        #  Create subdirectory and move this cutoff's graphs into it
         ########################################################################
-        cutoff="1e-${e}"
+        graph_pref=${fasta%.fasta}_${cutoff}
         dir3=${dir2}/${cutoff}
         date >> $log
         echo "Creating and moving into subdirectory" >> $log
         echo $dir3 >> $log
         mkdir -p $dir3
-        blastp=${fasta%.fasta}_${cutoff}.blastp
+        mv ${graph_pref}_*.abc ${graph_pref}_*.mci ${graph_pref}.tab $dir3/
         cd $dir3
         echo >> $log
 
-        ########################################################################
-        #  ...BLAST data set against itself
-        ########################################################################
-        date >> $log
-        echo "BLAST'ing ${fasta} with max evalue cutoff 1e-${e}" >> $log
-        nice blastp \
-             -query ${dir2}/${fasta} \
-             -db ${dir2}/${fasta} \
-             -out $blastp \
-             -outfmt '7 std qlen slen' \
-             -evalue $cutoff \
-             -soft_masking true \
-             -num_threads 8 \
-             2>&1 >> $log
-        echo >> $log
-
-        ########################################################################
-        #  ...generate a set of MCL-formatted abc graphs
-        ########################################################################
-        date >> $log
-        echo "Generating abc graphs from ${blastp} for MCL" >> $log
-        nice ${dir0}/blast2graphs.py \
-             $blastp \
-             ${blastp%.blastp} \
-             --fasta ${dir2}/$fasta
-        echo >> $log
-
         ########################################################################
         #  Move connected component FASTA files into new directory
         ########################################################################
@@ -180,7 +192,7 @@ do
         echo "Creating and moving connected component FASTA files into" >> $log
         echo "${dir3}/comp_fastas" >> $log
         mkdir -p ${dir3}/comp_fastas
-        mv ${blastp%.blastp}_comp*.fasta ${dir3}/comp_fastas
+        mv ${dir2}/${graph_pref}_comp*.fasta ${dir3}/comp_fastas
         echo "Moving into subdirectory" >> $log
         echo ${dir3}/comp_fastas
         cd comp_fastas
@@ -250,12 +262,15 @@ do
             #  Create subdirectory and change into it
             ####################################################################
             dir4=${dir3}/${norm}
-            abc_pref=${blastp%.blastp}_${norm}
+            abc_pref=${graph_pref}_${norm}
             date >> $log
             echo "Creating and moving into subdirectory:" >> $log
             echo $dir4 >> $log
             mkdir -p $dir4
             mv ${abc_pref}_???.abc ${dir4}/
+            mv ${abc_pref}_???.mci ${dir4}/
+            tab=${dir4}/${graph_pref}.tab
+            cp ${graph_pref}.tab $tab
             cd $dir4
             echo >> $log
 
@@ -265,17 +280,12 @@ do
             for metric in nle bit bsr bal
             do
                 abc=${abc_pref}_${metric}.abc
-#                mci=${abc_pref}_${metric}.mci
+                # Pre-indexed matrix written by blast2graphs.py --mci, so MCL
+                # does not need to re-parse the abc file for every inflation
+                mci=${abc_pref}_${metric}.mci
                 date >> $log
                 echo "Creating clusters from:" >> $log
-                echo $abc >> $log
-#                echo "Converting abc to mci file"
-#                nice mcxload \
-#                    --stream-mirror \
-#                    --write-binary \
-#                    -abc $abc \
-#                    -o $mci
-#                echo >> $log
+                echo $mci >> $log
 
                 ################################################################
                 #  For each inflation parameter...
@@ -292,7 +302,7 @@ do
                     echo "Running MCL with inflation parameter ${i1}.${i2}" \
                          >> $log
                     nice mcl \
-                         $abc --abc \
+                         $mci -use-tab $tab \
                          -I ${i1}.${i2} \
                          -o ${abc%.abc}_I${I}.mcl \
                          2>&1 >> $log
@@ -305,7 +315,7 @@ do
             #  Announce completion of this batch of MCL jobs
             ####################################################################
             date >> $log
-            echo "Finished all MCL jobs for ${blastp}!" >> $log
+            echo "Finished all MCL jobs for ${graph_pref}!" >> $log
             echo >> $log
 
             ####################################################################
@@ -322,7 +332,7 @@ do
             echo "Generating stacked barchart PDFs for:" >> $log
             echo ${abc_pref} >> $log
             nice ${dir0}/barcharts.R \
-                 ${abc_pref}_*.Rtab
+                 ${abc_pref}_kog_summary.Rtab
             echo >> $log
 
             ####################################################################
@@ -335,7 +345,7 @@ do
                  --gexf \
                  --graphml \
                  --compress bz2 \
-                 --blast ${dir3}/${blastp} \
+                 --blast ${dir2}/${blastp} \
                  --graphs ${abc_pref}_???.abc \
                  --clusterings ${abc_pref}_???_I??.mcl \
                  --out_pref $abc_pref
@@ -1,12 +1,24 @@
 #!/usr/bin/env python
 
 
+import os
 import sys
+import json
+import time
 import argparse
-from copy import deepcopy
+import binascii
+from collections import deque
 
+import numpy as np
 from Bio import SeqIO
-from numpy.random import seed, random_integers, shuffle
+
+from compressedFiles import (InputFileType, open_output, get_output_name,
+                             rewind_input)
+
+
+# Output files: fragmentation scheme applied in organism order ('ord') or
+# shuffled within each KOG ('shf'), and even ('evn') or random ('rnd') breaks
+LAYOUTS = ('ord_evn', 'ord_rnd', 'shf_evn', 'shf_rnd')
 
 
 def main(argv=None):
@@ -21,41 +33,50 @@ def main(argv=None):
 
     args = get_parsed_args()
 
-    seed(42)
-    eck, orgs, min_len = import_fasta(args.fasta)
-    scheme = fit_string_to_length(str(args.scheme), len(orgs))
-    scheme_list = [int(x) for x in scheme]
-    min_frag = calculate_minimum_fragment_length(min_len, max(scheme_list))
-
-    handle_pref = str(args.prefix) + '_' + scheme
-    oe_handle = open(handle_pref + "_ord_evn.fasta", "w")
-    or_handle = open(handle_pref + "_ord_rnd.fasta", "w")
-    se_handle = open(handle_pref + "_shf_evn.fasta", "w")
-    sr_handle = open(handle_pref + "_shf_rnd.fasta", "w")
-
-    for kog_id in sorted(eck.keys()):
-
-        ord_scheme = deepcopy(scheme_list)
-        shf_scheme = shuffled_scheme(scheme_list, orgs, eck[kog_id])
-
-        for org_id in sorted(eck[kog_id].keys()):
-            ord_pieces = ord_scheme.pop()
-
-            for seq_id in sorted(eck[kog_id][org_id].keys()):
-                # seq_info contains a tuple that is unpacked by the * operator
-                seq_info = eck[kog_id][org_id][seq_id]
-
-                even_split(oe_handle, ord_pieces, seq_id, *seq_info)
-                rand_split(or_handle, ord_pieces, min_frag, seq_id, *seq_info)
-
-                shf_pieces = shf_scheme.pop()
-                even_split(se_handle, shf_pieces, seq_id, *seq_info)
-                rand_split(sr_handle, shf_pieces, min_frag, seq_id, *seq_info)
-
-    oe_handle.close()
-    or_handle.close()
-    se_handle.close()
-    sr_handle.close()
+    if args.stream:
+        # One pass for the organisms and shortest length, then a second
+        # that reads and fragments one KOG at a time. KOGs are checked for
+        # contiguity in the first pass, before any output is written.
+        try:
+            orgs, min_len = scan_fasta(args.fasta)
+        except ValueError as err:
+            sys.stderr.write(str(err) + "\n")
+            return 1
+        kog_groups = iter_kog_groups(rewind_input(args.fasta))
+    else:
+        eck, orgs, min_len = import_fasta(args.fasta)
+        kog_groups = ((kog_id, eck[kog_id]) for kog_id in sorted(eck.keys()))
+
+    # Every scheme and replicate is generated from the same parsed KOGs
+    datasets = get_datasets(args.scheme, args.replicates, orgs, min_len,
+                            args.prefix)
+    for dataset in datasets:
+        dataset['handles'] = [
+            open_fasta_output(dataset['files'][layout], args)
+            for layout in LAYOUTS]
+        dataset['fragments'] = dict((layout, 0) for layout in LAYOUTS)
+
+    counts = dict(kogs=0, sequences=0)
+    kog_groups = count_kog_groups(kog_groups, counts)
+
+    # Each KOG draws from its own random stream, so its fragments do not
+    # depend on the other KOGs in the file or the process handling it
+    for dataset_blocks in fragment_kogs(
+            kog_groups, [(dataset['scheme_list'], dataset['min_frag'],
+                          dataset['replicate']) for dataset in datasets],
+            orgs, args.seed, processes=args.jobs):
+        for dataset, blocks in zip(datasets, dataset_blocks):
+            for handle, layout, text in zip(dataset['handles'], LAYOUTS,
+                                            blocks):
+                handle.write(text)
+                dataset['fragments'][layout] += text.count('>')
+
+    for dataset in datasets:
+        for handle in dataset.pop('handles'):
+            handle.close()
+        write_manifest(dataset, args, orgs, counts)
+
+    return 0
 
 
 def get_parsed_args():
@@ -90,26 +111,81 @@ def get_parsed_args():
                     "scheme shuffled within each KOG in an effort to " +
                     "minimize per-organism effects.")
 
-    parser.add_argument('fasta', type=argparse.FileType('r'),
-                        help="Reformatted COG, KOG, or CEGMA FASTA file")
+    parser.add_argument('fasta', type=InputFileType('r'),
+                        help="Reformatted COG, KOG, or CEGMA FASTA file " +
+                             "(may be compressed with gzip, bzip2 or zstd)")
 
-    parser.add_argument('scheme', type=int,
-                        help="An integer encoding the fragmentation scheme " +
+    parser.add_argument('scheme', type=int, nargs='+',
+                        help="One or more integers encoding fragmentation " +
+                             "schemes " +
                              "usig one digit per organism, where the " +
                              "organism order is: Agamb, Athal, Celeg, " +
                              "Cinte, Crein, Dmela, Ecuni, Hsapi, Scere, " +
                              "Spomb, Tgond. Integers that are not eleven " +
                              "digits will be either repeated or truncated, " +
-                             "as necessary.")
+                             "as necessary. Every digit must be 1-9 (the " +
+                             "number of pieces). The FASTA file is read " +
+                             "once for all schemes.")
 
     parser.add_argument('prefix', default="eck",
                         help="Prefix for output files [def='eck']")
 
+    parser.add_argument('--stream', dest='stream', default=False,
+                        action='store_true',
+                        help="Read the FASTA file one KOG at a time instead " +
+                             "of loading all of it, which requires the " +
+                             "records of each KOG to be contiguous; KOGs are " +
+                             "written in file order rather than sorted. The " +
+                             "file is read twice, so it can not be a pipe " +
+                             "or stdin")
+
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1,
+                        help="Number of processes fragmenting KOGs in " +
+                             "parallel (the output does not depend on it) " +
+                             "[def=1]")
+
+    parser.add_argument('--replicates', dest='replicates', type=int,
+                        default=1,
+                        help="Number of replicate data sets per scheme, each " +
+                             "with its own random breaks and shuffling; with " +
+                             "more than one, file names get a '_r##' " +
+                             "replicate number [def=1]")
+
+    parser.add_argument('--seed', dest='seed', type=int, default=42,
+                        help="Seed from which the random stream of each KOG " +
+                             "is derived [def=42]")
+
+    parser.add_argument('--compress', dest='compress', default=None,
+                        choices=['gz', 'bz2', 'zst'],
+                        help="Compress the output FASTA files with gzip, " +
+                             "bzip2 or zstd [def=None]")
+
+    parser.add_argument('--compress_threads', dest='compress_threads',
+                        type=int, default=4,
+                        help="Number of threads compressing each output " +
+                             "file [def=4]")
+
     args = parser.parse_args()
 
+    for scheme in args.scheme:
+        if not is_valid_scheme(scheme):
+            parser.error("Invalid fragmentation scheme " + str(scheme) +
+                         ": every digit must be 1-9, the number of pieces " +
+                         "for an organism's sequences")
+
+    if args.stream and not os.path.isfile(args.fasta.name):
+        parser.error("--stream reads the FASTA file twice, so it must be a " +
+                     "regular file rather than a pipe or stdin")
+
     return args
 
 
+def open_fasta_output(path, args):
+    """Open an output FASTA file, compressed if requested"""
+    return open_output(get_output_name(path, args.compress), 'w',
+                       compress=args.compress, threads=args.compress_threads)
+
+
 def import_fasta(fasta):
     """Import entire ECK database into a Python dictionary
 
@@ -141,6 +217,83 @@ def import_fasta(fasta):
     return eck, orgs, min_len
 
 
+def scan_fasta(fasta):
+    """Find the organisms and shortest sequence length of a FASTA file
+
+    Only the headers and line lengths are looked at, so no sequences are
+    kept in memory.
+
+    Raises
+    ------
+    ValueError
+        If the records of a KOG are not contiguous
+    """
+    orgs = set()
+    min_len = float("inf")
+    seq_len = None
+    kog_id = None
+    done = set()
+
+    for line in fasta:
+        if line.startswith('>'):
+            if seq_len is not None:
+                min_len = min(min_len, seq_len)
+            seq_id = line[1:].split()[0]
+            orgs.add(seq_id.split('|')[0])
+            seq_len = 0
+
+            rec_kog_id = seq_id.split('___')[1]
+            if rec_kog_id != kog_id:
+                done.add(kog_id)
+                if rec_kog_id in done:
+                    raise ValueError(get_contiguity_message(rec_kog_id))
+                kog_id = rec_kog_id
+        elif seq_len is not None:
+            seq_len += len(''.join(line.split()))
+    if seq_len is not None:
+        min_len = min(min_len, seq_len)
+
+    return list(sorted(orgs)), min_len
+
+
+def iter_kog_groups(fasta):
+    """Read a FASTA file one KOG at a time
+
+    Yields (kog_id, kog_dict) in file order, where kog_dict is keyed by
+    organism ID and then sequence ID like the KOGs in import_fasta().
+
+    Raises
+    ------
+    ValueError
+        If the records of a KOG are not contiguous
+    """
+    kog_id = None
+    kog_dict = None
+    done = set()
+
+    for record in SeqIO.parse(fasta, 'fasta'):
+        rec_kog_id, org_id, seq_id, seq_len, seq = sequence_info(record)
+        if rec_kog_id != kog_id:
+            if kog_dict is not None:
+                yield kog_id, kog_dict
+                done.add(kog_id)
+            if rec_kog_id in done:
+                raise ValueError(get_contiguity_message(rec_kog_id))
+            kog_id = rec_kog_id
+            kog_dict = dict()
+
+        kog_dict.setdefault(org_id, dict())[seq_id] = (seq_len, seq)
+
+    if kog_dict is not None:
+        yield kog_id, kog_dict
+
+
+def get_contiguity_message(kog_id):
+    """Error message for a KOG whose records are not contiguous"""
+    return ("The records of " + kog_id + " are not contiguous; group the " +
+            "FASTA file by KOG or run without --stream")
+
+
 def sequence_info(record):
     """Mine info from a SeqIO sequence object
 
@@ -161,17 +314,106 @@ def fit_string_to_length(string, length):
     Modified from a post by Jason Scheirer:
     http://stackoverflow.com/questions/3391076/repeat-string-to-certain-length
     """
-    return (string*((length/len(string))+1))[:length]
+    return (string*((length//len(string))+1))[:length]
 
 
 def calculate_minimum_fragment_length(min_len, max_frags):
     """
     """
-    min_even = min_len / max_frags
+    min_even = min_len // max_frags
     return min(10, min_even)
 
 
-def shuffled_scheme(scheme_list, orgs, kog_dict):
+def is_valid_scheme(scheme):
+    """Check that every digit of a scheme is a number of pieces from 1-9"""
+    return str(scheme).isdigit() and '0' not in str(scheme)
+
+
+def get_datasets(schemes, replicates, orgs, min_len, prefix):
+    """Describe the data set generated for each scheme and replicate
+
+    Schemes that are the same once fitted to the number of organisms are
+    only generated once.
+
+    Returns
+    -------
+    list of dict
+        One per data set, with its scheme (as a string and a list), minimum
+        random fragment length, zero-based replicate number, file prefix and
+        output file name for each of LAYOUTS
+
+    Raises
+    ------
+    ValueError
+        If a scheme has a digit that is not a number of pieces (0)
+    """
+    datasets = list()
+    seen = set()
+    for scheme in schemes:
+        if not is_valid_scheme(scheme):
+            raise ValueError("Invalid fragmentation scheme " + str(scheme) +
+                             ": every digit must be 1-9")
+        scheme = fit_string_to_length(str(scheme), len(orgs))
+        if scheme in seen:
+            continue
+        seen.add(scheme)
+        scheme_list = [int(x) for x in scheme]
+        min_frag = calculate_minimum_fragment_length(min_len,
+                                                     max(scheme_list))
+
+        for replicate in range(replicates):
+            dataset_pref = str(prefix) + '_' + scheme
+            if replicates > 1:
+                dataset_pref += '_r{0:02d}'.format(replicate+1)
+            datasets.append(dict(
+                scheme=scheme, scheme_list=scheme_list, min_frag=min_frag,
+                replicate=replicate, prefix=dataset_pref,
+                files=dict((layout, dataset_pref+'_'+layout+".fasta")
+                           for layout in LAYOUTS)))
+
+    return datasets
+
+
+def count_kog_groups(kog_groups, counts):
+    """Pass on (kog_id, kog_dict) pairs, counting KOGs and sequences"""
+    for kog_id, kog_dict in kog_groups:
+        counts['kogs'] += 1
+        counts['sequences'] += sum(len(org_seqs) for org_seqs in
+                                   kog_dict.values())
+        yield kog_id, kog_dict
+
+
+def write_manifest(dataset, args, orgs, counts):
+    """Write the parameters and contents of a data set as JSON
+
+    The manifest, <dataset prefix>_manifest.json, records everything needed
+    to regenerate the data set and the number of fragments in each file.
+    """
+    files = dict((layout, get_output_name(name, args.compress))
+                 for layout, name in dataset['files'].items())
+    info = dict(
+        fasta=args.fasta.name, scheme=dataset['scheme'], orgs=orgs,
+        replicate=dataset['replicate']+1, seed=args.seed,
+        min_frag=dataset['min_frag'], stream=args.stream,
+        kogs=counts['kogs'], sequences=counts['sequences'],
+        fragments=dataset['fragments'], files=files,
+        created=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    with open(dataset['prefix']+'_manifest.json', 'w') as handle:
+        json.dump(info, handle, indent=2, sort_keys=True)
+
+
+def get_kog_rng(seed, kog_id, replicate=0):
+    """Random number generator for one KOG, derived from the seed, the KOG ID
+    and the (zero-based) replicate number"""
+    kog_int = int(binascii.hexlify(kog_id.encode('utf-8')), 16)
+    entropy = [seed, kog_int]
+    if replicate:  # The first replicate matches a run without replicates
+        entropy.append(replicate)
+    return np.random.default_rng(np.random.SeedSequence(entropy))
+
+
+def shuffled_scheme(scheme_list, orgs, kog_dict, rng):
     """Determine a per-COG scheme for fragmenting sequences
 
     In all but the CEGMA set, the number of represented organisms and the
@@ -191,49 +433,238 @@ def shuffled_scheme(scheme_list, orgs, kog_dict):
         except KeyError:
             continue
 
-    shuffle(shf_scheme)
+    return rng.permutation(np.array(shf_scheme, dtype=np.int64))
+
+
+def fragment_kogs(kog_groups, datasets, orgs, seed, processes=1,
+                  batch_residues=1 << 22):
+    """Fragment KOGs in batches, in a pool of processes if processes > 1
+
+    KOGs are gathered into batches of about batch_residues residues, and
+    each batch is fragmented for every data set. With several processes, at
+    most two batches per process are in flight, so memory use does not
+    depend on the size of the input.
+
+    Parameters
+    ----------
+    kog_groups : iterable
+        (kog_id, kog_dict) pairs, like those from iter_kog_groups()
+    datasets : list of tuples
+        (scheme_list, min_frag, replicate) of each data set, with
+        scheme_list and min_frag as for fragment_kog()
+    orgs : list
+        As for fragment_kog()
+    seed : int
+        Seed from which the random stream of each KOG is derived
+    processes : int, optional
+        Number of worker processes
+
+    Yields
+    ------
+    list of lists of str
+        For each data set, the FASTA text of each batch in each of LAYOUTS,
+        in input order
+    """
+    params = (datasets, orgs, seed)
+    batches = iter_batches(kog_groups, batch_residues)
+
+    if processes <= 1:
+        for batch in batches:
+            yield fragment_batch(batch, *params)
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(processes=processes,
+                                initializer=_init_fragment_worker,
+                                initargs=(params,))
+    pending = deque()
+    try:
+        for batch in batches:
+            pending.append(pool.apply_async(_fragment_batch, (batch,)))
+            while len(pending) > 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def iter_batches(kog_groups, batch_residues):
+    """Gather KOGs into lists holding about batch_residues residues"""
+    batch = list()
+    residues = 0
+    for kog_id, kog_dict in kog_groups:
+        batch.append((kog_id, kog_dict))
+        residues += sum(seq_len for org_seqs in kog_dict.values()
+                        for seq_len, seq in org_seqs.values())
+        if residues >= batch_residues:
+            yield batch
+            batch = list()
+            residues = 0
+    if batch:
+        yield batch
+
+
+def fragment_batch(batch, datasets, orgs, seed):
+    """Fragment a batch of KOGs for every data set, each KOG and replicate
+    with its own random stream
+
+    Returns
+    -------
+    list of lists of str
+        For each data set, the FASTA text of the batch in each of LAYOUTS
+    """
+    blocks = [[list() for layout in LAYOUTS] for dataset in datasets]
+    for kog_id, kog_dict in batch:
+        for dataset_blocks, (scheme_list, min_frag, replicate) in \
+                zip(blocks, datasets):
+            fragments = fragment_kog(kog_dict, scheme_list, orgs, min_frag,
+                                     get_kog_rng(seed, kog_id, replicate))
+            for block, text in zip(dataset_blocks, fragments):
+                block.append(text)
 
-    return shf_scheme
+    return [[''.join(block) for block in dataset_blocks]
+            for dataset_blocks in blocks]
 
 
-def even_split(handle, pieces, seq_id, seq_len, seq):
-    """Split sequence into subsequences of equal length"""
-    sub_len = int(seq_len/pieces)
-    for i in range(pieces):
-        header = '>{0}---{1}of{2}'.format(seq_id, i+1, pieces)
-        if i+1 < pieces:
-            sub_seq = seq[i*sub_len:(i+1)*sub_len]
-        else:
-            sub_seq = seq[i*sub_len:]
-        handle.write("{0}\n{1}\n".format(header, sub_seq))
+# Parameters shared with the worker processes of fragment_kogs()
+_worker_params = None
 
 
-def rand_split(handle, pieces, min_frag, seq_id, seq_len, seq):
-    """Split sequence into subsequences of random lengths"""
-    break_points = get_breaks(min_frag, seq_len, pieces)
-    for i in range(pieces):
-        header = '>{0}---{1}of{2}'.format(seq_id, i+1, pieces)
-        if i+1 < pieces:
-            sub_seq = seq[break_points[i]:break_points[i+1]]
-        else:
-            sub_seq = seq[break_points[i]:]
-        handle.write("{0}\n{1}\n".format(header, sub_seq))
+def _init_fragment_worker(params):
+    global _worker_params
+    _worker_params = params
 
 
-def get_breaks(min_frag, seq_len, pieces):
-    """Select break point positions"""
-    internal_breaks = sorted(list(random_integers(2, seq_len, pieces-1)))
-    break_points = [0]+internal_breaks+[seq_len]
-    bad_break = False
-    for i in range(1, len(break_points)):
-        if break_points[i]-break_points[i-1] < min_frag:
-            bad_break = True
-    if bad_break:
-        break_points = get_breaks(min_frag, seq_len, pieces)
+def _fragment_batch(batch):
+    return fragment_batch(batch, *_worker_params)
 
-    return break_points
+
+def fragment_kog(kog_dict, scheme_list, orgs, min_frag, rng):
+    """Fragment every sequence of a KOG in all four layouts at once
+
+    In the ordered layouts, the sequences of the organisms of the KOG are
+    split by the counts of the scheme taken from its end, one organism at a
+    time in alphabetical order; in the shuffled layouts, by the shuffled
+    scheme. The break points of all four layouts are drawn in one batch.
+
+    Returns
+    -------
+    list of str
+        The FASTA text of the fragments in each of LAYOUTS
+    """
+    seq_ids = list()
+    seqs = list()
+    ord_pieces = list()
+
+    ord_scheme = list(scheme_list)
+    for org_id in sorted(kog_dict.keys()):
+        pieces = ord_scheme.pop()
+        for seq_id in sorted(kog_dict[org_id].keys()):
+            seq_len, seq = kog_dict[org_id][seq_id]
+            seq_ids.append(seq_id)
+            seqs.append(seq)
+            ord_pieces.append(pieces)
+
+    shf_pieces = shuffled_scheme(scheme_list, orgs, kog_dict, rng)
+    n_seqs = len(seqs)
+
+    # One entry per sequence per layout, in the order of LAYOUTS
+    seq_lens = np.tile(np.array([len(seq) for seq in seqs], dtype=np.int64),
+                       len(LAYOUTS))
+    pieces = np.concatenate([ord_pieces, ord_pieces, shf_pieces,
+                             shf_pieces]).astype(np.int64)
+    is_random = np.repeat([layout.endswith('rnd') for layout in LAYOUTS],
+                          n_seqs)
+
+    frag_seqs, frag_nums, starts, ends = get_fragment_bounds(
+        seq_lens, pieces, min_frag, is_random, rng)
+
+    return format_fragments(seq_ids, seqs, pieces, frag_seqs, frag_nums,
+                            starts, ends, len(LAYOUTS))
+
+
+def get_fragment_bounds(seq_lens, pieces, min_frag, is_random, rng):
+    """Locate the fragments of many sequences
+
+    Even fragments all have the length seq_len // pieces, except the last,
+    which takes the remainder. Random break points are sampled directly
+    rather than by rejection: the slack of a sequence, seq_len - pieces *
+    min_frag, is cut at pieces - 1 sorted uniform random positions, and each
+    fragment gets min_frag residues plus its share of the slack, so that
+    every fragment is at least min_frag long.
+
+    Parameters
+    ----------
+    seq_lens, pieces : numpy.ndarray
+        Length and number of fragments of each sequence
+    min_frag : int
+        Minimum length of a random fragment
+    is_random : numpy.ndarray
+        Whether the break points of each sequence are random (or even)
+    rng : numpy.random.Generator
+        Source of the random break points
+
+    Returns
+    -------
+    frag_seqs, frag_nums, starts, ends : numpy.ndarray
+        For each fragment, in order: the index of its sequence, its
+        zero-based number within the sequence and its start and end
+    """
+    n_frags = int(pieces.sum())
+    frag_seqs = np.repeat(np.arange(len(pieces)), pieces)
+    firsts = np.cumsum(pieces) - pieces
+    frag_nums = np.arange(n_frags) - firsts[frag_seqs]
+    lens = seq_lens[frag_seqs]
+    counts = pieces[frag_seqs]
+
+    starts = frag_nums * (lens // counts)
+
+    is_break = is_random[frag_seqs] & (frag_nums > 0)
+    if is_break.any():
+        slack = lens[is_break] - counts[is_break] * min_frag
+        if (slack < 0).any():
+            raise ValueError("Sequences are too short to split into " +
+                             "fragments of at least " + str(min_frag))
+
+        # Uniform positions, sorted within each sequence
+        positions = rng.random(len(slack))
+        positions = positions[np.lexsort((positions, frag_seqs[is_break]))]
+        starts[is_break] = (frag_nums[is_break] * min_frag +
+                            np.floor(positions * (slack + 1)).astype(np.int64))
+
+    ends = np.empty_like(starts)
+    ends[:-1] = starts[1:]
+    lasts = firsts + pieces - 1
+    ends[lasts] = seq_lens
+
+    return frag_seqs, frag_nums, starts, ends
+
+
+def format_fragments(seq_ids, seqs, pieces, frag_seqs, frag_nums, starts,
+                     ends, n_layouts):
+    """Format fragments as FASTA text, one block per layout
+
+    Fragment headers have the format '>seqid---XofY'. Entry i of pieces
+    (and the sequence numbers in frag_seqs) refers to sequence i % n_seqs of
+    layout i // n_seqs.
+    """
+    n_seqs = len(seqs)
+    pieces = pieces.tolist()
+    records = ['>{0}---{1}of{2}\n{3}\n'.format(
+                   seq_ids[i % n_seqs], num+1, pieces[i],
+                   seqs[i % n_seqs][start:stop])
+               for i, num, start, stop in zip(frag_seqs.tolist(),
+                                              frag_nums.tolist(),
+                                              starts.tolist(), ends.tolist())]
+
+    bounds = [0] + np.searchsorted(
+        frag_seqs, np.arange(1, n_layouts+1) * n_seqs).tolist()
+    return [''.join(records[beg:end]) for beg, end in zip(bounds[:-1],
+                                                          bounds[1:])]
 
 
 if __name__ == "__main__":
     sys.exit(main())
-
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+
+"""
+Compact storage for the combined graphs written by graphs2gml.py.
+
+graphs2gml.py merges the sequences from a BLAST file, the weighted edges of
+any number of abc graphs and the co-clustering counts from any number of MCL
+clusterings into one network for Cytoscape or Gephi. Keeping that network as
+a NetworkX MultiGraph costs a dict per node, two per edge and one more per
+attribute, which stops fitting in memory long before hundreds of clusterings
+have been added.
+
+The EdgeRecords class instead interns sequence IDs to integers and keeps one
+fixed-size record per pair of sequences in a NumPy structured array: both
+ends, the weight of each metric from the abc graphs and the number of
+clusterings per metric that put the pair in the same cluster. Nodes and edges
+are produced on demand, in the form the streaming writers in graphWriters.py
+expect, without ever building a NetworkX graph.
+
+Co-clustering is counted with sparse cluster membership matrices rather than
+by visiting every pair in every cluster. With C the sequences x clusters
+membership matrix of a clustering, the number of clusters shared by two
+sequences is an entry of C.C^T. Only the entries for pairs that already have
+a record (the graph edges) are computed unless a minimum count is given, in
+which case C.C^T is computed in blocks of rows sized to bound its number of
+entries, so that giant clusters can not exhaust memory.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+from labelIndex import LabelIndex
+
+
+class EdgeRecords(object):
+    """Nodes and per-pair edge records of a combined graph
+
+    Every pair of sequences has at most one record. A pair with a weight for
+    any metric is written as a 'graph' edge (key 0) carrying those weights,
+    and a pair that co-clustered at least once is written as a 'cluster' edge
+    (key 1) carrying the co-clustering counts, just as the MultiGraph kept
+    graph and cluster edges under keys 0 and 1.
+
+    Co-clustering counts are only kept for the pairs with a record when the
+    clustering is added, so graphs must be added before clusterings. Pairs
+    without a graph edge are added by count_new_coclusters() once all
+    clusterings have been added, if min_cocluster is given.
+
+    Args:
+        idchar: Character used to delineate between the organism ID and the
+            remainder of the sequence ID
+        min_cocluster: Keep the cluster memberships so that
+            count_new_coclusters() can add every pair sharing a cluster in at
+            least this many clusterings of the same metric [def=None]
+        capacity: Initial number of edge records
+        label_index: LabelIndex giving the KOG of each sequence ID [def=a
+            new index for KOG IDs]
+    """
+    metrics = ('nle', 'bit', 'bsr', 'bal')
+
+    # Attribute names and types, in output order
+    node_attrs = (('len', int), ('sbs', float), ('org', str), ('kog', str))
+    edge_attrs = (('interaction', str), ('Org_match', bool),
+                  ('KOG_match', bool)) + tuple((met, float) for met in metrics)
+
+    def __init__(self, idchar='|', min_cocluster=None, capacity=1024,
+                 label_index=None):
+        self.idchar = idchar
+        self.min_cocluster = min_cocluster
+        self.label_index = LabelIndex() if label_index is None \
+            else label_index
+        self.seq_ids = list()  # index -> sequence ID
+        self.seq_idx = dict()  # sequence ID -> index
+        self.node_len = list()
+        self.node_sbs = list()
+        self.node_org = list()
+        self.node_kog = list()
+
+        fields = [('src', np.int32), ('dst', np.int32)]
+        fields += [('w_'+met, np.float64) for met in self.metrics]
+        fields += [('n_'+met, np.int32) for met in self.metrics]
+        self.records = np.empty(capacity, dtype=fields)
+        self.edge_idx = dict()  # packed (u, v) index pair -> row
+        self.n_edges = 0
+
+        # Cluster memberships per metric, for count_new_coclusters()
+        self.memberships = dict((met, list()) for met in self.metrics)
+        self.n_clusters = dict((met, 0) for met in self.metrics)
+
+    def add_node(self, seq_id, seq_len=None, bit_scr=None):
+        """Add a sequence (or update its length and self bit score)
+
+        Returns:
+            The integer index of the sequence
+        """
+        idx = self.intern(seq_id)
+        self.node_len[idx] = seq_len
+        self.node_sbs[idx] = bit_scr
+        return idx
+
+    def intern(self, seq_id):
+        """Return the integer index for a sequence ID, adding it if needed"""
+        idx = self.seq_idx.get(seq_id)
+        if idx is None:
+            idx = len(self.seq_ids)
+            self.seq_idx[seq_id] = idx
+            self.seq_ids.append(seq_id)
+            self.node_len.append(None)
+            self.node_sbs.append(None)
+            self.node_org.append(seq_id.split(self.idchar)[0])
+            self.node_kog.append(self.label_index.label(seq_id))
+        return idx
+
+    def get_row(self, u, v):
+        """Return the record row for a pair of node indices, adding it if
+        needed"""
+        key = _pair_key(u, v)
+        row = self.edge_idx.get(key)
+        if row is None:
+            row = self.n_edges
+            if row == len(self.records):
+                self.records = _grow(self.records)
+            rec = self.records[row]
+            rec['src'] = u
+            rec['dst'] = v
+            for met in self.metrics:
+                rec['w_'+met] = np.nan
+                rec['n_'+met] = 0
+            self.edge_idx[key] = row
+            self.n_edges += 1
+        return row
+
+    def set_weight(self, qry_id, ref_id, metric, weight):
+        """Store the weight of one metric for a pair of sequences"""
+        row = self.get_row(self.intern(qry_id), self.intern(ref_id))
+        self.records['w_'+metric][row] = weight
+
+    def add_cocluster(self, qry_id, ref_id, metric, count=1):
+        """Count clusterings of one metric that put two sequences together"""
+        row = self.get_row(self.intern(qry_id), self.intern(ref_id))
+        self.records['n_'+metric][row] += count
+
+    def add_clustering(self, clusters, metric):
+        """Count the pairs of records that share a cluster in a clustering
+
+        Args:
+            clusters: A list of clusters, each a list of sequence IDs
+            metric: The metric of the graph that was clustered
+        """
+        self.add_clustering_counts(self.get_clustering_counts(clusters),
+                                   metric)
+
+    def get_clustering_counts(self, clusters):
+        """Count the clusters shared by each record's pair, without changing
+        the records
+
+        This is the costly half of add_clustering(), and can run in another
+        process on a copy of the records made after all graphs were added.
+
+        Args:
+            clusters: A list of clusters, each a list of sequence IDs
+
+        Returns:
+            A dict holding the number of clusters shared by the pair of each
+                record ('shared'), the node index of each cluster member
+                ('members', -1-k for the k-th entry of 'new_ids', the IDs that
+                have no index yet) and the cluster of each member ('labels')
+        """
+        seq_idx = self.seq_idx
+        new_ids = list()
+        new_idx = dict()
+        members = list()
+        for cluster in clusters:
+            for seq_id in cluster:
+                idx = seq_idx.get(seq_id)
+                if idx is None:
+                    idx = new_idx.get(seq_id)
+                    if idx is None:
+                        idx = new_idx[seq_id] = -1 - len(new_ids)
+                        new_ids.append(seq_id)
+                members.append(idx)
+
+        members = np.array(members, dtype=np.int32)
+        labels = np.repeat(np.arange(len(clusters), dtype=np.int32),
+                           [len(cluster) for cluster in clusters])
+
+        # Sequences without an index have no records, so they are left out
+        known = members >= 0
+        memb = membership_matrix(members[known], labels[known],
+                                 len(self.seq_ids), len(clusters))
+        recs = self.records[:self.n_edges]
+        shared = memb[recs['src']].multiply(memb[recs['dst']]).sum(axis=1)
+
+        return dict(shared=np.asarray(shared, dtype=np.int32).ravel(),
+                    members=members, labels=labels, new_ids=new_ids,
+                    n_clusters=len(clusters))
+
+    def add_clustering_counts(self, counts, metric):
+        """Add the result of get_clustering_counts() to the records
+
+        Args:
+            counts: A dict returned by get_clustering_counts(), computed when
+                the records had the same number of edges as now
+            metric: The metric of the graph that was clustered
+        """
+        self.records['n_'+metric][:len(counts['shared'])] += counts['shared']
+
+        if self.min_cocluster is not None:
+            new_idx = np.array([self.intern(seq_id) for seq_id in
+                                counts['new_ids']], dtype=np.int32)
+            members = counts['members']
+            is_new = members < 0
+            members[is_new] = new_idx[-1 - members[is_new]]
+            self.memberships[metric].append(
+                (members, counts['labels'] + self.n_clusters[metric]))
+            self.n_clusters[metric] += counts['n_clusters']
+        else:
+            for seq_id in counts['new_ids']:
+                self.intern(seq_id)
+
+    def count_new_coclusters(self, max_entries=1 << 24):
+        """Add a record for every pair without one that shared a cluster in
+        at least min_cocluster clusterings of the same metric
+
+        Args:
+            max_entries: Largest number of entries of C.C^T computed at once
+        """
+        if self.min_cocluster is None:
+            return
+        n_nodes = len(self.seq_ids)
+        n_graph = self.n_edges  # Records whose counts are already known
+
+        for met in self.metrics:
+            if not self.memberships[met]:
+                continue
+            memb = membership_matrix(
+                np.concatenate([m for m, l in self.memberships[met]]),
+                np.concatenate([l for m, l in self.memberships[met]]),
+                n_nodes, self.n_clusters[met])
+            memb_t = memb.T.tocsr()
+            self.memberships[met] = list()
+
+            # Entries in each row of C.C^T: the sizes of the row's clusters
+            work = memb.dot(np.diff(memb_t.indptr)).astype(np.int64)
+            for beg, end in get_row_blocks(work, max_entries):
+                shared = memb[beg:end].dot(memb_t).tocoo()
+                u = shared.row + beg
+                keep = (u < shared.col) & (shared.data >= self.min_cocluster)
+
+                for u, v, count in zip(u[keep].tolist(),
+                                       shared.col[keep].tolist(),
+                                       shared.data[keep].tolist()):
+                    row = self.edge_idx.get(_pair_key(u, v))
+                    if row is not None and row < n_graph:
+                        continue
+                    row = self.get_row(u, v)
+                    self.records['n_'+met][row] = count
+
+    def number_of_nodes(self):
+        return len(self.seq_ids)
+
+    def number_of_edges(self):
+        """Number of edges written (a pair may give a graph and a cluster
+        edge)"""
+        recs = self.records[:self.n_edges]
+        has_weight = np.zeros(self.n_edges, dtype=bool)
+        has_count = np.zeros(self.n_edges, dtype=bool)
+        for met in self.metrics:
+            has_weight |= ~np.isnan(recs['w_'+met])
+            has_count |= recs['n_'+met] > 0
+        return int(np.count_nonzero(has_weight) + np.count_nonzero(has_count))
+
+    def iter_nodes(self):
+        """Yield (index, sequence ID, attributes) for every node
+
+        Attributes that are not known (eg. the length of a sequence without a
+        self-hit) are left out.
+        """
+        for idx, seq_id in enumerate(self.seq_ids):
+            attrs = OrderedDict()
+            for name, value in zip(('len', 'sbs', 'org', 'kog'),
+                                   (self.node_len[idx], self.node_sbs[idx],
+                                    self.node_org[idx], self.node_kog[idx])):
+                if value is not None:
+                    attrs[name] = value
+            yield idx, seq_id, attrs
+
+    def iter_edges(self, block_size=65536):
+        """Yield (u, v, key, attributes) for every edge, in record order
+
+        Records are converted to Python values block_size at a time.
+        """
+        metrics = self.metrics
+        node_org = self.node_org
+        node_kog = self.node_kog
+
+        for beg in range(0, self.n_edges, block_size):
+            recs = self.records[beg:min(beg+block_size, self.n_edges)]
+            weights = [recs['w_'+met].tolist() for met in metrics]
+            counts = [recs['n_'+met].tolist() for met in metrics]
+
+            for i, (u, v) in enumerate(zip(recs['src'].tolist(),
+                                           recs['dst'].tolist())):
+                org_match = node_org[u] == node_org[v]
+                kog_match = node_kog[u] == node_kog[v]
+
+                attrs = OrderedDict()
+                for met, col in zip(metrics, weights):
+                    if col[i] == col[i]:  # Not NaN
+                        attrs[met] = col[i]
+                if attrs:
+                    yield u, v, 0, _edge_attrs('graph', org_match, kog_match,
+                                               attrs)
+
+                attrs = OrderedDict()
+                for met, col in zip(metrics, counts):
+                    if col[i]:
+                        attrs[met] = col[i]
+                if attrs:
+                    yield u, v, 1, _edge_attrs('cluster', org_match,
+                                               kog_match, attrs)
+
+
+def membership_matrix(members, labels, n_nodes, n_clusters):
+    """Sparse 0/1 matrix of sequences (rows) by clusters (columns)"""
+    from scipy import sparse
+
+    memb = sparse.csr_matrix(
+        (np.ones(len(members), dtype=np.int32), (members, labels)),
+        shape=(n_nodes, n_clusters))
+    memb.data[:] = 1  # A sequence listed twice in a cluster counts once
+    return memb
+
+
+def get_row_blocks(work, max_entries):
+    """Split rows into consecutive blocks of at most max_entries work
+
+    A row with more work than max_entries gets a block of its own.
+
+    Returns:
+        A list of (beg, end) row ranges
+    """
+    blocks = list()
+    beg = 0
+    total = 0
+    for row, cost in enumerate(work.tolist()):
+        if total + cost > max_entries and row > beg:
+            blocks.append((beg, row))
+            beg = row
+            total = 0
+        total += cost
+    if beg < len(work):
+        blocks.append((beg, len(work)))
+    return blocks
+
+
+def _edge_attrs(interaction, org_match, kog_match, metric_attrs):
+    """Attributes of an edge, in the order of EdgeRecords.edge_attrs"""
+    attrs = OrderedDict([('interaction', interaction),
+                         ('Org_match', org_match), ('KOG_match', kog_match)])
+    attrs.update(metric_attrs)
+    return attrs
+
+
+def _pair_key(u, v):
+    """Pack an unordered pair of node indices into a single integer"""
+    if u < v:
+        return (u << 32) | v
+    return (v << 32) | u
+
+
+def _grow(arr):
+    """Return a copy of an array with twice the capacity"""
+    new = np.empty(max(2 * len(arr), 1), dtype=arr.dtype)
+    new[:len(arr)] = arr
+    return new
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+"""
+Columnar storage for graphs of best BLAST hits.
+
+NetworkX keeps a Python dict of attributes for every edge, which costs several
+hundred bytes per edge once the four BLAST-based metrics are stored. The
+EdgeStore class instead interns sequence IDs to integer indices and keeps one
+NumPy array per edge attribute, so that each best hit costs a few dozen bytes.
+When given the organism ID delimiter, it also keeps a running count of edges
+per pair of organisms and sums each metric per pair from the final best hits
+when the averages are needed.
+"""
+
+import math
+
+import numpy as np
+
+
+class EdgeStore(object):
+    """Best-hit graph with sequence IDs interned to integers
+
+    Nodes are the sequences with a self-alignment score. Edges are held in
+    parallel arrays (src, dst, bit, nle, bsr, bal) and a dict maps each
+    unordered pair of node indices to its row, so that reciprocal hits and
+    repeated HSPs replace the existing row whenever they have a larger bit
+    score. Self-hits are never stored as edges.
+
+    Only the first n_edges rows of each array are valid; use column() to get
+    a view trimmed to the used rows.
+
+    If idchar is given, each sequence's organism is interned to a small
+    integer when the sequence is first seen, and the edge count for each pair
+    of organisms is updated whenever a new edge is inserted. The counts are
+    kept in the upper triangle of org_cnt (n_org x n_org). The metric sums
+    for each pair are computed by org_pair_sums() from the stored best hits.
+
+    Connected components are tracked with a union-find forest (parent) that
+    is updated as each new edge is inserted.
+    """
+    metrics = ('nle', 'bit', 'bsr', 'bal')
+
+    def __init__(self, capacity=1024, idchar=None):
+        self.seq_ids = list()  # index -> sequence ID
+        self.seq_idx = dict()  # sequence ID -> index
+        self.sbs = np.empty(capacity, dtype=np.float64)
+        self.idchar = idchar
+        self.node_org = np.empty(capacity, dtype=np.int32)
+        self.parent = np.empty(capacity, dtype=np.int32)
+        self.org_ids = list()  # index -> organism ID
+        self.org_idx = dict()  # organism ID -> index
+        self.org_cnt = np.zeros((0, 0), dtype=np.int64)
+        self.src = np.empty(capacity, dtype=np.int32)
+        self.dst = np.empty(capacity, dtype=np.int32)
+        self.cols = dict()
+        for met in self.metrics:
+            self.cols[met] = np.empty(capacity, dtype=np.float64)
+        self.edge_idx = dict()  # packed (u, v) index pair -> row
+        self.n_edges = 0
+
+    def intern(self, seq_id):
+        """Return the integer index for a sequence ID, adding it if needed"""
+        idx = self.seq_idx.get(seq_id)
+        if idx is None:
+            idx = len(self.seq_ids)
+            self.seq_idx[seq_id] = idx
+            self.seq_ids.append(seq_id)
+            if idx == len(self.sbs):
+                self.sbs = _grow(self.sbs)
+                self.node_org = _grow(self.node_org)
+                self.parent = _grow(self.parent)
+            self.sbs[idx] = np.nan  # No self-alignment seen yet
+            self.parent[idx] = idx
+            if self.idchar is not None:
+                self.node_org[idx] = self.intern_organism(
+                    seq_id.split(self.idchar)[0])
+        return idx
+
+    def intern_organism(self, org_id):
+        """Return the integer index for an organism ID, adding it if needed"""
+        org = self.org_idx.get(org_id)
+        if org is None:
+            org = len(self.org_ids)
+            self.org_idx[org_id] = org
+            self.org_ids.append(org_id)
+            n_org = len(self.org_ids)
+            self.org_cnt = _pad_square(self.org_cnt, n_org)
+        return org
+
+    def has_node(self, seq_id):
+        """Check whether a self-alignment score has been seen for a sequence"""
+        idx = self.seq_idx.get(seq_id)
+        return idx is not None and not np.isnan(self.sbs[idx])
+
+    def nodes(self):
+        """Return the IDs of all sequences with a self-alignment score"""
+        return [self.seq_ids[i] for i in
+                np.flatnonzero(~np.isnan(self.sbs[:len(self.seq_ids)]))]
+
+    def self_score(self, seq_id):
+        """Return the self-alignment bit score of a sequence"""
+        return float(self.sbs[self.seq_idx[seq_id]])
+
+    def update_self_score(self, seq_id, bit_scr):
+        """Store a self-alignment bit score, keeping the largest one seen"""
+        idx = self.intern(seq_id)
+        if np.isnan(self.sbs[idx]) or bit_scr > self.sbs[idx]:
+            self.sbs[idx] = bit_scr
+
+    def add_best_hit(self, qry_id, ref_id, bit, nle, bsr, bal):
+        """Insert a hit, or replace the stored one if this bit score is larger
+
+        Returns:
+            True if the edge table changed, otherwise False
+        """
+        if qry_id == ref_id:
+            return False
+
+        u = self.intern(qry_id)
+        v = self.intern(ref_id)
+        key = _pair_key(u, v)
+        row = self.edge_idx.get(key)
+
+        if row is None:
+            row = self.n_edges
+            if row == len(self.src):
+                self._grow_edges()
+            self.edge_idx[key] = row
+            self.src[row] = u
+            self.dst[row] = v
+            self.n_edges += 1
+            self._union(u, v)
+            if self.idchar is not None:
+                self._count_org_pair(u, v)
+
+        # Largest bit score => best hit
+        elif not bit > self.cols['bit'][row]:
+            return False
+
+        self.cols['bit'][row] = bit
+        self.cols['nle'][row] = nle
+        self.cols['bsr'][row] = bsr
+        self.cols['bal'][row] = bal
+
+        return True
+
+    def has_edge(self, qry_id, ref_id):
+        """Check whether a best hit is stored between two sequences"""
+        u = self.seq_idx.get(qry_id)
+        v = self.seq_idx.get(ref_id)
+        if u is None or v is None:
+            return False
+        return _pair_key(u, v) in self.edge_idx
+
+    def column(self, met):
+        """Return a view of the used rows of one edge attribute array"""
+        if met == 'src':
+            return self.src[:self.n_edges]
+        elif met == 'dst':
+            return self.dst[:self.n_edges]
+        return self.cols[met][:self.n_edges]
+
+    def edges(self, data=False):
+        """Iterate over edges in the same form as networkx.Graph.edges()"""
+        seq_ids = self.seq_ids
+        for row in range(self.n_edges):
+            qry_id = seq_ids[self.src[row]]
+            ref_id = seq_ids[self.dst[row]]
+            if data:
+                edata = dict()
+                for met in self.metrics:
+                    edata[met] = float(self.cols[met][row])
+                yield qry_id, ref_id, edata
+            else:
+                yield qry_id, ref_id
+
+    def number_of_edges(self):
+        return self.n_edges
+
+    def org_pair_sums(self):
+        """Sum each metric over the edges between each pair of organisms
+
+        The sums are computed with math.fsum(), which rounds only once, so
+        they depend neither on the order in which hits were stored nor on
+        how many times a best hit was replaced.
+
+        Returns:
+            org_lo, org_hi: Arrays with the organism indices of each pair
+                (org_lo <= org_hi), in the order of np.nonzero(org_cnt)
+            sums: An array with one row per pair and one column per metric,
+                in the order of self.metrics
+        """
+        if not self.n_edges:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros((0, len(self.metrics)))
+
+        n_org = len(self.org_ids)
+        i = self.node_org[self.column('src')].astype(np.int64)
+        j = self.node_org[self.column('dst')].astype(np.int64)
+        pair = np.minimum(i, j) * n_org + np.maximum(i, j)
+
+        order = np.argsort(pair, kind='mergesort')
+        pair = pair[order]
+        bounds = np.flatnonzero(np.diff(pair)) + 1
+        begs = np.concatenate(([0], bounds)).tolist()
+        ends = np.concatenate((bounds, [len(pair)])).tolist()
+
+        sums = np.empty((len(begs), len(self.metrics)), dtype=np.float64)
+        for k, met in enumerate(self.metrics):
+            values = self.column(met)[order].tolist()
+            sums[:, k] = [math.fsum(values[beg:end])
+                          for beg, end in zip(begs, ends)]
+
+        pair = pair[begs]
+        return pair // n_org, pair % n_org, sums
+
+    def component_labels(self):
+        """Label each sequence with the index of its connected component
+
+        Components are numbered in the order of their first sequence. Every
+        sequence with a self-alignment score belongs to exactly one
+        component, even if it has no edges.
+
+        Returns:
+            labels: An array with one component index per interned sequence
+                (-1 for sequences without a self-alignment score)
+            n_comp: The number of components
+        """
+        n_nodes = len(self.seq_ids)
+        roots = np.array([self._find(i) for i in range(n_nodes)],
+                         dtype=np.int64)
+        is_node = ~np.isnan(self.sbs[:n_nodes])
+
+        labels = np.full(n_nodes, -1, dtype=np.int64)
+        uniq, first, inverse = np.unique(roots[is_node], return_index=True,
+                                         return_inverse=True)
+        # Renumber roots by the position of their first member
+        rank = np.empty(len(uniq), dtype=np.int64)
+        rank[np.argsort(first, kind='mergesort')] = np.arange(len(uniq))
+        labels[is_node] = rank[inverse.ravel()]
+
+        return labels, len(uniq)
+
+    def connected_components(self):
+        """Return a list of sets of sequence IDs, one per connected component
+        """
+        labels, n_comp = self.component_labels()
+        comps = [set() for i in range(n_comp)]
+        for seq_id, label in zip(self.seq_ids, labels.tolist()):
+            if label >= 0:
+                comps[label].add(seq_id)
+
+        return comps
+
+    def edge_subgraph(self, keep):
+        """Return a new EdgeStore with every node but only some of the edges
+
+        The organism pair totals and connected components of the new store
+        are computed from the selected edges alone.
+
+        Args:
+            keep: A boolean array with one entry per stored edge
+
+        Returns:
+            An EdgeStore
+        """
+        rows = np.flatnonzero(np.asarray(keep)[:self.n_edges])
+        n_nodes = len(self.seq_ids)
+
+        return EdgeStore.from_arrays(
+            seq_ids=self.seq_ids, sbs=self.sbs[:n_nodes],
+            src=self.src[rows], dst=self.dst[rows],
+            cols=dict((met, self.cols[met][rows]) for met in self.metrics),
+            idchar=self.idchar)
+
+    @classmethod
+    def from_arrays(cls, seq_ids, sbs, src, dst, cols, idchar=None):
+        """Build an EdgeStore from node and edge arrays
+
+        Every (src, dst) pair must be unique and no edge may be a self-hit,
+        as is the case for the arrays of an existing EdgeStore.
+
+        Args:
+            seq_ids: A list of sequence IDs
+            sbs: An array of self-alignment scores, one per sequence ID (NaN
+                for sequences without one)
+            src, dst: Arrays of indices into seq_ids for both ends of each
+                edge
+            cols: A dict containing an array of values for each metric
+            idchar: Character used to delineate between the organism ID and
+                the remainder of the sequence ID
+
+        Returns:
+            An EdgeStore
+        """
+        store = cls(capacity=max(len(seq_ids), 1), idchar=idchar)
+        for seq_id in seq_ids:
+            store.intern(seq_id)
+        store.sbs[:len(seq_ids)] = sbs
+
+        store.src = np.array(src, dtype=np.int32)
+        store.dst = np.array(dst, dtype=np.int32)
+        for met in store.metrics:
+            store.cols[met] = np.array(cols[met], dtype=np.float64)
+        store.n_edges = len(store.src)
+
+        lo = np.minimum(store.src, store.dst).astype(np.int64)
+        hi = np.maximum(store.src, store.dst).astype(np.int64)
+        store.edge_idx = dict(zip(((lo << 32) | hi).tolist(),
+                                  range(store.n_edges)))
+
+        if idchar is not None:
+            i = store.node_org[store.src]
+            j = store.node_org[store.dst]
+            org_lo = np.minimum(i, j)
+            org_hi = np.maximum(i, j)
+            np.add.at(store.org_cnt, (org_lo, org_hi), 1)
+
+        for u, v in zip(store.src.tolist(), store.dst.tolist()):
+            store._union(u, v)
+
+        return store
+
+    def _find(self, i):
+        """Return the root of a node's tree, halving the path on the way"""
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def _union(self, u, v):
+        """Join the components of two nodes"""
+        ru = self._find(u)
+        rv = self._find(v)
+        if ru != rv:
+            self.parent[max(ru, rv)] = min(ru, rv)
+
+    def _count_org_pair(self, u, v):
+        """Count a new edge between the organisms of two nodes"""
+        i = self.node_org[u]
+        j = self.node_org[v]
+        if i > j:
+            i, j = j, i
+        self.org_cnt[i, j] += 1
+
+    def _grow_edges(self):
+        self.src = _grow(self.src)
+        self.dst = _grow(self.dst)
+        for met in self.metrics:
+            self.cols[met] = _grow(self.cols[met])
+
+
+def _pair_key(u, v):
+    """Pack an unordered pair of node indices into a single integer"""
+    if u < v:
+        return (u << 32) | v
+    return (v << 32) | u
+
+
+def _pad_square(arr, size):
+    """Return a copy of an array with its first two axes zero-padded to size
+    """
+    new = np.zeros((size, size) + arr.shape[2:], dtype=arr.dtype)
+    new[:arr.shape[0], :arr.shape[1]] = arr
+    return new
+
+
+def _grow(arr):
+    """Return a copy of an array with twice the capacity"""
+    new = np.empty(max(2 * len(arr), 1), dtype=arr.dtype)
+    new[:len(arr)] = arr
+    return new
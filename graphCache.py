@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+"""
+Persistent cache of arrays parsed from BLAST files.
+
+Parsing a large BLAST file takes far longer than loading the handful of
+arrays that the programs in this package actually keep from it (self bit
+scores, best-hit edges, organism IDs, ...). The GraphCache class saves those
+arrays in a cache directory, one subdirectory per entry with one .npy file
+per array, so that later runs on the same file can memory-map them instead.
+
+Entries are keyed by a fingerprint of the input file (its size, modification
+time and a hash of its first and last megabyte) together with every option
+that affects the parsed result. Loading an entry marks it as recently used,
+and the least recently used entries are removed whenever the cache grows
+beyond its maximum size.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+
+class GraphCache(object):
+    """Directory of cached arrays with least-recently-used eviction
+
+    Args:
+        cache_dir: Directory holding the cache entries (created if needed)
+        max_bytes: Largest total size of all entries, in bytes
+    """
+
+    def __init__(self, cache_dir, max_bytes=10 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_key(self, path, **options):
+        """Compute the cache key for a file parsed with a set of options
+
+        Args:
+            path: Path to the input file
+            options: Every setting that affects the parsed result (eg. the
+                program name, column numbers and ID delimiter)
+
+        Returns:
+            A hexadecimal string
+        """
+        key = hashlib.sha1()
+        key.update(get_file_fingerprint(path).encode('utf-8'))
+        key.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return key.hexdigest()
+
+    def load(self, key):
+        """Load the arrays saved under a key
+
+        Returns:
+            A dict of memory-mapped arrays keyed by name, or None if there is
+            no entry for the key
+        """
+        entry = os.path.join(self.cache_dir, key)
+        meta_path = os.path.join(entry, 'meta.json')
+        if not os.path.isfile(meta_path):
+            return None
+
+        try:
+            with open(meta_path) as handle:
+                names = json.load(handle)['arrays']
+            arrays = dict()
+            for name in names:
+                arrays[name] = np.load(os.path.join(entry, name+'.npy'),
+                                       mmap_mode='r')
+        except (IOError, OSError, ValueError, KeyError):
+            return None  # A damaged entry is treated as missing
+
+        os.utime(entry, None)  # Most recently used
+
+        return arrays
+
+    def save(self, key, arrays, **info):
+        """Save a dict of arrays under a key, then evict old entries
+
+        The entry is written to a temporary directory and renamed into
+        place, so concurrent runs never see a partially written entry.
+
+        Args:
+            key: A key returned by get_key()
+            arrays: A dict of NumPy arrays keyed by name
+            info: Extra details stored with the entry (eg. the input path)
+        """
+        entry = os.path.join(self.cache_dir, key)
+        tmp = os.path.join(self.cache_dir,
+                           '.tmp-{0}-{1}'.format(key, os.getpid()))
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, name+'.npy'), np.asarray(arr))
+
+        info['arrays'] = sorted(arrays.keys())
+        info['created'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        with open(os.path.join(tmp, 'meta.json'), 'w') as handle:
+            json.dump(info, handle, indent=2, sort_keys=True)
+
+        if os.path.isdir(entry):  # Written by another run in the meantime
+            shutil.rmtree(tmp)
+        else:
+            os.rename(tmp, entry)
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits max_bytes
+
+        Args:
+            keep: A key that is never evicted (eg. the entry just saved)
+        """
+        entries = list()
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            size = get_dir_size(entry)
+            entries.append((os.path.getmtime(entry), size, name))
+            total += size
+
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name),
+                          ignore_errors=True)
+            total -= size
+
+
+def get_file_fingerprint(path, sample_size=1 << 20):
+    """Describe a file by its size, modification time and sampled contents
+
+    Only the first and last sample_size bytes are hashed, so fingerprinting
+    takes the same time for any file size.
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as handle:
+        digest.update(handle.read(sample_size))
+        if stat.st_size > sample_size:
+            handle.seek(max(stat.st_size - sample_size, sample_size))
+            digest.update(handle.read(sample_size))
+
+    return '{0}:{1!r}:{2}'.format(stat.st_size, stat.st_mtime,
+                                  digest.hexdigest())
+
+
+def get_dir_size(path):
+    """Total size of the files in a directory, in bytes"""
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+"""
+Streaming GML, GEXF and GraphML writers.
+
+The NetworkX writers need the whole graph as a NetworkX object and build
+their output (an element tree, for the XML formats) from it in memory. The
+writers here take any graph that can produce its nodes and edges one at a
+time, such as an EdgeRecords object, and write each node and edge as soon
+as it is produced, so memory use does not grow with the size of the output.
+
+A graph must provide:
+    node_attrs, edge_attrs: Sequences of (name, type) pairs declaring every
+        attribute that may appear, with types int, float, bool or str
+    iter_nodes(): Yields (index, node ID, attribute dict) tuples
+    iter_edges(): Yields (u, v, key, attribute dict) tuples, where u and v
+        are node indices and key distinguishes parallel edges
+
+The output follows the layout of the corresponding NetworkX writers, with
+the graph marked as an undirected multigraph, and is read back by
+networkx.read_gml(), read_gexf() and read_graphml(). Attributes that are
+missing from a node or edge are left out rather than written as empty
+values.
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+
+# Attribute type names, which GEXF and GraphML share
+XML_TYPES = {int: 'long', float: 'double', bool: 'boolean', str: 'string'}
+
+
+def write_gml(graph, handle):
+    """Write a graph in GML format
+
+    Nodes are numbered by their index and labelled with their ID, as
+    networkx.write_gml() does.
+    """
+    handle.write("graph [\n  multigraph 1\n")
+
+    for idx, node_id, attrs in graph.iter_nodes():
+        lines = ["  node [\n    id {0}\n    label {1}\n".format(
+            idx, _gml_value(node_id))]
+        for name, value in attrs.items():
+            lines.append("    {0} {1}\n".format(name, _gml_value(value)))
+        lines.append("  ]\n")
+        handle.write(''.join(lines))
+
+    for u, v, key, attrs in graph.iter_edges():
+        lines = ["  edge [\n    source {0}\n    target {1}\n    key {2}\n"
+                 .format(u, v, key)]
+        for name, value in attrs.items():
+            lines.append("    {0} {1}\n".format(name, _gml_value(value)))
+        lines.append("  ]\n")
+        handle.write(''.join(lines))
+
+    handle.write("]\n")
+
+
+def write_gexf(graph, handle):
+    """Write a graph in GEXF 1.2 format"""
+    node_ids = list()
+
+    handle.write(
+        "<?xml version='1.0' encoding='utf-8'?>\n"
+        "<gexf xmlns=\"http://www.gexf.net/1.2draft\" "
+        "xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" "
+        "xsi:schemaLocation=\"http://www.gexf.net/1.2draft "
+        "http://www.gexf.net/1.2draft/gexf.xsd\" version=\"1.2\">\n"
+        "  <graph defaultedgetype=\"undirected\" mode=\"static\">\n")
+
+    node_keys = _write_gexf_attributes(handle, 'node', graph.node_attrs)
+    edge_keys = _write_gexf_attributes(handle, 'edge', graph.edge_attrs)
+
+    handle.write("    <nodes>\n")
+    for idx, node_id, attrs in graph.iter_nodes():
+        node_ids.append(quoteattr(str(node_id)))
+        handle.write("      <node id={0} label={0}>\n{1}      </node>\n"
+                     .format(node_ids[-1], _gexf_attvalues(attrs, node_keys)))
+    handle.write("    </nodes>\n")
+
+    handle.write("    <edges>\n")
+    for i, (u, v, key, attrs) in enumerate(graph.iter_edges()):
+        handle.write("      <edge id=\"{0}\" source={1} target={2}>\n{3}"
+                     "      </edge>\n".format(i, node_ids[u], node_ids[v],
+                                             _gexf_attvalues(attrs,
+                                                             edge_keys)))
+    handle.write("    </edges>\n  </graph>\n</gexf>\n")
+
+
+def write_graphml(graph, handle):
+    """Write a graph in GraphML format"""
+    node_ids = list()
+
+    handle.write(
+        "<?xml version='1.0' encoding='utf-8'?>\n"
+        "<graphml xmlns=\"http://graphml.graphdrawing.org/xmlns\" "
+        "xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\" "
+        "xsi:schemaLocation=\"http://graphml.graphdrawing.org/xmlns "
+        "http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd\">\n")
+
+    node_keys = _write_graphml_keys(handle, 'node', graph.node_attrs, 0)
+    edge_keys = _write_graphml_keys(handle, 'edge', graph.edge_attrs,
+                                    len(node_keys))
+
+    handle.write("  <graph edgedefault=\"undirected\">\n")
+    for idx, node_id, attrs in graph.iter_nodes():
+        node_ids.append(quoteattr(str(node_id)))
+        handle.write("    <node id={0}>\n{1}    </node>\n".format(
+            node_ids[-1], _graphml_data(attrs, node_keys)))
+
+    for u, v, key, attrs in graph.iter_edges():
+        handle.write("    <edge source={0} target={1} id=\"{2}\">\n{3}"
+                     "    </edge>\n".format(node_ids[u], node_ids[v], key,
+                                            _graphml_data(attrs, edge_keys)))
+    handle.write("  </graph>\n</graphml>\n")
+
+
+def _gml_value(value):
+    """Format a value as GML, quoting and escaping strings"""
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    elif isinstance(value, (int, float)):
+        return repr(value)
+    return '"{0}"'.format(str(value).replace('&', '&amp;')
+                          .replace('"', '&quot;'))
+
+
+def _xml_value(value):
+    """Format a value for an XML attribute or element"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _write_gexf_attributes(handle, cls, attr_types):
+    """Declare the attributes of one class; return a dict of their IDs"""
+    keys = dict()
+    handle.write("    <attributes class=\"{0}\" mode=\"static\">\n"
+                 .format(cls))
+    for i, (name, attr_type) in enumerate(attr_types):
+        keys[name] = str(i)
+        handle.write("      <attribute id=\"{0}\" title={1} type=\"{2}\" />\n"
+                     .format(i, quoteattr(name), XML_TYPES[attr_type]))
+    handle.write("    </attributes>\n")
+    return keys
+
+
+def _gexf_attvalues(attrs, keys):
+    if not attrs:
+        return ''
+    return "        <attvalues>\n{0}        </attvalues>\n".format(''.join(
+        "          <attvalue for=\"{0}\" value={1} />\n".format(
+            keys[name], quoteattr(_xml_value(value)))
+        for name, value in attrs.items()))
+
+
+def _write_graphml_keys(handle, domain, attr_types, first):
+    """Declare the keys of one domain; return a dict of their IDs"""
+    keys = dict()
+    for i, (name, attr_type) in enumerate(attr_types, first):
+        keys[name] = 'd{0}'.format(i)
+        handle.write("  <key attr.name={0} attr.type=\"{1}\" for=\"{2}\" "
+                     "id=\"{3}\" />\n".format(quoteattr(name),
+                                             XML_TYPES[attr_type],
+                                             domain, keys[name]))
+    return keys
+
+
+def _graphml_data(attrs, keys):
+    return ''.join("      <data key=\"{0}\">{1}</data>\n".format(
+        keys[name], escape(_xml_value(value)))
+        for name, value in attrs.items())
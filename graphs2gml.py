@@ -7,11 +7,20 @@ Created on Thu Mar  6 21:20:18 2014
 """
 
 
+import os
 import sys
 import argparse
 import re
 
-import networkx as nx
+import numpy as np
+
+from blastReader import BlastReader, decode_ids
+from edgeRecords import EdgeRecords
+from labelIndex import KOG_PATTERN, get_label_index, save_label_index
+from graphWriters import write_gml, write_gexf, write_graphml
+from graphCache import GraphCache
+from compressedFiles import (InputFileType, open_input, open_output,
+                             get_output_name)
 
 
 def main(argv=None):
@@ -32,34 +41,46 @@ def main(argv=None):
 
     args = get_parsed_args()
 
-    MG = nx.MultiGraph()
+    label_index = get_label_index(path=args.label_index,
+                                  pattern=args.label_pattern)
+    records = EdgeRecords(idchar=args.idchar,
+                          min_cocluster=args.min_cocluster,
+                          label_index=label_index)
+
+    cache = None
+    if args.cache_dir:
+        cache = GraphCache(args.cache_dir,
+                           max_bytes=int(args.cache_size * 1048576))
 
     # Add comprehensive list of nodes to graph from original BLAST file
-    get_nodes_from_blast(MG=MG, blast=args.blast, bscol=args.bscol,
-                         qlcol=args.qlcol, idchar=args.idchar)
+    get_nodes_from_blast(records=records, blast=args.blast,
+                         bscol=args.bscol-1, qlcol=args.qlcol-1, cache=cache)
 
     # Add edges present in the various graphs output by blast2graph.py
     for graph_handle in args.graphs:
-        add_edges_from_graph(MG=MG, graph_handle=graph_handle)
+        add_edges_from_graph(records=records, graph_handle=graph_handle)
 
     # Add edges between nodes that co-clustered in at least one MCL clustering
-    for mcl_file in args.clusterings:
-        mcl_handle = open(mcl_file)
-        add_edges_from_clustering(MG=MG, mcl_handle=mcl_handle)
-        mcl_handle.close()
+    add_edges_from_clusterings(records=records, mcl_files=args.clusterings,
+                               processes=args.jobs)
+    records.count_new_coclusters()
 
     # Print one or more network files to be viewed in Cytoscape and/or Gephi
     prefix = str(args.out_pref)
-    if args.compress:
-        suffix = '.'+str(args.compress)
-    else:
-        suffix = ''
-
-    nx.write_gml(MG, prefix+'.gml'+suffix)
+    writers = [('gml', write_gml)]
     if args.gexf:
-        nx.write_gexf(MG, prefix+'.gexf'+suffix)
+        writers.append(('gexf', write_gexf))
     if args.graphml:
-        nx.write_graphml(MG, prefix+'.graphml'+suffix)
+        writers.append(('graphml', write_graphml))
+
+    # Nodes and edges are streamed from the records, one at a time
+    for ext, write_graph in writers:
+        out_name = get_output_name(prefix+'.'+ext, args.compress)
+        with open_output(out_name, 'w', compress=args.compress,
+                         threads=args.compress_threads) as handle:
+            write_graph(records, handle)
+
+    save_label_index(label_index, args.label_index)
 
 
 def get_parsed_args():
@@ -89,23 +110,40 @@ def get_parsed_args():
                         action='store_true',
                         help="Print GraphML file in addition to the GML file")
     parser.add_argument('--compress', dest='compress', default=None,
+                        choices=['gz', 'bz2', 'zst'],
                         help="Compress output files using either the gzip " +
-                             "'gz' or bzip2 'bz2' compression algorithm " +
-                             "[def=None]")
+                             "'gz', bzip2 'bz2' or zstd 'zst' compression " +
+                             "algorithm [def=None]")
+    parser.add_argument('--compress_threads', dest='compress_threads',
+                        type=int, default=4,
+                        help="Number of threads compressing each output " +
+                             "file [def=4]")
     parser.add_argument('--blast', dest='blast',
-                        type=argparse.FileType('r'),
+                        type=InputFileType('r'),
                         help="BLASTp file containing self hits for every " +
-                             "node in the graph")
+                             "node in the graph (may be compressed)")
     parser.add_argument('--graphs', dest='graphs', nargs='+',
-                        type=argparse.FileType('r'),
+                        type=InputFileType('r'),
                         help="'abc' graphs like those produced by the " +
-                             "blast2graph.py program")
+                             "blast2graph.py program (may be compressed)")
     parser.add_argument('--clusterings', dest='clusterings', nargs='+',
-                        help="Clusterings generated by MCL. In order to " +
+                        help="Clusterings generated by MCL, which may be " +
+                             "compressed. In order to " +
                              "more easily support a very large number of " +
                              "clusterings, I do not pre-validate that each " +
                              "clustering file is actually a readable text " +
                              "file.")
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1,
+                        help="Number of processes reading and counting " +
+                             "the clusterings in parallel (the output does " +
+                             "not depend on it) [def=1]")
+    parser.add_argument('--min_cocluster', dest='min_cocluster', type=int,
+                        default=None,
+                        help="Also add cluster edges between sequences " +
+                             "without a graph edge that share a cluster in " +
+                             "at least this many clusterings of the same " +
+                             "metric (by default only pairs with a graph " +
+                             "edge get co-clustering counts) [def=None]")
     parser.add_argument('--bscol', dest='bscol', type=int, default=12,
                         help="One-indexed column containing pairwise bit " +
                              "scores (not required if files include " +
@@ -117,63 +155,101 @@ def get_parsed_args():
     parser.add_argument('--idchar', dest='idchar', default='|',
                         help="The character used to separate the organism " +
                              "ID from the rest of the sequence ID [def='|']")
+    parser.add_argument('--label_pattern', dest='label_pattern',
+                        default=KOG_PATTERN,
+                        help="Regular expression locating the KOG (or other " +
+                             "label) in each sequence ID; the first group is " +
+                             "used if it has one [def="+KOG_PATTERN+"]")
+    parser.add_argument('--label_index', dest='label_index', default=None,
+                        help="File (.npz) holding the label of each " +
+                             "sequence ID; read if it exists, and written " +
+                             "otherwise (may be shared with mcl2rtab.py)")
+    parser.add_argument('--cache_dir', dest='cache_dir', default=None,
+                        help="Directory in which the self-hits read from " +
+                             "the BLAST file are cached, so that later runs " +
+                             "on the same file skip reading it (may be " +
+                             "shared with blast2graphs.py)")
+    parser.add_argument('--cache_size', dest='cache_size', type=float,
+                        default=10240,
+                        help="Largest total size of the cache in MB; the " +
+                             "least recently used entries are removed " +
+                             "first [def=10240]")
 
     args = parser.parse_args()
 
     return args
 
 
-def get_nodes_from_blast(MG, blast, bscol, qlcol, idchar):
-    """Store sequence information from BLAST file in NetworkX graph
+def get_nodes_from_blast(records, blast, bscol, qlcol, cache=None):
+    """Store sequence information from BLAST file as nodes in EdgeRecords
+
+    Only the self-hits are used; bscol and qlcol are zero-based. If a
+    GraphCache is given, the self-hits are loaded from it when the BLAST file
+    has been read before, and saved to it otherwise.
     """
-    for line in blast:
-        temp = line.strip().split()
-        if not temp:
-            continue
-        elif temp[0][0] == "#":
-            continue
+    arrays = None
+    if cache is not None and os.path.isfile(blast.name):
+        cache_key = cache.get_key(blast.name, program='graphs2gml',
+                                  bscol=bscol, qlcol=qlcol)
+        arrays = cache.load(cache_key)
+    else:
+        cache = None
+
+    if arrays is None:
+        arrays = get_self_hit_arrays(blast=blast, bscol=bscol, qlcol=qlcol)
+        if cache is not None:
+            cache.save(cache_key, arrays,
+                       blast=os.path.abspath(blast.name))
 
-        if temp[0] == temp[1]:
-            seq_id = str(temp[0])
-            bit_scr = float(temp[bscol])
-            seq_len = int(temp[qlcol])
-            org_id = seq_id.split(idchar)[0]
-            try:
-                kog_id = re.search('KOG\d{4}', seq_id).group()
-            except AttributeError:
-                kog_id = None
+    # The organism and KOG of each node are taken from its ID
+    for seq_id, bit_scr, seq_len in zip(decode_ids(arrays['seq_ids']),
+                                        arrays['sbs'].tolist(),
+                                        arrays['len'].tolist()):
+        records.add_node(seq_id, seq_len=seq_len, bit_scr=bit_scr)
 
-            MG.add_node(seq_id, {'len': seq_len, 'sbs': bit_scr,
-                                 'org': org_id, 'kog': kog_id})
 
+def get_self_hit_arrays(blast, bscol, qlcol):
+    """Collect the sequence IDs, bit scores and lengths of all self-hits
 
-def add_edges_from_graph(MG, graph_handle):
+    Returns:
+        A dict with the arrays 'seq_ids' (byte strings), 'sbs' and 'len', in
+        file order
     """
+    seq_ids = list()
+    bit_scrs = list()
+    seq_lens = list()
+
+    reader = BlastReader(blast)
+    for chunk in reader.iter_chunks({0: None, 1: None, bscol: np.float64,
+                                     qlcol: np.int64}):
+        is_self = chunk[0] == chunk[1]
+        seq_ids.append(chunk[0][is_self])
+        bit_scrs.append(chunk[bscol][is_self])
+        seq_lens.append(chunk[qlcol][is_self])
+    reader.close()
+
+    if not seq_ids:
+        return dict(seq_ids=np.array([], dtype=bytes),
+                    sbs=np.array([], dtype=np.float64),
+                    len=np.array([], dtype=np.int64))
+
+    return dict(seq_ids=np.concatenate(seq_ids),
+                sbs=np.concatenate(bit_scrs), len=np.concatenate(seq_lens))
+
+
+def add_edges_from_graph(records, graph_handle):
+    """Store the weights from an abc graph file in EdgeRecords
+
+    The metric is identified from the file name; a later file with the same
+    metric replaces the weights of pairs it shares with an earlier one.
     """
     metric = get_metric_from_filename(graph_handle.name)
     for line in graph_handle:
         temp = line.strip().split()
         if not temp:
             continue
-        u = str(temp[0])
-        v = str(temp[1])
-        w = float(temp[2])
-
-        try:
-            MG[u][v][0][metric] = w
-
-        except KeyError:
-            org_match = False
-            if MG.node[u]['org'] == MG.node[v]['org']:
-                org_match = True
-
-            kog_match = False
-            if MG.node[u]['kog'] == MG.node[v]['kog']:
-                kog_match = True
-
-            MG.add_edge(u, v, attr_dict={metric: w, 'interaction': 'graph',
-                                         'Org_match': org_match,
-                                         'KOG_match': kog_match})
+        records.set_weight(str(temp[0]), str(temp[1]), metric,
+                           float(temp[2]))
 
 
 def get_metric_from_filename(filename):
@@ -195,38 +271,70 @@ def get_metric_from_filename(filename):
             "'_nle'.")
 
 
-def add_edges_from_clustering(MG, mcl_handle):
+def add_edges_from_clustering(records, mcl_handle):
+    """Count the pairs of sequences that share a cluster in an MCL clustering
+
+    The counts are kept for the metric identified from the file name.
     """
+    metric = get_metric_from_filename(mcl_handle.name)
+    records.add_clustering(read_clusters(mcl_handle), metric)
+
+
+def add_edges_from_clusterings(records, mcl_files, processes=1):
+    """Count co-clustered pairs in many MCL clusterings, in parallel
+
+    Each file is read and counted in a worker process holding a copy of the
+    records, and the counts are added to the records in the order of
+    mcl_files, so the result does not depend on the number of processes.
+
+    Args:
+        records: An EdgeRecords object that all graphs have been added to
+        mcl_files: A list of paths to (possibly compressed) clusterings
+        processes: Number of worker processes
     """
+    if processes <= 1 or len(mcl_files) <= 1:
+        for mcl_file in mcl_files:
+            mcl_handle = open_input(mcl_file)
+            add_edges_from_clustering(records=records, mcl_handle=mcl_handle)
+            mcl_handle.close()
+        return
+
+    import multiprocessing
+
+    pool = multiprocessing.Pool(processes=processes,
+                                initializer=_init_clustering_worker,
+                                initargs=(records,))
+    try:
+        for metric, counts in pool.imap(_count_clustering_file, mcl_files,
+                                        chunksize=1):
+            records.add_clustering_counts(counts, metric)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def read_clusters(mcl_handle):
+    """Read an MCL clustering as a list of lists of sequence IDs"""
+    clusters = [cluster.split() for cluster in mcl_handle]
+    return [seqs for seqs in clusters if seqs]
+
+
+# Records shared with the worker processes of add_edges_from_clusterings()
+_worker_records = None
+
+
+def _init_clustering_worker(records):
+    global _worker_records
+    _worker_records = records
+
+
+def _count_clustering_file(mcl_file):
+    mcl_handle = open_input(mcl_file)
     metric = get_metric_from_filename(mcl_handle.name)
-    for cluster in mcl_handle:
-        seqs = cluster.strip().split()
-        for u in seqs:
-            for v in seqs:
-                if u == v:
-                    break
-                else:
-                    try:
-                        MG[u][v][1][metric] += 1
-
-                    except KeyError:
-                        try:
-                            MG[u][v][1][metric] = 1
-
-                        except KeyError:
-                            org_match = False
-                            if MG.node[u]['org'] == MG.node[v]['org']:
-                                org_match = True
-
-                            kog_match = False
-                            if MG.node[u]['kog'] == MG.node[v]['kog']:
-                                kog_match = True
-
-                            MG.add_edge(u, v,
-                                        attr_dict={metric: 1,
-                                                   'interaction': 'cluster',
-                                                   'Org_match': org_match,
-                                                   'KOG_match': kog_match})
+    counts = _worker_records.get_clustering_counts(read_clusters(mcl_handle))
+    mcl_handle.close()
+
+    return metric, counts
 
 
 if __name__ == "__main__":
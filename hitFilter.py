@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+"""
+Ingestion-time filters for tabular BLAST hits.
+
+BLAST itself can only filter on E-value, and every hit it reports would
+otherwise be added to the graph, including a long tail of weak hits that MCL
+prunes anyway. The HitFilter class drops hits while the BLAST file is being
+parsed, before their sequence IDs are decoded or their metrics buffered, so
+filtered hits never take up memory and never reach the later stages.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+
+class HitFilter(object):
+    """Thresholds applied to each chunk of hits returned by a BlastReader
+
+    Self-hits are never filtered, since they provide the self-alignment
+    scores. Filters are applied in the order of the arguments below and each
+    removed hit is counted against the first filter it fails. The BSR filter
+    is the exception: it is counted per pair of sequences whose hits all fail
+    it (filtered_bsr_pairs), since the single pass reader only keeps the best
+    hit of each pair until the self-alignment scores are known.
+
+    Args:
+        max_evalue: Largest E-value kept
+        min_bit: Smallest bit score kept
+        min_qcov: Smallest fraction of the query length covered by the
+            alignment (from the qstart, qend and qlen columns)
+        min_scov: Smallest fraction of the subject length covered by the
+            alignment (from the sstart, send and slen columns)
+        top_hits: Keep only the first top_hits subjects hit by each query
+            (BLAST lists each query's hits from best to worst, and multiple
+            HSPs between the same two sequences count as one hit)
+        min_bsr: Smallest bit score ratio kept (applied by the caller once
+            self-alignment scores are known, see keep_bsr())
+        evcol, bscol, qlcol, slcol: Zero-based columns containing the
+            E-values, bit scores, query lengths and subject lengths
+    """
+    names = ('evalue', 'bit', 'qcov', 'scov', 'top_hits', 'bsr_pairs')
+
+    def __init__(self, max_evalue=None, min_bit=None, min_qcov=None,
+                 min_scov=None, top_hits=None, min_bsr=None,
+                 evcol=10, bscol=11, qlcol=12, slcol=13):
+        self.max_evalue = max_evalue
+        self.min_bit = min_bit
+        self.min_qcov = min_qcov
+        self.min_scov = min_scov
+        self.top_hits = top_hits
+        self.min_bsr = min_bsr
+        self.evcol = evcol
+        self.bscol = bscol
+        self.qlcol = qlcol
+        self.slcol = slcol
+        self.counts = OrderedDict(('filtered_'+name, 0) for name in self.names)
+        self._n_subjects = dict()  # query ID -> subjects ranked so far
+        self._last_pair = None  # (query, subject) of the last hit ranked
+
+    def filters_chunks(self):
+        """Check whether apply() can remove any hits"""
+        return not (self.max_evalue is None and self.min_bit is None and
+                    self.min_qcov is None and self.min_scov is None and
+                    self.top_hits is None)
+
+    def apply(self, chunk):
+        """Remove the hits that fail a filter from a chunk of BLAST columns
+
+        Args:
+            chunk: A dict of column arrays as yielded by
+                BlastReader.iter_chunks(), in file order
+
+        Returns:
+            A dict with the same columns, holding only the hits that passed
+        """
+        if not self.filters_chunks():
+            return chunk
+
+        keep = chunk[0] == chunk[1]  # Self-hits always pass
+        todo = ~keep
+
+        if self.max_evalue is not None:
+            evalue = compute_evalue_array(chunk[self.evcol][todo])
+            todo[todo] = self._count('evalue', evalue <= self.max_evalue)
+
+        if self.min_bit is not None:
+            bit = chunk[self.bscol][todo]
+            todo[todo] = self._count('bit', bit >= self.min_bit)
+
+        if self.min_qcov is not None:
+            qcov = compute_coverage(chunk[6][todo], chunk[7][todo],
+                                    chunk[self.qlcol][todo])
+            todo[todo] = self._count('qcov', qcov >= self.min_qcov)
+
+        if self.min_scov is not None:
+            scov = compute_coverage(chunk[8][todo], chunk[9][todo],
+                                    chunk[self.slcol][todo])
+            todo[todo] = self._count('scov', scov >= self.min_scov)
+
+        if self.top_hits is not None:
+            todo[todo] = self._count('top_hits', self._rank_subjects(
+                chunk[0][todo], chunk[1][todo]) <= self.top_hits)
+
+        keep |= todo
+        if keep.all():
+            return chunk
+
+        return dict((col, arr[keep]) for col, arr in chunk.items())
+
+    def keep_bsr(self, bsr, count=True):
+        """Mask of the bit score ratios that pass the BSR filter
+
+        Args:
+            bsr: The bit score ratio of the best hit of a pair of sequences,
+                or an array of them
+            count: Add the failures to filtered_bsr_pairs (leave it False
+                for hits that are not known to be the best of their pair, and
+                count the pairs with count_bsr_pairs() instead)
+        """
+        if self.min_bsr is None:
+            return np.ones(np.shape(bsr), dtype=bool)
+        passed = np.asarray(bsr) >= self.min_bsr
+        if count:
+            self._count('bsr_pairs', passed)
+        return passed
+
+    def count_bsr_pairs(self, n):
+        """Add n pairs of sequences dropped by the BSR filter"""
+        self.counts['filtered_bsr_pairs'] += n
+
+    def _count(self, name, passed):
+        """Add the number of hits failing a filter to its counter"""
+        self.counts['filtered_'+name] += int(np.size(passed) -
+                                             np.count_nonzero(passed))
+        return passed
+
+    def _rank_subjects(self, qry, ref):
+        """Number the distinct subjects hit by each query in file order
+
+        Consecutive hits between the same two sequences (multiple HSPs)
+        share a number. The count for each query is carried over between
+        chunks.
+
+        Returns:
+            An array with the one-based rank of each hit's subject among all
+            of the subjects hit by its query so far
+        """
+        n_hits = len(qry)
+        if n_hits == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        is_new = np.ones(n_hits, dtype=bool)
+        is_new[1:] = (qry[1:] != qry[:-1]) | (ref[1:] != ref[:-1])
+        if self._last_pair == (qry[0], ref[0]):
+            is_new[0] = False
+
+        uniq, inverse = np.unique(qry, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='mergesort')
+        sizes = np.bincount(inverse, minlength=len(uniq))
+        group_beg = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+
+        # Running count of new subjects within each query's hits
+        new_sum = np.cumsum(is_new[order])
+        before = np.concatenate(([0], new_sum))[group_beg]
+        prior = np.array([self._n_subjects.get(q, 0) for q in uniq.tolist()],
+                         dtype=np.int64)
+
+        rank = np.empty(n_hits, dtype=np.int64)
+        rank[order] = new_sum - np.repeat(before - prior, sizes)
+
+        totals = prior + np.bincount(inverse, weights=is_new,
+                                     minlength=len(uniq)).astype(np.int64)
+        for q, total in zip(uniq.tolist(), totals.tolist()):
+            self._n_subjects[q] = total
+        self._last_pair = (qry[-1], ref[-1])
+
+        return rank
+
+
+def compute_evalue_array(evalue):
+    """Convert an array of E-value strings to floats, each distinct one once
+    """
+    uniq, inverse = np.unique(np.asarray(evalue), return_inverse=True)
+    return uniq.astype(np.float64)[inverse.ravel()]
+
+
+def compute_coverage(aln_beg, aln_end, seq_len):
+    """Fraction of a sequence covered by an alignment (either strand)"""
+    aln_beg = np.asarray(aln_beg, dtype=np.float64)
+    aln_end = np.asarray(aln_end, dtype=np.float64)
+    return (np.abs(aln_end - aln_beg) + 1) / np.asarray(seq_len,
+                                                        dtype=np.float64)
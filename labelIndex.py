@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+Index of the reference class (eg. KOG) of each sequence ID.
+
+mcl2rtab.py and graphs2gml.py need the KOG of every sequence they see, and
+the same sequence IDs turn up in every one of hundreds of clusterings. The
+LabelIndex class runs the label pattern once per distinct sequence ID and
+keeps the result as a small integer code, so that scoring a clustering only
+needs dict lookups followed by NumPy array operations on the codes.
+
+The index can be built up front from the FASTA or BLAST file the clusterings
+were made from, and saved to (and later loaded from) an .npz file so that
+other runs and programs can share it. The pattern is a regular expression:
+the label is its first group if it has one, otherwise the whole match, so
+sequences can be scored against classifications other than KOGs.
+"""
+
+import re
+
+import numpy as np
+
+from blastReader import BlastReader, decode_ids, encode_ids
+
+
+KOG_PATTERN = r'KOG\d{4}'
+
+
+class LabelIndex(object):
+    """Sequence ID -> integer label code, with the label of each code
+
+    Sequences whose IDs do not match the pattern get the code -1.
+
+    Args:
+        pattern: Regular expression locating the label in a sequence ID
+    """
+
+    def __init__(self, pattern=KOG_PATTERN):
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.labels = list()  # code -> label
+        self.label_code = dict()  # label -> code
+        self.seq_code = dict()  # sequence ID -> code
+        self.n_saved = 0  # Number of sequence IDs in the saved file
+        self.new_ids = None  # IDs matched since pop_new_labels(), if tracked
+
+    def code(self, seq_id):
+        """Return the label code of a sequence ID, matching it if needed"""
+        code = self.seq_code.get(seq_id)
+        if code is None:
+            code = self.seq_code[seq_id] = self._match(seq_id)
+            if self.new_ids is not None:
+                self.new_ids.append(seq_id)
+        return code
+
+    def codes(self, seq_ids):
+        """Return an array with the label code of each sequence ID"""
+        seq_code = self.seq_code
+        codes = [seq_code.get(seq_id) for seq_id in seq_ids]
+        if None in codes:
+            codes = [self.code(seq_id) for seq_id in seq_ids]
+        return np.array(codes, dtype=np.int64)
+
+    def label(self, seq_id):
+        """Return the label of a sequence ID, or None if it has none"""
+        code = self.code(seq_id)
+        return None if code < 0 else self.labels[code]
+
+    def pop_new_labels(self):
+        """Return (sequence ID, label) for each ID matched since the last call
+
+        New IDs are only tracked once this has been called, eg. in a worker
+        process whose labels are merged back with add_labels().
+        """
+        seq_labels = [(seq_id, self.label(seq_id))
+                      for seq_id in self.new_ids or ()]
+        self.new_ids = list()
+        return seq_labels
+
+    def add_labels(self, seq_labels):
+        """Add sequence IDs whose labels are already known
+
+        Args:
+            seq_labels: (sequence ID, label) pairs, the label None for IDs
+                without one, as returned by pop_new_labels()
+        """
+        seq_code = self.seq_code
+        for seq_id, label in seq_labels:
+            if seq_id not in seq_code:
+                seq_code[seq_id] = -1 if label is None else \
+                    self._label_code(label)
+
+    def get_label_ranks(self):
+        """Return the position of each code's label in sorted label order"""
+        ranks = np.empty(len(self.labels), dtype=np.int64)
+        ranks[sorted(range(len(self.labels)),
+                     key=self.labels.__getitem__)] = np.arange(
+                         len(self.labels))
+        return ranks
+
+    def add_fasta(self, fasta_handle):
+        """Index the ID (first word) of every header line in a FASTA file"""
+        for line in fasta_handle:
+            if line.startswith('>'):
+                words = line[1:].split()
+                if words:
+                    self.code(words[0])
+
+    def add_blast(self, blast_handle):
+        """Index every query sequence ID in a tabular BLAST file"""
+        reader = BlastReader(blast_handle)
+        for chunk in reader.iter_chunks({0: None}):
+            for seq_id in decode_ids(np.unique(chunk[0])):
+                self.code(seq_id)
+        reader.close()
+
+    def save(self, path):
+        """Save the index as an .npz file"""
+        seq_ids = list(self.seq_code.keys())
+        handle = open(path, 'wb')
+        np.savez(handle, pattern=np.array(self.pattern),
+                 labels=encode_ids(self.labels), seq_ids=encode_ids(seq_ids),
+                 codes=np.array([self.seq_code[seq_id] for seq_id in seq_ids],
+                                dtype=np.int32))
+        handle.close()
+        self.n_saved = len(seq_ids)
+
+    @classmethod
+    def load(cls, path, pattern=KOG_PATTERN):
+        """Load an index saved by save()
+
+        Raises:
+            ValueError: If the index was built with another pattern
+        """
+        data = np.load(path)
+        if str(data['pattern']) != pattern:
+            raise ValueError(
+                ("Label index {0} was built with the pattern '{1}', not " +
+                 "'{2}'").format(path, data['pattern'], pattern))
+
+        index = cls(pattern)
+        index.labels = decode_ids(data['labels'])
+        index.label_code = dict((label, code) for code, label in
+                                enumerate(index.labels))
+        index.seq_code = dict(zip(decode_ids(data['seq_ids']),
+                                  data['codes'].tolist()))
+        index.n_saved = len(index.seq_code)
+        return index
+
+    def _match(self, seq_id):
+        match = self.regex.search(seq_id)
+        if match is None:
+            return -1
+        return self._label_code(match.group(1) if self.regex.groups
+                                else match.group())
+
+    def _label_code(self, label):
+        code = self.label_code.get(label)
+        if code is None:
+            code = self.label_code[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+
+def get_label_index(path=None, pattern=KOG_PATTERN, fasta=None, blast=None):
+    """Load a saved label index, or build a new one
+
+    Args:
+        path: An .npz file written by LabelIndex.save(), used if it exists
+        pattern: Regular expression locating the label in a sequence ID
+        fasta: A FASTA file handle whose sequence IDs are indexed up front
+        blast: A BLAST file handle whose query IDs are indexed up front
+
+    Returns:
+        A LabelIndex
+    """
+    import os
+
+    if path and os.path.isfile(path):
+        return LabelIndex.load(path, pattern)
+
+    index = LabelIndex(pattern)
+    if fasta is not None:
+        index.add_fasta(fasta)
+    if blast is not None:
+        index.add_blast(blast)
+    return index
+
+
+def save_label_index(index, path):
+    """Save a label index if it has grown since it was loaded or saved"""
+    if path and len(index.seq_code) != index.n_saved:
+        index.save(path)
@@ -3,13 +3,67 @@
 """
 This script should work with clusters of any sequences whose IDs contain the
 typical KOG identifiers in their standard format, the keyword 'KOG' followed
-by a four digit ID number (eg. KOG0001, KOG2437, etc.).
+by a four digit ID number (eg. KOG0001, KOG2437, etc.). Other labels can be
+located with the --label_pattern option.
+
+Every clustering is read once and reduced to a table of the number of members
+of each KOG in each cluster, from which the KOGs per cluster and clusters per
+KOG histograms are counted as integer arrays. The histograms of all
+clusterings are written to a single table, <prefix>_kog_summary.Rtab, with
+one row per histogram bin:
+
+    Order, Fragmentation, EvalueCutoff, Normalization, Dimensionalization,
+    Metric, Inflation: The clustering, as parsed from its file name
+    Measure: 'KOGsPerCluster' or 'ClustersPerKOG'
+    Value: The number of KOGs in a cluster, or of clusters holding a KOG
+    ClusterCount: The number of clusters (or KOGs) with that value
+
+How well each clustering agrees with the KOGs is also summarized in
+<prefix>_clustering_scores.Rtab, one row per clustering, by the pairwise
+precision, recall and F1 score, the adjusted Rand index and the normalized
+mutual information. All of them are computed from the cluster x KOG table,
+without enumerating pairs of sequences.
 """
 
 import sys
 import re
 import argparse
 
+import numpy as np
+
+from labelIndex import KOG_PATTERN, get_label_index, save_label_index
+from compressedFiles import (InputFileType, open_input, open_output,
+                             get_output_name, strip_compression_suffix)
+
+
+# Columns describing a clustering, parsed from its file name
+PROPERTY_COLUMNS = ('Order', 'Fragmentation', 'EvalueCutoff', 'Normalization',
+                    'Dimensionalization', 'Metric', 'Inflation')
+
+# Columns describing the agreement of a clustering with the KOGs
+SCORE_COLUMNS = ('Sequences', 'Clusters', 'KOGs', 'PairPrecision',
+                 'PairRecall', 'PairF1', 'ARI', 'NMI')
+
+# File name tags, with the column and value each one stands for. When a name
+# holds two tags for the same column, the one listed first here is used.
+FILE_NAME_TAGS = (('ord', 'Order', 'Ordered'),
+                  ('shf', 'Order', 'Shuffled'),
+                  ('evn', 'Fragmentation', 'Even'),
+                  ('rnd', 'Fragmentation', 'Random'),
+                  ('raw', 'Normalization', 'Raw'),
+                  ('nrm', 'Normalization', 'Normalized'),
+                  ('dmnd', 'Dimensionalization', 'Dimensioned'),
+                  ('dmls', 'Dimensionalization', 'Dimensionless'),
+                  ('nle', 'Metric', '-Log10Evalue'),
+                  ('bit', 'Metric', 'BitScore'),
+                  ('bsr', 'Metric', 'BitScoreRatio'),
+                  ('bal', 'Metric', 'AnchoredLength'))  # Bit Per Length
+
+# Finds every tag, E-value cutoff ('_1e-X') and inflation ('_I##') in one pass
+FILE_NAME_PATTERN = re.compile(
+    r'_(?:(' + '|'.join(tag for tag, column, value in FILE_NAME_TAGS) +
+    r')|(1e-\d+)|I(\d{2}))')
+
 
 def main(argv=None):
     """Where the magic happens!
@@ -23,26 +77,52 @@ def main(argv=None):
 
     args = get_parsed_args()
 
-    kpc_handle = open(args.prefix+"_kogs_per_cluster_summary.Rtab", 'w')
-    kpc_handle.write("Order\tFragmentation\tEvalueCutoff\tNormalization\t" +
-                     "Dimensionalization\tMetric\tInflation\t" +
-                     "KOGsPerCluster\tClusterCount\n")
+    # Each sequence ID is matched against the label pattern only once
+    label_index = get_label_index(path=args.label_index,
+                                  pattern=args.label_pattern,
+                                  fasta=args.fasta, blast=args.blast)
+
+    summary_handle = open_output(
+        get_output_name(args.prefix+"_kog_summary.Rtab", args.compress), 'w',
+        compress=args.compress)
+    summary_handle.write('\t'.join(PROPERTY_COLUMNS) +
+                         "\tMeasure\tValue\tClusterCount\n")
+
+    kogs_handle = None
+    if args.cluster_kogs:
+        kogs_handle = open_output(
+            get_output_name(args.prefix+"_cluster_kogs.tsv", args.compress),
+            'w', compress=args.compress)
+        kogs_handle.write("Clustering\tCluster\tKOG\tSequenceCount\n")
+
+    scores_handle = open_output(
+        get_output_name(args.prefix+"_clustering_scores.Rtab", args.compress),
+        'w', compress=args.compress)
+    scores_handle.write('\t'.join(PROPERTY_COLUMNS + SCORE_COLUMNS)+'\n')
+
+    # Rows are printed in the order of the files, however many processes
+    for mcl_name, mcl_properties, kogs_per_cluster, clusters_per_kog, \
+            scores, cluster_kogs in score_clustering_files(
+                args.mcl_files, label_index, cluster_kogs=args.cluster_kogs,
+                processes=args.jobs, merge_labels=bool(args.label_index)):
 
-    cpk_handle = open(args.prefix+"_clusters_per_kog_summary.Rtab", 'w')
-    cpk_handle.write("Order\tFragmentation\tEvalueCutoff\tNormalization\t" +
-                     "Dimensionalization\tMetric\tInflation\t" +
-                     "ClustersPerKOG\tClusterCount\n")
+        print_histogram(summary_handle, 'KOGsPerCluster', kogs_per_cluster,
+                        mcl_properties)
 
-    for mcl_file in args.mcl_files:
-        mcl_properties = parse_file_name(mcl_file.name)
-        kogs_per_cluster, clusters_per_kog = score_clustering(mcl_file)
+        print_histogram(summary_handle, 'ClustersPerKOG', clusters_per_kog,
+                        mcl_properties)
 
-        print_kpc(kpc_handle, kogs_per_cluster, *mcl_properties)
+        print_scores(scores_handle, scores, mcl_properties)
 
-        print_cpk(cpk_handle, clusters_per_kog, *mcl_properties)
+        if kogs_handle is not None:
+            print_cluster_kogs(kogs_handle, mcl_name, *cluster_kogs)
 
-    kpc_handle.close()
-    cpk_handle.close()
+    summary_handle.close()
+    scores_handle.close()
+    if kogs_handle is not None:
+        kogs_handle.close()
+
+    save_label_index(label_index, args.label_index)
 
 
 def get_parsed_args():
@@ -65,9 +145,40 @@ def get_parsed_args():
                     "of MCL clustering files")
 
     parser.add_argument('prefix',
-                        help='Prefix for global summary files')
-    parser.add_argument('mcl_files', nargs='+', type=argparse.FileType('r'),
-                        help='MCL output files')
+                        help='Prefix for the summary table(s)')
+    parser.add_argument('mcl_files', nargs='+', type=InputFileType('r'),
+                        help='MCL output files (may be compressed with ' +
+                             'gzip, bzip2 or zstd)')
+    parser.add_argument('--jobs', dest='jobs', type=int, default=1,
+                        help='Number of processes scoring clusterings in ' +
+                             'parallel [def=1]')
+    parser.add_argument('--compress', dest='compress', default=None,
+                        choices=['gz', 'bz2', 'zst'],
+                        help='Compress the summary table(s) with gzip, ' +
+                             'bzip2 or zstd [def=None]')
+    parser.add_argument('--cluster_kogs', dest='cluster_kogs', default=False,
+                        action='store_true',
+                        help='Also write the number of members of each KOG ' +
+                             'in each cluster of every clustering to one ' +
+                             'table, <prefix>_cluster_kogs.tsv')
+    parser.add_argument('--label_pattern', dest='label_pattern',
+                        default=KOG_PATTERN,
+                        help='Regular expression locating the KOG (or other ' +
+                             'label) in each sequence ID; the first group ' +
+                             'is used if it has one [def=' + KOG_PATTERN + ']')
+    parser.add_argument('--label_index', dest='label_index', default=None,
+                        help='File (.npz) holding the label of each ' +
+                             'sequence ID; read if it exists, and written ' +
+                             'otherwise, so that later runs (and ' +
+                             'graphs2gml.py) can reuse it')
+    parser.add_argument('--fasta', dest='fasta', type=InputFileType('r'),
+                        default=None,
+                        help='FASTA file whose sequence IDs are indexed ' +
+                             'before scoring (may be compressed)')
+    parser.add_argument('--blast', dest='blast', type=InputFileType('r'),
+                        default=None,
+                        help='BLAST file whose query IDs are indexed ' +
+                             'before scoring (may be compressed)')
 
     args = parser.parse_args()
 
@@ -76,89 +187,196 @@ def get_parsed_args():
 
 def parse_file_name(mcl_file_name):
     """Gather information about cluster generation parameters from file name
+
+    Returns
+    -------
+    tuple
+        The values of PROPERTY_COLUMNS: order, fragmentation, E-value cutoff,
+        normalization, dimensionalization, metric and inflation
     """
-    # Determine if fragmentation scheme was randomized for each KOG
-    if re.search('_ord', mcl_file_name):
-        ordr = "Ordered"
-    elif re.search('_shf', mcl_file_name):
-        ordr = "Shuffled"
-    else:
-        raise Exception(
-            "Could not determine if fragmentation scheme was shuffled or " +
-            "applied directly for file "+mcl_file_name+". Make sure file " +
-            "names contain either '_ord' or '_shf'.")
-
-    # Determine if break points were evenly spaced
-    if re.search('_evn', mcl_file_name):
-        frag = "Even"
-    elif re.search('_rnd', mcl_file_name):
-        frag = "Random"
-    else:
-        raise Exception(
-            "Could not determine if break points were evenly spaced in " +
-            "file "+mcl_file_name+". Make sure file names contain either " +
-            "'_evn' or '_rnd'.")
-
-    # Determine E-value cutoff used for BLASTp
-    evl_ctof = re.search('_1e-\d+', mcl_file_name)
-    if evl_ctof:
-        ctof = evl_ctof.group(0).lstrip('_')
-    else:
-        raise Exception(
-            "Could not determine BLAST E-value cutoff for file " +
-            mcl_file_name+". Make sure file names indicate the E-value " +
-            "cutoff using fomat '_1e-X'.")
-
-    # Determine if graph was normalized (by inter-/intr-organsm averages)
-    if re.search('_raw', mcl_file_name):
-        norm = "Raw"
-    elif re.search('_nrm', mcl_file_name):
-        norm = "Normalized"
-    else:
-        raise Exception(
-            "Could not determine if file "+mcl_file_name+" was normalized. " +
-            "Make sure file names contain either '_raw', '_nrm'.")
-
-    # Determine if edge weights have dimensions or are dimensionless
-    if re.search('_dmnd', mcl_file_name):
-        dmsn = "Dimensioned"
-    elif re.search('_dmls', mcl_file_name):
-        dmsn = "Dimensionless"
-    else:
-        raise Exception(
-            "Could not determine if file "+mcl_file_name+" has dimensions. " +
-            "Make sure file names contain either '_dmnd' or '_dmls'.")
-
-    # Identify metric used to weight graph
-    if re.search('_nle', mcl_file_name):
-        mtrc = "-Log10Evalue"
-    elif re.search('_bit', mcl_file_name):
-        mtrc = "BitScore"
-    elif re.search('_bsr', mcl_file_name):
-        mtrc = "BitScoreRatio"
-    elif re.search('_bal', mcl_file_name):  # Bit Per Length
-        mtrc = "AnchoredLength"
-    else:
-        raise Exception(
-            "Could not determine metric used for file "+mcl_file_name+". " +
-            "Make sure file names contain one of '_bit', '_bsr', '_bal', or " +
-            "'_nle'.")
-
-    # Identify inflation parameter used by MCL
-    if re.search('I\d{2}', mcl_file_name):
-        infl = re.search('_I\d{2}', mcl_file_name).group()
-        infl = float(infl.lstrip('_I'))/10
-    else:
-        raise Exception(
-            "Could not determine inflation value for "+mcl_file_name+". " +
-            "Make sure file names contain '_I##' where '##' is the " +
-            "inflation parameter (sans decimal)")
+    tags = set()
+    values = dict()
+    for tag, ctof, infl in FILE_NAME_PATTERN.findall(mcl_file_name):
+        if tag:
+            tags.add(tag)
+        elif ctof:
+            values.setdefault('EvalueCutoff', ctof)
+        else:
+            values.setdefault('Inflation', float(infl)/10)
+
+    for tag, column, value in FILE_NAME_TAGS:
+        if tag in tags:
+            values.setdefault(column, value)
+
+    for column in PROPERTY_COLUMNS:
+        if column not in values:
+            raise Exception(
+                "Could not determine the "+column+" of file " +
+                mcl_file_name+". Make sure file names contain " +
+                get_tag_hint(column)+".")
+
+    return tuple(values[column] for column in PROPERTY_COLUMNS)
+
+
+def get_tag_hint(column):
+    """Describe the file name tags giving the value of a column"""
+    if column == 'EvalueCutoff':
+        return "the BLAST E-value cutoff in the format '_1e-X'"
+    elif column == 'Inflation':
+        return ("'_I##' where '##' is the inflation parameter (sans " +
+                "decimal)")
+    return "one of " + ", ".join("'_"+tag+"'" for tag, tag_column, value in
+                                 FILE_NAME_TAGS if tag_column == column)
+
+
+def score_clustering_files(mcl_files, label_index, cluster_kogs=False,
+                           processes=1, merge_labels=False):
+    """Score many MCL cluster files, in parallel if processes > 1
+
+    Parameters
+    ----------
+    mcl_files : list of readable_file_handles
+        MCL clusterings; with more than one process, each file is re-opened
+        by name in a worker process
+    label_index : LabelIndex
+        Label of each sequence ID, copied to the worker processes
+    cluster_kogs : bool, optional
+        Also return the KOG counts of each cluster
+    processes : int, optional
+        Number of worker processes
+    merge_labels : bool, optional
+        Add the labels matched in the worker processes to label_index, so
+        that it can be saved
+
+    Yields
+    ------
+    (mcl_name, mcl_properties, kogs_per_cluster, clusters_per_kog, scores,
+    cluster_kogs) for each file, in the order of mcl_files; mcl_name has no
+    compression suffix and cluster_kogs is None unless requested
+    """
+    if processes <= 1 or len(mcl_files) <= 1:
+        for mcl_file in mcl_files:
+            yield score_clustering_file(mcl_file, label_index, cluster_kogs)
+            mcl_file.close()
+        return
+
+    import multiprocessing
+
+    tasks = list()
+    for mcl_file in mcl_files:
+        tasks.append((mcl_file.name, cluster_kogs))
+        mcl_file.close()
+
+    pool = multiprocessing.Pool(processes=processes,
+                                initializer=_init_scoring_worker,
+                                initargs=(label_index, merge_labels))
+    try:
+        for result, seq_labels in pool.imap(_score_clustering_file, tasks,
+                                            chunksize=1):
+            label_index.add_labels(seq_labels)
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def score_clustering_file(mcl_file, label_index, cluster_kogs=False):
+    """Parse the name of an MCL cluster file and score its clusters
+
+    Returns
+    -------
+    The tuples yielded by score_clustering_files()
+    """
+    mcl_name = strip_compression_suffix(mcl_file.name)
+    mcl_properties = parse_file_name(mcl_name)
+    contingency = get_contingency_table(mcl_file, label_index)
+    kogs_per_cluster, clusters_per_kog = score_clustering(contingency)
+    scores = get_agreement_scores(contingency)
+
+    kog_counts = None
+    if cluster_kogs:
+        labels = sorted(label_index.labels)
+        n_clusters, pair_clusters, pair_ranks, pair_counts = contingency
+        kog_counts = (pair_clusters, [labels[rank] for rank in
+                                      pair_ranks.tolist()], pair_counts)
+
+    return (mcl_name, mcl_properties, kogs_per_cluster, clusters_per_kog,
+            scores, kog_counts)
+
+
+# Label index shared with the worker processes of score_clustering_files()
+_worker_label_index = None
+
+
+def _init_scoring_worker(label_index, merge_labels):
+    global _worker_label_index
+    _worker_label_index = label_index
+    if merge_labels:
+        label_index.pop_new_labels()  # Start tracking new IDs
+
+
+def _score_clustering_file(task):
+    mcl_name, cluster_kogs = task
+    mcl_file = open_input(mcl_name)
+    result = score_clustering_file(mcl_file, _worker_label_index,
+                                   cluster_kogs)
+    mcl_file.close()
+
+    # Sequence IDs first seen here, for the parent's copy of the index
+    seq_labels = list()
+    if _worker_label_index.new_ids is not None:
+        seq_labels = _worker_label_index.pop_new_labels()
+
+    return result, seq_labels
+
 
-    return ordr, frag, ctof, norm, dmsn, mtrc, infl
+def get_contingency_table(mcl_file, label_index):
+    """Count the members of each KOG in each cluster of an MCL cluster file
 
+    The file is read once, line by line, keeping only the integer KOG code of
+    each member. Sequences without a KOG are left out.
 
-def score_clustering(mcl_file):
-    """Gather statistics from an MCL cluster file
+    Parameters
+    ----------
+    mcl_file : readable_file_handle
+        A set of MCL clusters, one per line
+    label_index : LabelIndex
+        Label (KOG) of each sequence ID
+
+    Returns
+    -------
+    n_clusters : int
+        Number of clusters (lines) in the file
+    pair_clusters, pair_ranks, pair_counts : numpy.ndarray
+        The sparse cluster x KOG table: for every (cluster, KOG) pair with at
+        least one member, the cluster number, the rank of the KOG in
+        alphabetical order and the number of members, ordered by cluster and
+        then KOG
+    """
+    code = label_index.code
+    codes = list()
+    sizes = list()
+    for cluster in mcl_file:
+        seqs = cluster.split()
+        codes.extend([code(seq) for seq in seqs])
+        sizes.append(len(seqs))
+
+    n_clusters = len(sizes)
+    members = np.array(codes, dtype=np.int64)
+    clusters = np.repeat(np.arange(n_clusters, dtype=np.int64), sizes)
+
+    ranks = label_index.get_label_ranks()
+    n_labels = max(len(ranks), 1)
+    is_labelled = members >= 0
+    pairs, pair_counts = np.unique(
+        clusters[is_labelled] * n_labels + ranks[members[is_labelled]],
+        return_counts=True)
+
+    return n_clusters, pairs // n_labels, pairs % n_labels, pair_counts
+
+
+def score_clustering(contingency):
+    """Gather statistics from the cluster x KOG table of an MCL clustering
 
     The function focuses on two measures of success:
 
@@ -174,91 +392,154 @@ def score_clustering(mcl_file):
 
     Parameters
     ----------
-    mcl_file : readable_file_handle
-        A set of MCL clusters
+    contingency : tuple
+        As returned by get_contingency_table()
 
     Returns
     -------
-    kogs_per_cluster : dict
-        Keyed by the number of KOGs represented within a particular cluster,
+    kogs_per_cluster : numpy.ndarray
+        Indexed by the number of KOGs represented within a particular cluster,
         and storing the number of clusters containing members of that number of
-        KOGs as values.
-    clusters_per_kog : dict
-        Keyed by the number of clusters containing members of a particular KOG,
-        and storing the number of KOGs spread across that number of clusters as
-        values.
+        KOGs.
+    clusters_per_kog : numpy.ndarray
+        Indexed by the number of clusters containing members of a particular
+        KOG, and storing the number of KOGs spread across that number of
+        clusters.
     """
-    cluster_counts_by_kog = dict()  # clusters/KOG requires 2-step processing
-    clusters_per_kog = dict()
-    kogs_per_cluster = dict()
+    n_clusters, pair_clusters, pair_ranks, pair_counts = contingency
 
-    # Print a per-line KOG summary to a special file for each MCL clustering
-    per_cluster_stats = open(mcl_file.name+"-kog_summary", 'w')
+    kogs_in_cluster = np.bincount(pair_clusters, minlength=n_clusters)
+    clusters_of_kog = np.bincount(pair_ranks)
 
-    # Parse each cluster
-    for cluster in mcl_file:
-        seqs = cluster.strip().split()
-        kog_counts = dict()
-
-        # Count occurance of each KOG within cluster
-        for seq in seqs:
-            kog = re.search('KOG\d{4}', seq).group()
-            try:
-                kog_counts[kog] += 1
-            except KeyError:
-                kog_counts[kog] = 1
-
-        # Print occurance of each KOG within cluster
-        out_line = ''
-        for k, v in sorted(kog_counts.iteritems()):
-            out_line += str(k)+':'+str(v)+'\t'
-        per_cluster_stats.write(out_line.rstrip()+'\n')
-
-        # Track number of clusters containing a certain number of KOGs
-        try:
-            kogs_per_cluster[len(kog_counts)] += 1
-        except KeyError:
-            kogs_per_cluster[len(kog_counts)] = 1
-
-        # Track number of KOGs spread across a certain number of clusters
-        for kog in kog_counts.keys():
-            try:
-                cluster_counts_by_kog[kog] += 1
-            except KeyError:
-                cluster_counts_by_kog[kog] = 1
-
-    per_cluster_stats.close()
-
-    # Transform per-KOG cluster counts
-    for count in cluster_counts_by_kog.itervalues():
-        try:
-            clusters_per_kog[count] += 1
-        except KeyError:
-            clusters_per_kog[count] = 1
+    kogs_per_cluster = np.bincount(kogs_in_cluster)
+    clusters_per_kog = np.bincount(clusters_of_kog[clusters_of_kog > 0])
 
     return kogs_per_cluster, clusters_per_kog
 
 
-def print_kpc(kpc_handle, kogs_per_cluster,
-              ordr, frag, ctof, norm, dmsn, mtrc, infl):
+def get_agreement_scores(contingency):
+    """Measure the agreement of a clustering with the KOGs
+
+    Every measure is computed from the cluster x KOG table: with n_ij the
+    number of members of KOG j in cluster i, a_i and b_j the cluster and KOG
+    sizes and N the number of sequences with a KOG, the number of pairs of
+    sequences sharing both a cluster and a KOG is sum(C(n_ij, 2)), and so
+    on. The cost is linear in the number of non-zero entries of the table.
+
+    1) Pairwise precision, recall and F1 score: Of the pairs of sequences
+        sharing a cluster, the fraction sharing a KOG (precision), and of the
+        pairs sharing a KOG, the fraction sharing a cluster (recall).
+
+    2) Adjusted Rand index: The fraction of pairs on which the clustering
+        and the KOGs agree, corrected for chance, so that random clusterings
+        score about 0 and a perfect one scores 1.
+
+    3) Normalized mutual information: The mutual information of the cluster
+        and KOG of a sequence, divided by the mean of their entropies.
+
+    Sequences without a KOG are left out, and so are clusters without any
+    sequence with a KOG.
+
+    Parameters
+    ----------
+    contingency : tuple
+        As returned by get_contingency_table()
+
+    Returns
+    -------
+    tuple
+        The values of SCORE_COLUMNS; measures that are undefined (eg.
+        precision when no two sequences share a cluster) are NaN
     """
+    n_clusters, pair_clusters, pair_ranks, pair_counts = contingency
+
+    cluster_sizes = np.bincount(pair_clusters, weights=pair_counts)
+    cluster_sizes = cluster_sizes[cluster_sizes > 0]
+    kog_sizes = np.bincount(pair_ranks, weights=pair_counts)
+    kog_sizes = kog_sizes[kog_sizes > 0]
+    n_seqs = float(pair_counts.sum())
+
+    # Numbers of pairs of sequences sharing a cluster and/or a KOG
+    both_pairs = _count_pairs(pair_counts)
+    cluster_pairs = _count_pairs(cluster_sizes)
+    kog_pairs = _count_pairs(kog_sizes)
+    all_pairs = n_seqs * (n_seqs - 1) / 2
+
+    precision = _divide(both_pairs, cluster_pairs)
+    recall = _divide(both_pairs, kog_pairs)
+    if precision + recall == 0:
+        f1 = 0.0
+    else:
+        f1 = _divide(2 * precision * recall, precision + recall)
+
+    expected = cluster_pairs * kog_pairs / all_pairs if all_pairs else 0.0
+    maximum = (cluster_pairs + kog_pairs) / 2
+    if maximum == expected:  # Only possible when they agree completely
+        ari = 1.0 if n_seqs else float('nan')
+    else:
+        ari = (both_pairs - expected) / (maximum - expected)
+
+    if n_seqs:
+        cluster_entropy = _entropy(cluster_sizes, n_seqs)
+        kog_entropy = _entropy(kog_sizes, n_seqs)
+        joint_entropy = _entropy(pair_counts, n_seqs)
+        mutual_info = cluster_entropy + kog_entropy - joint_entropy
+        if cluster_entropy + kog_entropy > 0:
+            nmi = 2 * mutual_info / (cluster_entropy + kog_entropy)
+        else:  # One cluster and one KOG
+            nmi = 1.0
+    else:
+        nmi = float('nan')
+
+    return (int(n_seqs), n_clusters, len(kog_sizes), precision, recall, f1,
+            ari, nmi)
+
+
+def _count_pairs(sizes):
+    """Number of unordered pairs within groups of the given sizes"""
+    sizes = np.asarray(sizes, dtype=np.float64)
+    return float((sizes * (sizes - 1) / 2).sum())
+
+
+def _entropy(sizes, total):
+    """Entropy (in nats) of groups of the given sizes out of total"""
+    probs = np.asarray(sizes, dtype=np.float64) / total
+    return float(-(probs * np.log(probs)).sum())
+
+
+def _divide(numerator, denominator):
+    """Divide, returning NaN for a zero (or NaN) denominator"""
+    if not denominator:
+        return float('nan')
+    return numerator / denominator
+
+
+def print_histogram(summary_handle, measure, histogram, mcl_properties):
+    """Print a row for every non-empty bin of a histogram
     """
-    for kog_count in sorted(kogs_per_cluster.keys()):
-        out_line = "{0}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\n".format(
-                   ordr, frag, ctof, norm, dmsn, mtrc, infl, kog_count,
-                   kogs_per_cluster[kog_count])
-        kpc_handle.write(out_line)
+    prefix = '\t'.join(str(value) for value in mcl_properties)
+    summary_handle.write(''.join(
+        "{0}\t{1}\t{2}\t{3}\n".format(prefix, measure, value, count)
+        for value, count in enumerate(histogram.tolist()) if count))
 
 
-def print_cpk(cpk_handle, clusters_per_kog,
-              ordr, frag, ctof, norm, dmsn, mtrc, infl):
+def print_scores(scores_handle, scores, mcl_properties):
+    """Print the agreement scores of a clustering as one row; NaN is printed
+    as NA for R
     """
+    scores_handle.write('\t'.join(
+        [str(value) for value in mcl_properties] +
+        ['NA' if value != value else str(value) for value in scores]) + '\n')
+
+
+def print_cluster_kogs(kogs_handle, mcl_name, pair_clusters, pair_labels,
+                       pair_counts):
+    """Print the number of members of each KOG in each cluster
     """
-    for cluster_count in sorted(clusters_per_kog.keys()):
-        out_line = "{0}\t{1}\t{2}\t{3}\t{4}\t{5}\t{6}\t{7}\t{8}\n".format(
-                   ordr, frag, ctof, norm, dmsn, mtrc, infl, cluster_count,
-                   clusters_per_kog[cluster_count])
-        cpk_handle.write(out_line)
+    kogs_handle.write(''.join(
+        "{0}\t{1}\t{2}\t{3}\n".format(mcl_name, cluster, label, count)
+        for cluster, label, count in zip(pair_clusters.tolist(), pair_labels,
+                                         pair_counts.tolist())))
 
 
 if __name__ == "__main__":
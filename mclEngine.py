@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+Markov Clustering (MCL) on scipy.sparse matrices.
+
+The external mcl program has to be started, and has to load the graph, once
+for every inflation value. This module runs the expansion, inflation, pruning
+and convergence loop in-process so that a whole sweep of inflation values can
+be computed from a graph that is already in memory, spread across a pool of
+worker processes. Clusterings are written one cluster per line, with the
+tab-separated labels of its members, exactly like mcl's labelled output.
+"""
+
+import multiprocessing
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from compressedFiles import open_output
+
+
+def build_matrix(src, dst, weights, n_nodes):
+    """Build a symmetric sparse adjacency matrix from an undirected edge list
+
+    Args:
+        src, dst: Arrays of node indices for both ends of each edge
+        weights: An array of edge weights
+        n_nodes: Number of nodes
+
+    Returns:
+        A scipy.sparse CSC matrix
+    """
+    rows = np.concatenate((src, dst))
+    cols = np.concatenate((dst, src))
+    vals = np.concatenate((weights, weights)).astype(np.float64)
+
+    return sparse.csc_matrix((vals, (rows, cols)), shape=(n_nodes, n_nodes))
+
+
+def add_self_loops(matrix):
+    """Add a loop to every node weighted by its heaviest edge (as mcl does)
+    """
+    matrix = sparse.csc_matrix(matrix)
+    loops = np.asarray(matrix.max(axis=0).todense()).ravel()
+    loops[loops == 0] = 1.0  # Singletons keep all of their flow
+
+    return sparse.csc_matrix(matrix + sparse.diags(loops, format='csc'))
+
+
+def normalize_columns(matrix):
+    """Scale each column of a CSC matrix to sum to one, in place"""
+    col_sums = np.asarray(matrix.sum(axis=0)).ravel()
+    col_sums[col_sums == 0] = 1.0
+    matrix.data /= np.repeat(col_sums, np.diff(matrix.indptr))
+
+    return matrix
+
+
+def prune(matrix, threshold):
+    """Drop entries smaller than threshold from a CSC matrix, in place"""
+    matrix.data[matrix.data < threshold] = 0
+    matrix.eliminate_zeros()
+
+    return matrix
+
+
+def mcl(matrix, inflation, expansion=2, prune_threshold=1e-4, max_iter=100,
+        tol=1e-6):
+    """Run MCL until the flow matrix converges
+
+    Args:
+        matrix: A symmetric scipy.sparse adjacency matrix (without loops)
+        inflation: The inflation parameter (mcl -I)
+        expansion: The expansion power (mcl -e)
+        prune_threshold: Entries below this value are set to zero after each
+            expansion (similar to mcl -P 10000)
+        max_iter: Maximum number of expansion/inflation rounds
+        tol: Largest change in any entry for the matrix to count as converged
+
+    Returns:
+        The converged flow matrix in CSC format
+    """
+    flow = normalize_columns(add_self_loops(matrix))
+
+    for i in range(max_iter):
+        last = flow
+
+        # Expansion
+        for j in range(expansion-1):
+            flow = flow.dot(last)
+        flow = sparse.csc_matrix(flow)
+
+        # Inflation
+        flow = prune(flow, prune_threshold)
+        flow.data **= inflation
+        flow = normalize_columns(flow)
+
+        if abs(flow - last).max() < tol:
+            break
+
+    return flow
+
+
+def get_clusters(flow):
+    """Interpret a converged flow matrix as a list of clusters
+
+    Each node is clustered with the attractors its flow ends up in, so the
+    clusters are the weakly connected components of the converged matrix.
+
+    Returns:
+        A list of lists of node indices, largest clusters first (as mcl
+            orders them)
+    """
+    n_comp, labels = connected_components(flow, directed=True,
+                                          connection='weak')
+    order = np.argsort(labels, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(labels[order])) + 1
+    clusters = [c.tolist() for c in np.split(order, bounds)]
+
+    # Largest first, ties broken by the smallest member index
+    clusters.sort(key=lambda c: (-len(c), c[0]))
+
+    return clusters
+
+
+def write_clusters(clusters, labels, out_path, compress=None):
+    """Write clusters one per line, members separated by tabs
+
+    The file is compressed if compress names a format ('gz', 'bz2', 'zst').
+    """
+    handle = open_output(out_path, 'w', compress=compress)
+    for cluster in clusters:
+        handle.write('\t'.join(labels[i] for i in cluster))
+        handle.write('\n')
+    handle.close()
+
+
+# Graphs shared with the worker processes of run_inflation_sweep()
+_sweep_graphs = dict()
+_sweep_compress = None
+
+
+def _init_sweep_worker(graphs, compress=None):
+    global _sweep_graphs, _sweep_compress
+    _sweep_graphs = graphs
+    _sweep_compress = compress
+
+
+def _run_sweep_task(task):
+    graph_name, inflation, out_path = task
+    matrix, labels, mcl_opts = _sweep_graphs[graph_name]
+    flow = mcl(matrix, inflation, **mcl_opts)
+    write_clusters(get_clusters(flow), labels, out_path,
+                   compress=_sweep_compress)
+
+    return out_path
+
+
+def run_inflation_sweep(graphs, tasks, processes=1, compress=None):
+    """Cluster several graphs at several inflation values
+
+    Each graph is sent to every worker process only once.
+
+    Args:
+        graphs: A dict keyed by graph name with (matrix, labels, mcl_opts)
+            tuples as values, where mcl_opts is a dict of keyword arguments
+            for mcl()
+        tasks: A list of (graph_name, inflation, out_path) tuples
+        processes: Number of worker processes
+        compress: Compression format for the clustering files, or None
+
+    Returns:
+        A list of the clustering files written, in the order of tasks
+    """
+    if processes <= 1:
+        _init_sweep_worker(graphs, compress)
+        return [_run_sweep_task(task) for task in tasks]
+
+    pool = multiprocessing.Pool(processes=processes,
+                                initializer=_init_sweep_worker,
+                                initargs=(graphs, compress))
+    try:
+        return pool.map(_run_sweep_task, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
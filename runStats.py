@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+"""
+Timings, counters and progress reports for long blast2graphs.py runs.
+
+A RunStats object is handed to each stage of the program. Stages are timed
+with the stage() context manager, which also records the peak resident set
+size at the end of the stage and can wrap the stage in cProfile. Counters
+(lines, hits, edge inserts and replacements, ...) are added with count(), and
+progress through the BLAST file is reported to stderr on a byte offset basis
+at most once per reporting interval. The collected statistics can be printed
+as a table or saved as JSON.
+"""
+
+import sys
+import json
+import time
+import platform
+from collections import OrderedDict
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class RunStats(object):
+    """Per-stage timings and counters for one run
+
+    Args:
+        progress: Report progress to stderr while reading the BLAST file
+        interval: Minimum number of seconds between progress reports
+        cprofile: Names of the stages to run under cProfile
+        prof_pref: Prefix for the cProfile output files, which are written
+            to <prof_pref>.<stage>.prof
+        handle: Where progress reports and the summary are written
+    """
+
+    def __init__(self, progress=False, interval=10.0, cprofile=None,
+                 prof_pref='blast2graphs', handle=sys.stderr):
+        self.stages = OrderedDict()
+        self.counts = OrderedDict()
+        self.progress = progress
+        self.interval = interval
+        self.cprofile = set(cprofile or ())
+        self.prof_pref = prof_pref
+        self.handle = handle
+        self.start = time.time()
+        self._last_report = self.start
+
+    @contextmanager
+    def stage(self, name, label=None):
+        """Time a stage of the program
+
+        Yields a dict to which the stage may add its own fields, eg. 'rows'
+        (for the throughput in rows per second) or 'bytes' (for MB/s).
+
+        Args:
+            name: Name of the stage
+            label: Distinguishes repeated runs of a stage (eg. the E-value
+                cutoff), which are recorded as <name>_<label>
+        """
+        record = OrderedDict()
+        profiler = None
+        cprofile = name in self.cprofile
+        if label is not None:
+            name = '{0}_{1}'.format(name, label)
+        if cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        beg = time.time()
+        try:
+            yield record
+        finally:
+            wall = time.time() - beg
+            if profiler is not None:
+                profiler.disable()
+                record['cprofile'] = '{0}.{1}.prof'.format(self.prof_pref,
+                                                          name)
+                profiler.dump_stats(record['cprofile'])
+
+            record['wall_s'] = wall
+            record['peak_rss_mb'] = get_peak_rss_mb()
+            if wall > 0:
+                if record.get('rows'):
+                    record['rows_per_s'] = record['rows'] / wall
+                if record.get('bytes'):
+                    record['mb_per_s'] = record['bytes'] / 1048576.0 / wall
+            self.stages[name] = record
+
+            if self.progress:
+                self.handle.write("[{0:9.1f}s] {1} done in {2:.2f}s\n".format(
+                    time.time() - self.start, name, wall))
+
+    def count(self, name, n=1):
+        """Add n to a counter"""
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def update(self, counts):
+        """Add every counter in a dict (eg. from a worker process)"""
+        for name, n in counts.items():
+            self.count(name, n)
+
+    def report_progress(self, done, total=None, what='BLAST file'):
+        """Report how many bytes have been read, if enough time has passed
+
+        Args:
+            done: Number of bytes processed so far
+            total: Total number of bytes, if known
+            what: Description of the input being read
+        """
+        if not self.progress:
+            return
+        now = time.time()
+        if now - self._last_report < self.interval:
+            return
+        self._last_report = now
+
+        elapsed = now - self.start
+        msg = "[{0:9.1f}s] {1}: {2:.1f} MB".format(elapsed, what,
+                                                  done / 1048576.0)
+        if total:
+            msg += " of {0:.1f} MB ({1:.1f}%)".format(total / 1048576.0,
+                                                      100.0 * done / total)
+        self.handle.write(msg + ", {0} lines\n".format(
+            self.counts.get('lines', 0)))
+
+    def summary(self):
+        """Collect all statistics in a JSON-serializable dict"""
+        return OrderedDict([
+            ('wall_s', time.time() - self.start),
+            ('peak_rss_mb', get_peak_rss_mb()),
+            ('peak_rss_children_mb', get_peak_rss_mb(children=True)),
+            ('python', platform.python_version()),
+            ('counts', self.counts),
+            ('stages', self.stages)])
+
+    def write_json(self, path):
+        """Save the statistics as a JSON file"""
+        handle = open(path, 'w')
+        json.dump(self.summary(), handle, indent=2)
+        handle.write('\n')
+        handle.close()
+
+    def print_summary(self):
+        """Print a table of stage timings followed by the counters"""
+        handle = self.handle
+        handle.write("{0:<20}{1:>10}{2:>12}{3:>14}{4:>10}{5:>10}\n".format(
+            'stage', 'wall_s', 'rows', 'rows/s', 'MB/s', 'peak_MB'))
+        for name, record in self.stages.items():
+            handle.write(
+                "{0:<20}{1:>10.2f}{2:>12}{3:>14}{4:>10}{5:>10}\n".format(
+                    name, record['wall_s'], format_value(record.get('rows')),
+                    format_value(record.get('rows_per_s'), '.0f'),
+                    format_value(record.get('mb_per_s'), '.1f'),
+                    format_value(record['peak_rss_mb'], '.1f')))
+        for name, n in self.counts.items():
+            handle.write("{0:<30}{1:>12}\n".format(name, n))
+
+
+def format_value(value, spec=''):
+    """Format a number for the summary table, or '-' if it is missing"""
+    if value is None:
+        return '-'
+    return format(value, spec)
+
+
+def get_peak_rss_mb(children=False):
+    """Peak resident set size in megabytes (None if it can not be measured)
+
+    Args:
+        children: Report the largest peak among finished child processes
+            (eg. the --workers pool) instead of this process
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':  # Bytes on macOS, kilobytes elsewhere
+        return peak / 1048576.0
+    return peak / 1024.0